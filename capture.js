@@ -0,0 +1,131 @@
+const { spawn } = require('child_process');
+const path = require('path');
+
+// Frame capture: rendered frames arrive as binary socket messages and are piped
+// straight into one long-running ffmpeg process, instead of one PNG file per frame.
+const captureDefaults = {
+  ffmpeg: process.env.FFMPEG || 'ffmpeg',
+  queueFrames: 120, // Frames waiting for the encoder before new ones are dropped
+  crf: 18,
+  preset: 'medium',
+};
+
+// Frame input formats: raw RGBA pixels as read with gl.readPixels (bottom row first),
+// or encoded images such as canvas.toBlob() PNGs
+const captureInputs = {
+  rgba: (options) => ['-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', `${options.width}x${options.height}`,
+    '-framerate', String(options.fps), '-i', 'pipe:0', '-vf', 'vflip'],
+  png: (options) => ['-f', 'image2pipe', '-c:v', 'png', '-framerate', String(options.fps), '-i', 'pipe:0'],
+};
+
+class Capture {
+  constructor(folder, options, settings = captureDefaults) {
+    const width = options.width | 0;
+    const height = options.height | 0;
+    const fps = Number(options.fps) || 24;
+    const format = options.format in captureInputs ? options.format : 'rgba';
+    if (format == 'rgba' && (width <= 0 || height <= 0)) {
+      throw new Error('Raw frame capture needs the frame width and height');
+    }
+    this.options = { width, height, fps, format };
+    this.settings = settings;
+    this.frameBytes = format == 'rgba' ? width * height * 4 : 0;
+    // Output name only, always inside the capture folder
+    this.file = path.join(folder, path.basename(String(options.output || `capture-${Date.now()}.mp4`)));
+
+    this.queue = [];
+    this.blocked = false;
+    this.ending = false;
+    this.lastFrame = -1;
+    this.lastData = null;
+    this.stats = { received: 0, written: 0, dropped: 0, repeated: 0, latencyTotal: 0, latencyMax: 0 };
+
+    this.encoder = spawn(settings.ffmpeg, ['-y', '-loglevel', 'error', ...captureInputs[format](this.options),
+      '-c:v', 'libx264', '-preset', settings.preset, '-crf', String(settings.crf), '-pix_fmt', 'yuv420p', this.file],
+      { stdio: ['pipe', 'ignore', 'inherit'] });
+    this.closed = new Promise((resolve) => {
+      this.encoder.on('error', (error) => {
+        console.log(`Capture encoder failed to start: ${error.message}`);
+        resolve(null);
+      });
+      this.encoder.on('close', (code) => resolve(code));
+    });
+    this.encoder.stdin.on('drain', () => {
+      this.blocked = false;
+      this.pump();
+    });
+    this.encoder.stdin.on('error', () => {
+      // Encoder exited: nothing more can be written
+      this.blocked = true;
+      this.queue = [];
+    });
+  }
+
+  // Queue a frame for the encoder. Frames that are late, out of order, the wrong size
+  // or don't fit the queue are dropped; frames skipped by the sender are filled with
+  // copies of the previous one, so the video keeps its timing. Returns whether it was queued.
+  push(frame, data) {
+    this.stats.received++;
+    if (this.ending || !Number.isInteger(frame) || frame <= this.lastFrame
+      || (this.frameBytes && data.length != this.frameBytes)) {
+      this.stats.dropped++;
+      return false;
+    }
+    if (this.queue.length >= this.settings.queueFrames) {
+      // The encoder is behind; a later frame fills this one's gap
+      this.stats.dropped++;
+      return false;
+    }
+
+    const arrived = process.hrtime.bigint();
+    const gap = this.lastData ? Math.min(frame - this.lastFrame - 1, this.settings.queueFrames - this.queue.length - 1) : 0;
+    for (let i = 0; i < gap; i++) {
+      this.queue.push({ data: this.lastData, arrived });
+    }
+    this.stats.repeated += gap;
+    this.queue.push({ data, arrived });
+    this.lastFrame = frame;
+    this.lastData = data;
+    this.pump();
+    return true;
+  }
+
+  pump() {
+    while (this.queue.length && !this.blocked) {
+      const item = this.queue.shift();
+      // write() returns false once the pipe is full; wait for 'drain' before writing more
+      this.blocked = !this.encoder.stdin.write(item.data, (error) => {
+        if (error) return;
+        const latency = Number(process.hrtime.bigint() - item.arrived) / 1e6;
+        this.stats.written++;
+        this.stats.latencyTotal += latency;
+        this.stats.latencyMax = Math.max(this.stats.latencyMax, latency);
+      });
+    }
+    if (this.ending && !this.queue.length && !this.encoder.stdin.writableEnded) {
+      this.encoder.stdin.end();
+    }
+  }
+
+  // Counters: frames received, written to the encoder, dropped and repeated,
+  // and the average and largest milliseconds from arrival to the encoder
+  summary() {
+    const { received, written, dropped, repeated, latencyTotal, latencyMax } = this.stats;
+    return {
+      file: this.file, queued: this.queue.length, received, written, dropped, repeated,
+      latencyAverage: written ? latencyTotal / written : 0, latencyMax,
+    };
+  }
+
+  // Write the queued frames, close the encoder's input and wait for it to finish the file
+  async finish() {
+    if (!this.ending) {
+      this.ending = true;
+      this.pump();
+    }
+    const code = await this.closed;
+    return { ...this.summary(), exitCode: code };
+  }
+}
+
+module.exports = { Capture, captureDefaults };
@@ -1,13 +1,51 @@
 const express = require('express');
 const app = express();
 const server = require('http').createServer(app);
-const io = require('socket.io')(server);
+// Raw captured frames are large (width x height x 4 bytes), so allow messages up to 64 MB.
+// The Vite dev server (port 3000) connects across origins for frame capture.
+const io = require('socket.io')(server, {
+  maxHttpBufferSize: 64 * 1024 * 1024,
+  cors: { origin: ['http://localhost:3000', 'http://127.0.0.1:3000'] },
+});
 const fs = require('fs');
+const path = require('path');
+const { Capture } = require('./capture.js');
 
 app.use(express.urlencoded({extended : true}));
 app.use(express.json());
 // Serve from dist in production, or public as fallback
 const staticDir = fs.existsSync(__dirname + '/dist') ? '/dist' : '/public';
+
+// Analysis data: serve the precompressed .br/.gz siblings written by the
+// processor when the browser accepts them. Requests versioned with ?v=<cache key>
+// never change, so they can be cached for good; others revalidate.
+const dataEncodings = [['br', '.br'], ['gzip', '.gz']];
+app.get(/\.data$/, function (req, res, next) {
+  const root = path.join(__dirname, staticDir);
+  let file;
+  try {
+    file = path.join(root, decodeURIComponent(req.path));
+  } catch (error) {
+    return next(); // Malformed URL, leave it to the static handler
+  }
+  if (!file.startsWith(root + path.sep)) return next();
+
+  res.set('Vary', 'Accept-Encoding');
+  res.set('Cache-Control', req.query.v ? 'public, max-age=31536000, immutable' : 'public, max-age=0, must-revalidate');
+  res.type('application/octet-stream');
+
+  // Byte ranges refer to the uncompressed file, so range requests get it as is
+  const [encoding, suffix] = (!req.headers.range && dataEncodings.find(([encoding, suffix]) =>
+    req.acceptsEncodings(encoding) && fs.existsSync(file + suffix))) || [null, ''];
+  if (encoding) res.set('Content-Encoding', encoding);
+  res.sendFile(file + suffix, { cacheControl: false }, (error) => {
+    if (error && !res.headersSent) {
+      res.removeHeader('Content-Encoding');
+      next();
+    }
+  });
+});
+
 app.use(express.static(__dirname + staticDir));
 server.listen(3001);
 console.log('Express server running on http://localhost:3001');
@@ -32,16 +70,61 @@ app.post('/config/save', function (req, res) {
 });
 
 io.on('connection', function (socket) {
+  // Legacy capture: one PNG file per frame, encoded later by hand
   socket.on('render-frame', function (data) {
     data.file = data.file.split(',')[1]; // Get rid of the data:image/png;base64 at the beginning of the file data
     var buffer = Buffer.from(data.file, 'base64');
-    fs.writeFile(__dirname + '/public/tmp/frame-' + data.frame + '.png', buffer.toString('binary'), 'binary', (error) => {
+    fs.writeFile(__dirname + '/public/tmp/frame-' + data.frame + '.png', buffer, (error) => {
       //console.log('error');
     });
   });
+
+  // Capture: binary frames piped straight into ffmpeg (see capture.js). Only for
+  // local clients, since it starts processes and writes files.
+  //   capture-start {width, height, fps, format: 'rgba' | 'png', output}, ack({file} or {error})
+  //   capture-frame frame number, binary data, ack({accepted, queued, dropped})
+  //   capture-end ack(counters)
+  const local = ['127.0.0.1', '::1', '::ffff:127.0.0.1'].includes(socket.handshake.address);
+  let capture = null;
+  const endCapture = async function () {
+    const ending = capture;
+    capture = null;
+    const summary = await ending.finish();
+    console.log('Capture finished:', summary);
+    return summary;
+  };
+
+  socket.on('capture-start', async function (options, ack = () => {}) {
+    if (!local) return ack({ error: 'Capture is only available to local clients' });
+    try {
+      if (capture) await endCapture();
+      fs.mkdirSync(__dirname + '/public/tmp', { recursive: true });
+      capture = new Capture(__dirname + '/public/tmp', options || {});
+      console.log(`Capturing to ${capture.file}`);
+      ack({ file: path.basename(capture.file) });
+    } catch (error) {
+      ack({ error: error.message });
+    }
+  });
+
+  socket.on('capture-frame', function (frame, data, ack = () => {}) {
+    if (!capture) return ack({ accepted: false });
+    const accepted = capture.push(frame, data);
+    const stats = capture.summary();
+    if (stats.received % (capture.options.fps * 10) == 0) console.log('Capture:', stats);
+    ack({ accepted, queued: stats.queued, dropped: stats.dropped });
+  });
+
+  socket.on('capture-end', async function (ack = () => {}) {
+    ack(capture ? await endCapture() : null);
+  });
+
+  socket.on('disconnect', function () {
+    if (capture) endCapture();
+  });
 });/**/
 
-//ffmpeg -r 60 -i /tmp/frame-%04d.png -vcodec libx264 -vpre lossless_slow -threads 0 output.mp4
+//Legacy PNG frames: ffmpeg -r 60 -i /tmp/frame-%04d.png -vcodec libx264 -vpre lossless_slow -threads 0 output.mp4
 
 //Max4Live Connection - song triggering, fx connection
 /*var osc = require('node-osc');
@@ -12,59 +12,110 @@ audio samples and extracts various features for visualization:
 
 The analysis works by:
 1. Splitting audio into chunks for efficient processing
-2. Processing each chunk through STFT and harmonic analysis
+2. Processing each chunk through STFT and harmonic analysis, either
+   sequentially or fanned out over a process pool
 3. Normalizing spectral data for consistent visualization
 4. Identifying non-quiet samples for clustering
 
+Results are returned as an AnalysisResult holding contiguous numpy arrays,
+which the clustering and export stages consume directly.
+
 Example usage:
-    stft_left, stft_right, harmonics, chunks, volumes, balances, widths, non_quiet = \
-        analysis('song.wav', 44100, 24, left_samples, right_samples)
+    result = analysis('song.wav', 44100, 24, WavSource('song.wav'))
+    result.stft.shape  # (frames, bins)
 """
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from typing import Any
 
-from worker_processor import worker_processor
+import numpy as np
+from numpy.typing import NDArray
+
+from analysis_plan import get_plan
+from audio_source import AudioSource
+from worker_processor import process_region, worker_processor
+
 
+# Volume below which a frame counts as quiet/silent and is left out of clustering
+NOISE_THRESHOLD: float = 0.0001
 
-# Type aliases for better readability
-STFTSamples = list[list[float]]
-HarmonicSamples = list[list[list[float]]]
-HarmonicChunks = list[list[list[list[float]]]]
+
+@dataclass
+class AnalysisResult:
+    """
+    Per-frame analysis features of a stereo stem.
+    
+    Every array has one row per output (fps) frame, except harmonics and
+    pitch, which follow the harmonic model's frame count and may be one
+    frame longer than the STFT data.
+    
+    Attributes:
+        stft: Normalized STFT magnitudes for the left channel, (frames, bins).
+        stft2: Normalized STFT magnitudes for the right channel, (frames, bins).
+        harmonics: Merged [frequencies, magnitudes] per frame, (frames, 2, nH).
+        pitch: Frequency of the first harmonic per frame in Hz.
+        volumes: Volume level for each frame.
+        balances: Stereo balance for each frame.
+        widths: Stereo width for each frame.
+        gains: Normalization gain applied to each left channel frame.
+        gains2: Normalization gain applied to each right channel frame.
+        maximums: Peak of each left channel frame before normalization.
+        maximums2: Peak of each right channel frame before normalization.
+        quiet: True for frames below the noise threshold.
+    """
+    stft: NDArray[np.float64]
+    stft2: NDArray[np.float64]
+    harmonics: NDArray[np.float64]
+    pitch: NDArray[np.float64]
+    volumes: NDArray[np.float64]
+    balances: NDArray[np.float64]
+    widths: NDArray[np.float64]
+    gains: NDArray[np.float64]
+    gains2: NDArray[np.float64]
+    maximums: NDArray[np.float64]
+    maximums2: NDArray[np.float64]
+    quiet: NDArray[np.bool_]
+    
+    def __len__(self) -> int:
+        """Number of STFT frames."""
+        return len(self.stft)
+    
+    @property
+    def nonquietsamples(self) -> NDArray[np.intp]:
+        """Indices of frames above the noise threshold."""
+        return np.flatnonzero(~self.quiet)
 
 
 def analysis(
     filename: str,
     fs: int,
     fps: int,
-    x: Any,
-    x2: Any
-) -> tuple[STFTSamples, STFTSamples, HarmonicSamples, HarmonicChunks, 
-           list[float], list[float], list[float], list[int]]:
+    source: AudioSource,
+    workers: int = 1
+) -> AnalysisResult:
     """
     Analyze audio samples and extract spectral features for visualization.
     
     Processes stereo audio data to extract STFT spectral data, harmonic
     information, volume levels, stereo balance, and width measurements.
-    Audio is processed in chunks for memory efficiency.
+    Audio is read from the source one chunk at a time, so only the chunks
+    being analyzed are held in memory.
     
     Args:
         filename: Name of the audio file being processed (for logging).
         fs: Sample rate of the audio in Hz (e.g., 44100).
         fps: Target frames per second for visualization output (e.g., 24).
-        x: Left channel audio samples as numpy array.
-        x2: Right channel audio samples as numpy array.
+        source: Stereo audio source (WavSource or ArraySource).
+        workers: Number of worker processes for chunk analysis. 1 (default)
+                 runs every chunk in this process. Results are merged in
+                 chunk order either way, so the output is identical.
     
     Returns:
-        A tuple containing:
-        - stftsamples_normalized: Normalized STFT data for left channel
-        - stftsamples_normalized2: Normalized STFT data for right channel
-        - harmonicsamples: Harmonic frequency and magnitude data
-        - harmonicchunks: Raw harmonic chunks before flattening
-        - volumes: Volume level for each frame
-        - balances: Stereo balance (-1 to 1) for each frame
-        - widths: Stereo width for each frame
-        - nonquietsamples: Indices of frames above noise threshold
+        AnalysisResult with normalized STFT data for both channels, harmonic
+        data, pitch, volume, balance and width per frame, the normalization
+        gains and maximums, and the quiet frame mask.
     
     Raises:
         ValueError: If audio samples are empty or sample rate is invalid.
@@ -72,10 +123,11 @@ def analysis(
     Example:
         >>> fs = 44100
         >>> fps = 24
-        >>> stft_l, stft_r, harm, chunks, vol, bal, wid, nq = \
-        ...     analysis('test.wav', fs, fps, left_audio, right_audio)
+        >>> result = analysis('test.wav', fs, fps, ArraySource(left_audio, right_audio))
+        >>> result.stft.shape[0] == len(result.volumes)
+        True
     """
-    if len(x) == 0 or len(x2) == 0:
+    if len(source) == 0:
         raise ValueError("Audio samples cannot be empty")
     
     if fs <= 0:
@@ -84,123 +136,125 @@ def analysis(
     if fps <= 0:
         raise ValueError(f"FPS must be positive, got {fps}")
     
-    totallen: int = len(x)
-    chunkseconds: int = 2  # Process 2 seconds at a time
+    if workers <= 0:
+        raise ValueError(f"workers must be positive, got {workers}")
     
-    chunklen: int = fs * chunkseconds
+    totallen: int = len(source)
+    chunklen: int = get_plan(fs, fps).chunklen
     chunkcount: int = totallen // chunklen
     lastlen: int = totallen - (chunkcount * chunklen)
     
     # Initialize result dictionaries for collecting chunk outputs
-    return_dict_stft: dict[int, list[list[float]]] = {}
-    return_dict_stft2: dict[int, list[list[float]]] = {}
-    return_dict_harmonic: dict[int, list[list[list[float]]]] = {}
+    return_dict_stft: dict[int, NDArray[np.float64]] = {}
+    return_dict_stft2: dict[int, NDArray[np.float64]] = {}
+    return_dict_harmonic: dict[int, NDArray[np.float64]] = {}
     return_dict_resid: dict[int, Any] = {}  # Reserved for residual analysis
-    return_dict_volume: dict[int, list[float]] = {}
-    return_dict_balance: dict[int, list[float]] = {}
-    return_dict_width: dict[int, list[float]] = {}
-    
-    # Process all chunks sequentially
-    for i in range(chunkcount):
-        worker_processor(
-            filename, fs, fps, x, x2, i, chunkcount, chunklen, totallen,
-            return_dict_stft, return_dict_stft2, return_dict_harmonic,
-            return_dict_resid, return_dict_volume, return_dict_balance, return_dict_width
-        )
-    
-    # Process last bit (remaining samples that don't fill a complete chunk)
-    if lastlen > 0:
-        worker_processor(
-            filename, fs, fps, x, x2, chunkcount, chunkcount, chunklen, totallen,
-            return_dict_stft, return_dict_stft2, return_dict_harmonic,
-            return_dict_resid, return_dict_volume, return_dict_balance, return_dict_width
-        )
-    
-    # Collect and flatten chunk results
-    stftchunks: list[list[list[float]]] = list(return_dict_stft.values())
-    stftchunks2: list[list[list[float]]] = list(return_dict_stft2.values())
-    harmonicchunks: HarmonicChunks = list(return_dict_harmonic.values())
-    volumechunks: list[list[float]] = list(return_dict_volume.values())
-    balancechunks: list[list[float]] = list(return_dict_balance.values())
-    widthchunks: list[list[float]] = list(return_dict_width.values())
-    
-    # Convert chunks into single flattened arrays
-    stftsamples: list[list[float]] = []
-    stftsamples2: list[list[float]] = []
-    volumes: list[float] = []
-    balances: list[float] = []
-    widths: list[float] = []
-    
-    for i in range(len(stftchunks)):
-        stftsamples.extend(stftchunks[i])
-        stftsamples2.extend(stftchunks2[i])
-        volumes.extend(volumechunks[i])
-        balances.extend(balancechunks[i])
-        widths.extend(widthchunks[i])
-    
-    # Convert harmonic chunks into single multi-dim array
-    harmonicsamples: HarmonicSamples = []
-    for i in range(len(harmonicchunks)):
-        harmonicsamples.extend(harmonicchunks[i])
+    return_dict_volume: dict[int, NDArray[np.float64]] = {}
+    return_dict_balance: dict[int, NDArray[np.float64]] = {}
+    return_dict_width: dict[int, NDArray[np.float64]] = {}
     
-    # Normalize STFT samples for consistent visualization
-    # Each frame is normalized by its maximum value to bring all frames to [0,1] range
-    stftsamples_normalized: STFTSamples = []
-    stftsamples_normalized2: STFTSamples = []
-    gains: list[float] = []
-    gains2: list[float] = []
-    maximums: list[float] = []
-    maximums2: list[float] = []
-    
-    for i in range(len(stftsamples)):
-        # Find maximum value in this frame
-        maximum: float = 0.0
-        maximum2: float = 0.0
-        for j in range(len(stftsamples[i])):
-            if stftsamples[i][j] > maximum:
-                maximum = stftsamples[i][j]
-            if stftsamples2[i][j] > maximum2:
-                maximum2 = stftsamples2[i][j]
-        
-        # Calculate gain (inverse of maximum for normalization)
-        # Handle edge case where maximum is 0 to avoid division by zero
-        if maximum == 0:
-            maximum = 1e-10
-        if maximum2 == 0:
-            maximum2 = 1e-10
+    # Number of chunk jobs, including the trailing partial chunk
+    jobcount: int = chunkcount + 1 if lastlen > 0 else chunkcount
+    
+    if workers == 1 or jobcount <= 1:
+        # Process all chunks sequentially (the last one may be partial)
+        for i in range(jobcount):
+            worker_processor(
+                filename, fs, fps, source, i, chunkcount, chunklen, totallen,
+                return_dict_stft, return_dict_stft2, return_dict_harmonic,
+                return_dict_resid, return_dict_volume, return_dict_balance, return_dict_width
+            )
+    else:
+        # Fan chunks out over a process pool. Each job carries only its own
+        # region of the source (a path and range for WavSource); results are
+        # stored in chunk order so the dictionaries end up exactly as the
+        # sequential path leaves them.
+        with ProcessPoolExecutor(max_workers=min(workers, jobcount)) as pool:
+            futures = []
+            for i in range(jobcount):
+                chunkdelta = i * chunklen
+                futures.append(pool.submit(
+                    process_region, fs, fps,
+                    source.region(chunkdelta, chunklen + chunkdelta),
+                    chunklen
+                ))
             
-        gain: float = 1.0 / maximum
-        gain2: float = 1.0 / maximum2
-        gains.append(gain)
-        gains2.append(gain2)
-        maximums.append(maximum)
-        maximums2.append(maximum2)
-        
-        # Normalize values by multiplying by gain
-        normalized: list[float] = []
-        normalized2: list[float] = []
-        for j in range(len(stftsamples[i])):
-            normalized.append(stftsamples[i][j] * gain)
-            normalized2.append(stftsamples2[i][j] * gain2)
-        
-        stftsamples_normalized.append(normalized)
-        stftsamples_normalized2.append(normalized2)
-    
-    # Make list of samples that aren't noise to choose from
-    # Threshold of 0.0001 filters out quiet/silent frames
-    noise_threshold: float = 0.0001
-    nonquietsamples: list[int] = []
-    for i in range(len(volumes)):
-        if volumes[i] >= noise_threshold:
-            nonquietsamples.append(i)
-    
-    return (
-        stftsamples_normalized,
-        stftsamples_normalized2,
-        harmonicsamples,
-        harmonicchunks,
-        volumes,
-        balances,
-        widths,
-        nonquietsamples
+            for i, future in enumerate(futures):
+                (return_dict_stft[i], return_dict_stft2[i], return_dict_harmonic[i],
+                 return_dict_volume[i], return_dict_balance[i],
+                 return_dict_width[i]) = future.result()
+                print(f"{filename} worker {i}/{chunkcount}")
+    
+    # Concatenate chunk results in chunk order
+    order = range(jobcount)
+    stftsamples = np.concatenate([return_dict_stft[i] for i in order])
+    stftsamples2 = np.concatenate([return_dict_stft2[i] for i in order])
+    harmonicsamples = np.concatenate([return_dict_harmonic[i] for i in order])
+    volumes = np.concatenate([return_dict_volume[i] for i in order])
+    balances = np.concatenate([return_dict_balance[i] for i in order])
+    widths = np.concatenate([return_dict_width[i] for i in order])
+    
+    # Normalize STFT samples for consistent visualization
+    stftsamples_normalized, gains, maximums = normalize_frames(stftsamples)
+    stftsamples_normalized2, gains2, maximums2 = normalize_frames(stftsamples2)
+    
+    # Mark samples that are noise so clustering can skip them
+    quiet = _quiet_mask(volumes)
+    
+    return AnalysisResult(
+        stft=stftsamples_normalized,
+        stft2=stftsamples_normalized2,
+        harmonics=harmonicsamples,
+        pitch=np.ascontiguousarray(harmonicsamples[:, 0, 0]),
+        volumes=volumes,
+        balances=balances,
+        widths=widths,
+        gains=gains,
+        gains2=gains2,
+        maximums=maximums,
+        maximums2=maximums2,
+        quiet=quiet
     )
+
+
+def normalize_frames(
+    samples: NDArray[np.float64]
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Normalize every frame of a (frames, bins) matrix by its maximum.
+    
+    Brings all frames to the [0, 1] range. A frame's maximum is never taken
+    below 0, and an all-zero frame uses 1e-10 to avoid dividing by zero.
+    
+    Args:
+        samples: STFT magnitudes, shape (frames, bins).
+    
+    Returns:
+        Tuple of (normalized, gains, maximums), where gains = 1 / maximums.
+    """
+    if samples.size == 0:
+        maximums = np.zeros(len(samples))
+    else:
+        maximums = np.maximum(samples.max(axis=1), 0.0)
+    maximums[maximums == 0] = 1e-10
+    
+    gains = 1.0 / maximums
+    normalized = samples * gains[:, np.newaxis]
+    return normalized, gains, maximums
+
+
+def _quiet_mask(
+    volumes: NDArray[np.float64],
+    noise_threshold: float = NOISE_THRESHOLD
+) -> NDArray[np.bool_]:
+    """
+    Flag frames whose volume is below the noise threshold.
+    
+    Args:
+        volumes: Volume level for each frame.
+        noise_threshold: Frames quieter than this are considered silent.
+    
+    Returns:
+        Boolean array, True for quiet frames.
+    """
+    return volumes < noise_threshold
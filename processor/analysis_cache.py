@@ -0,0 +1,395 @@
+"""
+Content-addressed on-disk cache of stem analyses and their stage outputs.
+
+Analyzing a stem is by far the slowest step of the pipeline, and most
+re-runs only change a few stems or a few downstream settings.
+AnalysisCache stores:
+
+- the exported _analysis.* files of every stem (JSON, data file, data
+  segments and their precompressed copies)
+- intermediate stage artifacts as .npz files: the analysis arrays, the
+  k-means centroids and the vector quantization assignments
+
+Keys are content addresses. A stem's first key is the SHA-256 of its WAV
+file bytes plus the settings of the first stage; each later stage's key
+is derived from the previous key plus that stage's own settings
+(derive()). An unchanged stem is copied from the cache instead of being
+analyzed again, and changing e.g. only the clustering settings reuses the
+cached analysis and reruns clustering and export.
+
+Every lookup is appended to cache.log in the cache folder (one line per
+hit, miss, store or eviction), which keeps hit/miss statistics across runs
+and across the worker processes that analyze stems concurrently. Entries
+are evicted least-recently-used first once the cache grows past its size
+limit; entries a run still needs can be pinned to exempt them.
+
+Cache layout:
+    <root>/cache.log
+    <root>/<key[:2]>/<key>/analysis.json      (exported outputs)
+    <root>/<key[:2]>/<key>/analysis.data(.gz, .br)
+    <root>/<key[:2]>/<key>/analysis.NNNN.data(.gz, .br)
+    <root>/<key[:2]>/<key>/<stage>.npz        (stage artifacts)
+
+Example usage:
+    cache = AnalysisCache('/tmp/audiovis-cache', max_bytes=2 * 1024**3)
+    key = cache.key('stems/Song/Song Bass.wav', {'fps': 24})
+    if not cache.fetch(key, dest_folder, 'Song Bass.wav'):
+        ...  # analyze and export, then
+        cache.store(key, dest_folder, 'Song Bass.wav')
+    
+    clusterkey = cache.derive(key, {'centroidcount': 24})
+    arrays = cache.load_arrays(clusterkey, 'centroids')
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import fields, is_dataclass
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+from numpy.typing import NDArray
+
+
+# Bump when the cache layout or key scheme changes. Changes to a stage's
+# output belong in that stage's own settings (e.g. an export version).
+CACHE_VERSION: int = 1
+
+# Output files of a stem are named '{filename}_analysis.*' (the JSON, the
+# data file, its time segments and their precompressed copies)
+OUTPUT_PATTERN: str = 'analysis.*'
+
+# Output that every cached stem has
+OUTPUT_JSON: str = 'analysis.json'
+
+# Bytes read at a time when hashing audio files
+HASH_BLOCK_SIZE: int = 1 << 20
+
+
+class AnalysisCache:
+    """
+    Size-limited, content-addressed cache of stem analysis outputs.
+    
+    Safe to share between processes: entries are written to a temporary
+    folder and renamed into place, and a reader that loses an entry to a
+    concurrent eviction treats it as a miss.
+    
+    Args:
+        root: Cache folder (created if missing).
+        max_bytes: Total size of cached files above which the least
+                   recently used entries are evicted.
+    
+    Attributes:
+        root: Cache folder.
+        max_bytes: Size limit in bytes.
+        pinned: Keys of the entries evict() leaves alone (see pin()).
+    
+    Raises:
+        ValueError: If max_bytes is negative.
+    """
+    
+    def __init__(self, root: str | Path, max_bytes: int) -> None:
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must not be negative, got {max_bytes}")
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.pinned: set[str] = set()
+        self.root.mkdir(parents=True, exist_ok=True)
+    
+    def key(self, audio_path: str | Path, params: dict[str, Any]) -> str:
+        """
+        Compute the cache key of a stem.
+        
+        Args:
+            audio_path: Path to the stem's WAV file.
+            params: Every setting that affects the output. Dataclasses
+                    (such as an AnalysisPlan) are expanded field by field.
+        
+        Returns:
+            Hex SHA-256 digest of the file bytes, the parameters and
+            CACHE_VERSION.
+        """
+        digest = hashlib.sha256()
+        with open(audio_path, 'rb') as f:
+            while block := f.read(HASH_BLOCK_SIZE):
+                digest.update(block)
+        
+        settings = {'cache_version': CACHE_VERSION, **params}
+        digest.update(json.dumps(_canonical(settings), sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def derive(self, key: str, params: dict[str, Any]) -> str:
+        """
+        Compute the key of a later stage from the previous stage's key.
+        
+        Args:
+            key: Key of the stage this one consumes.
+            params: Settings of this stage only.
+        
+        Returns:
+            Hex SHA-256 digest of the parent key and the parameters.
+        """
+        settings = {'cache_version': CACHE_VERSION, 'parent': key, **params}
+        encoded = json.dumps(_canonical(settings), sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+    
+    def load_arrays(self, key: str, name: str, label: str = '-') -> dict[str, NDArray[Any]] | None:
+        """
+        Load a stage artifact.
+        
+        Args:
+            key: Stage key.
+            name: Artifact name (e.g. 'analysis', 'centroids').
+            label: What the artifact belongs to, for cache.log.
+        
+        Returns:
+            Dictionary of the stored arrays on a hit, None on a miss.
+        """
+        entry = self._entry(key)
+        try:
+            with np.load(entry / f'{name}.npz') as stored:
+                arrays = {field: stored[field] for field in stored.files}
+            os.utime(entry)
+        except (OSError, ValueError):
+            self._log('miss', key, f'{label} {name}')
+            return None
+        
+        self._log('hit', key, f'{label} {name}')
+        return arrays
+    
+    def save_arrays(
+        self,
+        key: str,
+        name: str,
+        arrays: dict[str, NDArray[Any]],
+        label: str = '-'
+    ) -> None:
+        """
+        Store a stage artifact as an uncompressed .npz file.
+        
+        Evicts least recently used entries afterwards if the cache is
+        over its size limit.
+        
+        Args:
+            key: Stage key.
+            name: Artifact name (e.g. 'analysis', 'centroids').
+            arrays: Arrays to store, by field name.
+            label: What the artifact belongs to, for cache.log.
+        """
+        entry = self._entry(key)
+        entry.mkdir(parents=True, exist_ok=True)
+        
+        # Write under a temporary name so readers never see a partial file
+        fd, staging = tempfile.mkstemp(prefix=f'.{name}-', suffix='.npz', dir=entry)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(staging, entry / f'{name}.npz')
+        finally:
+            if os.path.exists(staging):
+                os.unlink(staging)
+        
+        self._log('store', key, f'{label} {name}')
+        self.evict()
+    
+    def fetch(self, key: str, dest_folder: str | Path, filename: str) -> bool:
+        """
+        Copy a cached stem's output files into dest_folder.
+        
+        Outputs that already carry the key (see output_cache_key()) are
+        current and left alone; that also counts as a hit. Outputs the
+        entry doesn't have (e.g. a .br file when it was stored without the
+        brotli package) are removed, so no stale copy is left behind.
+        
+        Args:
+            key: Cache key from key().
+            dest_folder: Output folder of the stem.
+            filename: Stem filename the outputs are named after.
+        
+        Returns:
+            True on a hit (outputs current or copied), False on a miss.
+        """
+        entry = self._entry(key)
+        if output_cache_key(dest_folder, filename) == key:
+            if entry.exists():
+                os.utime(entry)
+            self._log('hit', key, filename)
+            return True
+        
+        try:
+            # The JSON is always present; data files are not written for
+            # stems that are entirely quiet
+            cached = [path.name for path in entry.glob(OUTPUT_PATTERN)]
+            if OUTPUT_JSON not in cached:
+                raise FileNotFoundError(entry)
+            for suffix, output in _outputs(dest_folder, filename).items():
+                if suffix not in cached:
+                    output.unlink()
+            for suffix in cached:
+                shutil.copyfile(entry / suffix, Path(dest_folder) / f'{filename}_{suffix}')
+            # Mark as recently used for eviction
+            os.utime(entry)
+        except OSError:
+            self._log('miss', key, filename)
+            return False
+        
+        self._log('hit', key, filename)
+        return True
+    
+    def store(self, key: str, dest_folder: str | Path, filename: str) -> None:
+        """
+        Add a stem's freshly exported output files to the cache.
+        
+        Evicts least recently used entries afterwards if the cache is
+        over its size limit.
+        
+        Args:
+            key: Cache key from key().
+            dest_folder: Output folder the files were written to.
+            filename: Stem filename the outputs are named after.
+        """
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        
+        staging = Path(tempfile.mkdtemp(prefix=f'.{key[:12]}-', dir=self.root))
+        try:
+            for suffix, output in _outputs(dest_folder, filename).items():
+                shutil.copyfile(output, staging / suffix)
+            try:
+                staging.rename(entry)
+            except OSError:
+                # Another process stored the same key first
+                return
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        
+        self._log('store', key, filename)
+        self.evict()
+    
+    def pin(self, keys: Iterable[str]) -> None:
+        """
+        Exempt entries from eviction until unpin().
+        
+        For stage artifacts a later pass of the same run reads back, such
+        as the analyses the shared codebook is trained on. Pins belong to
+        this object: a copy sent to a worker process keeps the pins it
+        had when it was sent.
+        
+        Args:
+            keys: Keys of the entries to keep.
+        """
+        self.pinned.update(keys)
+    
+    def unpin(self, keys: Iterable[str]) -> None:
+        """Make pinned entries evictable again."""
+        self.pinned.difference_update(keys)
+    
+    def evict(self) -> int:
+        """
+        Remove least recently used entries until the cache fits max_bytes.
+        
+        Pinned entries count towards the size but are never removed.
+        
+        Returns:
+            Number of entries removed.
+        """
+        entries = []
+        total = 0
+        for entry in self.root.glob('??/*'):
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except OSError:
+                continue  # Evicted by another process meanwhile
+            total += size
+        
+        removed = 0
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry.name in self.pinned:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            self._log('evict', entry.name, '-')
+            total -= size
+            removed += 1
+        return removed
+    
+    def stats(self, since: float = 0.0) -> dict[str, int]:
+        """
+        Count cache events recorded in cache.log.
+        
+        Args:
+            since: Only count events at or after this time.time() value,
+                   e.g. the start of the current run.
+        
+        Returns:
+            Dictionary with 'hit', 'miss', 'store' and 'evict' counts.
+        """
+        counts = {'hit': 0, 'miss': 0, 'store': 0, 'evict': 0}
+        try:
+            with open(self.root / 'cache.log', encoding='utf-8') as log:
+                for line in log:
+                    parts = line.split(' ', 2)
+                    if len(parts) == 3 and float(parts[0]) >= since and parts[1] in counts:
+                        counts[parts[1]] += 1
+        except FileNotFoundError:
+            pass
+        return counts
+    
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+    
+    def _log(self, event: str, key: str, filename: str) -> None:
+        # Single short appends, so concurrent writers don't interleave lines
+        with open(self.root / 'cache.log', 'a', encoding='utf-8') as log:
+            log.write(f"{time.time():.3f} {event} {key} {filename}\n")
+
+
+def output_cache_key(dest_folder: str | Path, filename: str) -> str | None:
+    """
+    Read the cache key recorded in a stem's exported JSON.
+    
+    Comparing it with the key of the current audio and parameters tells
+    whether existing outputs are stale.
+    
+    Args:
+        dest_folder: Output folder of the stem.
+        filename: Stem filename.
+    
+    Returns:
+        The recorded key, or None if there is no readable output JSON or it
+        predates the cache.
+    """
+    json_path = Path(dest_folder) / f'{filename}_analysis.json'
+    try:
+        with open(json_path, encoding='utf-8') as f:
+            return json.load(f).get('track', {}).get('cache_key')
+    except (OSError, ValueError):
+        return None
+
+
+def _outputs(dest_folder: str | Path, filename: str) -> dict[str, Path]:
+    """Output files of a stem in dest_folder, by suffix after '{filename}_'."""
+    pattern = f'{glob.escape(filename)}_{OUTPUT_PATTERN}'
+    return {path.name[len(filename) + 1:]: path for path in Path(dest_folder).glob(pattern)}
+
+
+def _canonical(value: Any) -> Any:
+    """Convert parameters to JSON-serializable values for hashing."""
+    if is_dataclass(value) and not isinstance(value, type):
+        return {
+            f.name: _canonical(getattr(value, f.name))
+            for f in fields(value) if f.compare
+        }
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
@@ -0,0 +1,384 @@
+"""
+Binary layout of the _analysis.data files.
+
+Version 1 files are a headerless run of uint16 values; their layout is
+described only by the 'structure' dict of the sibling JSON. Version 2
+and later files describe themselves:
+
+    header   16 bytes   magic b'AVIS', format version (uint16), byte
+                        order mark 0xFEFF (uint16), section count
+                        (uint32), reserved (uint32)
+    table    32 bytes   per section: name (16 bytes, NUL padded), byte
+                        offset (uint32), element count (uint32), element
+                        type code (uint8: 1 = uint8, 2 = uint16), flags
+                        (uint8, version 3), reserved (6 bytes)
+    sections            each starting at a multiple of SECTION_ALIGNMENT
+
+All fields are little-endian. Since sections are aligned and stored in
+their own element type, a reader can view each one in place (e.g. as a
+JavaScript typed array over the fetched buffer) without copying.
+
+In version 3, a section with the FLAG_DELTA flag stores each element as
+its difference from the previous one, wrapping around in the section's
+integer type; readers restore it with a running sum, in place.
+encode_deltas() sets the flag on the sections that compress better that
+way. write_precompressed() writes the file along with gzip and (when the
+optional brotli package is installed) brotli compressed siblings for
+static serving.
+
+A song bundle packs many files (e.g. all stems' JSON and data files) into
+one, so a client can fetch them in a single request or by byte range:
+
+    header   16 bytes   magic b'AVSB', bundle version (uint16), byte order
+                        mark 0xFEFF (uint16), manifest length (uint32),
+                        reserved (uint32)
+    manifest            UTF-8 JSON {"files": {name: [offset, length]}},
+                        offsets relative to the end of the manifest
+                        (rounded up to SECTION_ALIGNMENT)
+    files               each starting at a multiple of SECTION_ALIGNMENT
+
+Example usage:
+    buffer, views = allocate_sections([('volume', np.uint16, 100),
+                                       ('centroid_indexes', np.uint8, 100)])
+    views['volume'][:] = volumes
+    views['centroid_indexes'][:] = indexes
+    buffer.tofile(path)
+    
+    encode_deltas(buffer)
+    write_precompressed(path, buffer)
+    
+    sections = read_sections(np.fromfile(path, dtype=np.uint8))
+    
+    bundle = pack_bundle({'a.json': b'{}', 'a.data': buffer})
+    files = read_bundle(bundle)
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import zlib
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+try:
+    import brotli
+except ImportError:  # Listed in requirements.txt; .br siblings are skipped without it
+    brotli = None
+
+
+# File signature of version 2 and later files
+ANALYSIS_MAGIC: bytes = b'AVIS'
+
+# Current format version (1 is the headerless uint16 layout)
+ANALYSIS_FORMAT_VERSION: int = 3
+
+# Versions read_sections() understands (2 has no section flags)
+READABLE_VERSIONS: tuple[int, ...] = (2, 3)
+
+# Section flag: elements are stored as differences from the previous one
+FLAG_DELTA: int = 1
+
+# Compression of the precompressed siblings (maximum; they are written once
+# and served many times)
+GZIP_LEVEL: int = 9
+BROTLI_QUALITY: int = 11
+
+# Precompressed sibling suffixes, appended to the file name
+PRECOMPRESSED_SUFFIXES: tuple[str, ...] = ('.br', '.gz')
+
+# Written as uint16; reads back as 0xFFFE with the wrong byte order
+BYTE_ORDER_MARK: int = 0xFEFF
+
+# Byte alignment of every section's start
+SECTION_ALIGNMENT: int = 8
+
+# File signature and version of song bundles
+BUNDLE_MAGIC: bytes = b'AVSB'
+BUNDLE_FORMAT_VERSION: int = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u2'),
+    ('byteorder', '<u2'),
+    ('sections', '<u4'),
+    ('reserved', '<u4'),
+])
+
+SECTION_DTYPE = np.dtype([
+    ('name', 'S16'),
+    ('offset', '<u4'),
+    ('count', '<u4'),
+    ('dtype', 'u1'),
+    ('flags', 'u1'),
+    ('reserved', 'V6'),
+])
+
+BUNDLE_HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u2'),
+    ('byteorder', '<u2'),
+    ('manifest', '<u4'),
+    ('reserved', '<u4'),
+])
+
+# Element type codes of the section table
+DTYPE_CODES: dict[np.dtype[Any], int] = {
+    np.dtype('<u1'): 1,
+    np.dtype('<u2'): 2,
+}
+
+
+def allocate_sections(
+    sections: list[tuple[str, DTypeLike, int]],
+    version: int = ANALYSIS_FORMAT_VERSION
+) -> tuple[NDArray[np.uint8], dict[str, NDArray[Any]]]:
+    """
+    Allocate a file buffer with its header and section table.
+    
+    Args:
+        sections: (name, element type, element count) of every section,
+                  in file order.
+        version: Format version written to the header, one of
+                 READABLE_VERSIONS. Only version 3 and later buffers can
+                 be passed to encode_deltas().
+    
+    Returns:
+        Tuple of (buffer, views): the whole file as bytes, zero-filled
+        apart from the header and table, and a writable view into it per
+        section name.
+    
+    Raises:
+        ValueError: If the version can't be read back, a name is too long
+                    or an element type has no code.
+    """
+    if version not in READABLE_VERSIONS:
+        raise ValueError(f"Unsupported analysis data version {version}")
+    
+    table = np.zeros(len(sections), dtype=SECTION_DTYPE)
+    offset = _align(HEADER_DTYPE.itemsize + table.nbytes)
+    for entry, (name, dtype, count) in zip(table, sections):
+        dtype = np.dtype(dtype).newbyteorder('<')
+        if dtype not in DTYPE_CODES:
+            raise ValueError(f"Unsupported section type {dtype} for {name}")
+        encoded = name.encode('ascii')
+        if len(encoded) > SECTION_DTYPE['name'].itemsize:
+            raise ValueError(f"Section name too long: {name}")
+        entry['name'] = encoded
+        entry['offset'] = offset
+        entry['count'] = count
+        entry['dtype'] = DTYPE_CODES[dtype]
+        offset = _align(offset + count * dtype.itemsize)
+    
+    buffer = np.zeros(offset, dtype=np.uint8)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = ANALYSIS_MAGIC
+    header['version'] = version
+    header['byteorder'] = BYTE_ORDER_MARK
+    header['sections'] = len(sections)
+    buffer[:HEADER_DTYPE.itemsize] = header.view(np.uint8)
+    buffer[HEADER_DTYPE.itemsize:HEADER_DTYPE.itemsize + table.nbytes] = table.view(np.uint8)
+    
+    return buffer, _views(buffer, table)
+
+
+def encode_deltas(buffer: NDArray[np.uint8]) -> None:
+    """
+    Delta-encode the sections of a file buffer that compress better so.
+    
+    Smooth curves (e.g. volume) shrink as differences, while noisy ones
+    can grow, so each section is compressed both ways with zlib and the
+    smaller one is kept. Encoded sections get FLAG_DELTA in the table.
+    
+    Args:
+        buffer: File buffer from allocate_sections(), version 3 or later,
+                with every section written. Modified in place.
+    
+    Raises:
+        ValueError: If the buffer is version 2, which has no section flags.
+    """
+    table = _table(buffer)
+    if buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]['version'] < 3:
+        raise ValueError("Version 2 analysis data can't be delta-encoded")
+    for entry, view in zip(table, _views(buffer, table).values()):
+        if view.size < 2:
+            continue
+        deltas = np.empty_like(view)
+        deltas[0] = view[0]
+        np.subtract(view[1:], view[:-1], out=deltas[1:])
+        if len(zlib.compress(deltas.tobytes())) < len(zlib.compress(view.tobytes())):
+            view[:] = deltas
+            entry['flags'] |= FLAG_DELTA
+
+
+def read_sections(buffer: NDArray[np.uint8] | bytes) -> dict[str, NDArray[Any]]:
+    """
+    View the sections of a version 2 or 3 file.
+    
+    Sections are views into the buffer, except for delta-encoded ones,
+    which are decoded into new arrays.
+    
+    Args:
+        buffer: Contents of the file.
+    
+    Returns:
+        Dictionary mapping each section name to its elements.
+    
+    Raises:
+        ValueError: If the buffer is not a version 2 or 3 file or is
+                    truncated.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    table = _table(data)
+    views = _views(data, table)
+    for entry, name in zip(table, list(views)):
+        if entry['flags'] & FLAG_DELTA:
+            # Running sum in the section's type wraps like the encoding did
+            views[name] = np.cumsum(views[name], dtype=views[name].dtype)
+    return views
+
+
+def write_precompressed(path: str | Path, buffer: NDArray[np.uint8] | bytes) -> None:
+    """
+    Write a file with gzip and brotli compressed siblings.
+    
+    The siblings (path + '.gz', path + '.br') hold the same bytes, for a
+    web server to send with Content-Encoding. Without the brotli package
+    no .br file is written, and a stale one from an earlier run is
+    removed.
+    
+    Args:
+        path: Output file path.
+        buffer: File contents.
+    """
+    path = Path(path)
+    contents = bytes(buffer)
+    path.write_bytes(contents)
+    # mtime=0 keeps the .gz identical for identical contents
+    Path(f'{path}.gz').write_bytes(gzip.compress(contents, GZIP_LEVEL, mtime=0))
+    
+    brotlipath = Path(f'{path}.br')
+    if brotli is not None:
+        brotlipath.write_bytes(brotli.compress(contents, quality=BROTLI_QUALITY))
+    else:
+        brotlipath.unlink(missing_ok=True)
+
+
+def pack_bundle(files: dict[str, NDArray[np.uint8] | bytes]) -> NDArray[np.uint8]:
+    """
+    Pack files into one song bundle.
+    
+    Args:
+        files: Contents of every file by name, in bundle order.
+    
+    Returns:
+        The bundle contents, with each file aligned to SECTION_ALIGNMENT
+        so its sections stay aligned too.
+    """
+    contents = {name: np.frombuffer(data, dtype=np.uint8) for name, data in files.items()}
+    entries: dict[str, list[int]] = {}
+    offset = 0
+    for name, data in contents.items():
+        entries[name] = [offset, data.size]
+        offset = _align(offset + data.size)
+    manifest = json.dumps({'files': entries}, separators=(',', ':')).encode('utf-8')
+    
+    start = _align(BUNDLE_HEADER_DTYPE.itemsize + len(manifest))
+    buffer = np.zeros(start + offset, dtype=np.uint8)
+    header = np.zeros(1, dtype=BUNDLE_HEADER_DTYPE)
+    header['magic'] = BUNDLE_MAGIC
+    header['version'] = BUNDLE_FORMAT_VERSION
+    header['byteorder'] = BYTE_ORDER_MARK
+    header['manifest'] = len(manifest)
+    buffer[:BUNDLE_HEADER_DTYPE.itemsize] = header.view(np.uint8)
+    manifestend = BUNDLE_HEADER_DTYPE.itemsize + len(manifest)
+    buffer[BUNDLE_HEADER_DTYPE.itemsize:manifestend] = np.frombuffer(manifest, dtype=np.uint8)
+    for name, data in contents.items():
+        fileoffset = start + entries[name][0]
+        buffer[fileoffset:fileoffset + data.size] = data
+    return buffer
+
+
+def read_bundle(buffer: NDArray[np.uint8] | bytes) -> dict[str, NDArray[np.uint8]]:
+    """
+    View the files of a song bundle.
+    
+    Args:
+        buffer: Contents of the bundle.
+    
+    Returns:
+        Dictionary mapping each file name to its bytes (views into the
+        buffer).
+    
+    Raises:
+        ValueError: If the buffer is not a song bundle or is truncated.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size < BUNDLE_HEADER_DTYPE.itemsize:
+        raise ValueError("Bundle too short for a header")
+    header = data[:BUNDLE_HEADER_DTYPE.itemsize].view(BUNDLE_HEADER_DTYPE)[0]
+    if header['magic'] != BUNDLE_MAGIC:
+        raise ValueError("Not a song bundle (no magic)")
+    if header['byteorder'] != BYTE_ORDER_MARK:
+        raise ValueError(f"Unexpected byte order mark {header['byteorder']:#06x}")
+    if header['version'] != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle version {header['version']}")
+    
+    manifestend = BUNDLE_HEADER_DTYPE.itemsize + int(header['manifest'])
+    if data.size < manifestend:
+        raise ValueError("Bundle truncated in the manifest")
+    manifest = json.loads(data[BUNDLE_HEADER_DTYPE.itemsize:manifestend].tobytes())
+    
+    start = _align(manifestend)
+    files: dict[str, NDArray[np.uint8]] = {}
+    for name, (offset, length) in manifest['files'].items():
+        end = start + offset + length
+        if end > data.size:
+            raise ValueError(f"Bundle truncated in file {name}")
+        files[name] = data[start + offset:end]
+    return files
+
+
+def _table(data: NDArray[np.uint8]) -> NDArray[np.void]:
+    """Check the header of a file buffer and view its section table."""
+    if data.size < HEADER_DTYPE.itemsize:
+        raise ValueError("Analysis data too short for a header")
+    header = data[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+    if header['magic'] != ANALYSIS_MAGIC:
+        raise ValueError("Not a version 2 or later analysis data file (no magic)")
+    if header['byteorder'] != BYTE_ORDER_MARK:
+        raise ValueError(f"Unexpected byte order mark {header['byteorder']:#06x}")
+    if header['version'] not in READABLE_VERSIONS:
+        raise ValueError(f"Unsupported analysis data version {header['version']}")
+    
+    tableend = HEADER_DTYPE.itemsize + int(header['sections']) * SECTION_DTYPE.itemsize
+    if data.size < tableend:
+        raise ValueError("Analysis data truncated in the section table")
+    return data[HEADER_DTYPE.itemsize:tableend].view(SECTION_DTYPE)
+
+
+def _views(
+    buffer: NDArray[np.uint8],
+    table: NDArray[np.void]
+) -> dict[str, NDArray[Any]]:
+    """Typed views of the sections listed in a section table."""
+    types = {code: dtype for dtype, code in DTYPE_CODES.items()}
+    views: dict[str, NDArray[Any]] = {}
+    for entry in table:
+        dtype = types.get(int(entry['dtype']))
+        if dtype is None:
+            raise ValueError(f"Unknown section type code {entry['dtype']}")
+        name = entry['name'].decode('ascii')
+        start = int(entry['offset'])
+        end = start + int(entry['count']) * dtype.itemsize
+        if end > buffer.size:
+            raise ValueError(f"Analysis data truncated in section {name}")
+        views[name] = buffer[start:end].view(dtype)
+    return views
+
+
+def _align(offset: int) -> int:
+    """Round an offset up to the section alignment."""
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
@@ -0,0 +1,395 @@
+"""
+Analysis parameters and the precomputed tables derived from them.
+
+This module is the single place the analysis settings live: the window,
+FFT and hop sizes of every sms-tools model, their peak thresholds and f0
+ranges, the chunk length, and the dB conversion constants used to turn
+analysis frames into visualization frames.
+
+An AnalysisPlan bundles those settings for one sample rate and output
+frame rate and precomputes what every chunk would otherwise rebuild:
+
+- Normalized analysis windows (shared, read-only arrays)
+- Bin-frequency tables for the STFT models
+- The analysis frame -> output (fps) frame segment maps, per frame count
+
+get_plan() caches plans, so every chunk and stem with the same sample
+rate, frame rate and model settings shares one plan (one per process when
+chunks run in a worker pool).
+
+Example usage:
+    plan = get_plan(44100, 24)
+    w = plan.window(plan.harmonic, MODEL_HARMONIC)
+    starts, ends, filled = plan.stft_segments(173)
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.signal import get_window
+
+
+# Model families, by how they normalize the analysis window.
+# stftAnal uses np.sum(); f0Detection and harmonicModelAnal use Python's
+# sum(), which rounds differently. sineModelAnal is handed the raw window
+# and normalizes it itself.
+MODEL_STFT: str = 'stft'
+MODEL_HARMONIC: str = 'harmonic'
+MODEL_SINE: str = 'sine'
+
+
+@dataclass(frozen=True)
+class FrameParams:
+    """
+    Framing of a spectral analysis.
+    
+    Attributes:
+        window: scipy window name (e.g. 'hann', 'blackman').
+        M: Window size.
+        N: FFT size (>= M).
+        H: Hop size.
+    """
+    window: str
+    M: int
+    N: int
+    H: int
+
+
+@dataclass(frozen=True)
+class SineParams(FrameParams):
+    """
+    Sinusoidal model settings.
+    
+    Attributes:
+        t: Peak threshold in negative dB.
+        minSineDur: Minimum duration of sines in seconds.
+        maxnSines: Maximum number of sines per frame.
+        freqDevOffset: Minimum frequency deviation at 0 Hz.
+        freqDevSlope: Slope increase of the minimum frequency deviation.
+        Ns: Synthesis FFT size.
+    """
+    t: float
+    minSineDur: float
+    maxnSines: int
+    freqDevOffset: float
+    freqDevSlope: float
+    Ns: int
+
+
+@dataclass(frozen=True)
+class F0Params(FrameParams):
+    """
+    Fundamental frequency (TWM) detection settings.
+    
+    Attributes:
+        t: Peak threshold in negative dB.
+        minf0: Minimum F0 in Hz.
+        maxf0: Maximum F0 in Hz.
+        f0et: F0 error threshold.
+    """
+    t: float
+    minf0: float
+    maxf0: float
+    f0et: float
+
+
+@dataclass(frozen=True)
+class HarmonicParams(F0Params):
+    """
+    Harmonic model settings (also used by the HPR model).
+    
+    Attributes:
+        nH: Maximum number of harmonics.
+        harmDevSlope: Harmonic deviation slope.
+        minSineDur: Minimum duration of harmonics in seconds.
+        Ns: Synthesis FFT size.
+    """
+    nH: int
+    harmDevSlope: float
+    minSineDur: float
+    Ns: int
+
+
+# Default model settings
+# 'hann' is the scipy name for Hanning window (scipy >= 1.1 deprecated 'hanning')
+STFT_PARAMS = FrameParams(window='hann', M=2048, N=2048, H=512)
+SINE_PARAMS = SineParams(
+    window='hamming', M=2001, N=2048, H=128, t=-80, minSineDur=0.02,
+    maxnSines=150, freqDevOffset=10, freqDevSlope=0.001, Ns=512
+)
+F0_PARAMS = F0Params(
+    window='blackman', M=1024, N=1024, H=128, t=-90,
+    minf0=130, maxf0=5000, f0et=7
+)
+HARMONIC_PARAMS = HarmonicParams(
+    window='blackman', M=2048, N=2048, H=128, t=-90, minf0=30, maxf0=3000,
+    f0et=7, nH=10, harmDevSlope=0.01, minSineDur=0.1, Ns=512
+)
+HPR_PARAMS = HarmonicParams(
+    window='blackman', M=2048, N=2048, H=128, t=-100, minf0=30, maxf0=700,
+    f0et=5, nH=48, harmDevSlope=0.01, minSineDur=0.1, Ns=512
+)
+HPR_RESIDUAL_PARAMS = FrameParams(window='blackman', M=1024, N=1024, H=512)
+
+# Seconds of audio analyzed per chunk
+CHUNK_SECONDS: int = 2
+
+# dB conversions: power = 10^(dB/10), amplitude = 10^(dB/20)
+POWER_DB_DIVISOR: float = 10
+AMPLITUDE_DB_DIVISOR: float = 20
+
+# Peak magnitude (dB) of an output frame with no analysis frames
+EMPTY_FRAME_DB: float = -1000.0
+
+
+@lru_cache(maxsize=None)
+def analysis_window(window: str, M: int, model: str = MODEL_STFT) -> NDArray[np.float64]:
+    """
+    Build an analysis window, once per configuration.
+    
+    Args:
+        window: scipy window name.
+        M: Window size.
+        model: MODEL_STFT or MODEL_HARMONIC, selecting the normalization
+               of the matching sms-tools analysis, or MODEL_SINE for the
+               unnormalized window.
+    
+    Returns:
+        Read-only window of length M.
+    
+    Raises:
+        ValueError: If the model family is unknown.
+    """
+    w = get_window(window, M)
+    if model == MODEL_STFT:
+        w = w / np.sum(w)
+    elif model == MODEL_HARMONIC:
+        w = w / sum(w)
+    elif model != MODEL_SINE:
+        raise ValueError(f"Unknown model family: {model}")
+    w.flags.writeable = False
+    return w
+
+
+@dataclass(frozen=True)
+class AnalysisPlan:
+    """
+    Analysis settings and precomputed tables for one sample rate and fps.
+    
+    Build plans with get_plan() so they are shared. Segment maps are
+    computed on first use for each analysis frame count and then reused.
+    
+    Attributes:
+        fs: Sample rate in Hz.
+        fps: Output frames per second, or None for a plan only used to run
+             the models (segment maps are then unavailable).
+        stft: STFT model settings.
+        sine: Sinusoidal model settings.
+        f0: F0 detection settings.
+        harmonic: Harmonic model settings.
+        hpr: Harmonic plus residual model settings.
+        hpr_residual: Framing of the HPR residual STFT.
+        chunkseconds: Seconds of audio per analysis chunk.
+    
+    Example:
+        >>> plan = get_plan(44100, 24)
+        >>> plan.chunklen
+        88200
+    """
+    fs: int
+    fps: int | None
+    stft: FrameParams = STFT_PARAMS
+    sine: SineParams = SINE_PARAMS
+    f0: F0Params = F0_PARAMS
+    harmonic: HarmonicParams = HARMONIC_PARAMS
+    hpr: HarmonicParams = HPR_PARAMS
+    hpr_residual: FrameParams = HPR_RESIDUAL_PARAMS
+    chunkseconds: int = CHUNK_SECONDS
+    _segments: dict[tuple[str, int, int], tuple[NDArray[np.intp], NDArray[np.intp], NDArray[np.bool_]]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    
+    def __post_init__(self) -> None:
+        if self.fs <= 0:
+            raise ValueError(f"Sample rate must be positive, got {self.fs}")
+        if self.fps is not None and self.fps <= 0:
+            raise ValueError(f"FPS must be positive, got {self.fps}")
+        
+        # Build every window the plan's models use up front
+        self.window(self.stft, MODEL_STFT)
+        self.window(self.sine, MODEL_SINE)
+        self.window(self.f0, MODEL_HARMONIC)
+        self.window(self.harmonic, MODEL_HARMONIC)
+        self.window(self.hpr, MODEL_HARMONIC)
+        self.window(self.hpr_residual, MODEL_STFT)
+    
+    @property
+    def chunklen(self) -> int:
+        """Number of samples per analysis chunk."""
+        return self.fs * self.chunkseconds
+    
+    @staticmethod
+    def window(params: FrameParams, model: str = MODEL_STFT) -> NDArray[np.float64]:
+        """Return the (read-only) analysis window for a model's framing."""
+        return analysis_window(params.window, params.M, model)
+    
+    def bin_frequencies(self, params: FrameParams) -> NDArray[np.float64]:
+        """Return the frequency in Hz of every positive-frequency bin."""
+        return bin_frequencies(self.fs, params.N)
+    
+    def stft_segments(
+        self,
+        numframes: int
+    ) -> tuple[NDArray[np.intp], NDArray[np.intp], NDArray[np.bool_]]:
+        """
+        Segment map from STFT frames to output frames.
+        
+        Args:
+            numframes: Number of STFT frames in the chunk.
+        
+        Returns:
+            Tuple of (starts, ends, filled): inclusive STFT frame bounds for
+            each output frame, and which output frames are non-empty.
+        """
+        analysislen: int = self.stft.N // 2
+        fftsizeratio: float = float(analysislen) / self.stft.H
+        framelen: float = float(self.fs) / self._require_fps() * fftsizeratio
+        ratio: float = float(framelen) / analysislen
+        return self._segment_map(MODEL_STFT, numframes, 0, ratio)
+    
+    def harmonic_segments(
+        self,
+        numframes: int,
+        chunklen: int
+    ) -> tuple[NDArray[np.intp], NDArray[np.intp], NDArray[np.bool_]]:
+        """
+        Segment map from harmonic model frames to output frames.
+        
+        Args:
+            numframes: Number of harmonic model frames in the chunk.
+            chunklen: Nominal number of samples per chunk.
+        
+        Returns:
+            Tuple of (starts, ends, filled), as for stft_segments().
+        """
+        analysislen: float = float(chunklen) / numframes
+        fftsizeratio: float = float(analysislen) / self.harmonic.H
+        framelen: float = float(self.fs) / self._require_fps() * fftsizeratio
+        ratio: float = float(framelen) / analysislen
+        return self._segment_map(MODEL_HARMONIC, numframes, chunklen, ratio)
+    
+    def _require_fps(self) -> int:
+        if self.fps is None:
+            raise ValueError("This analysis plan has no output frame rate")
+        return self.fps
+    
+    def _segment_map(
+        self,
+        model: str,
+        numframes: int,
+        chunklen: int,
+        ratio: float
+    ) -> tuple[NDArray[np.intp], NDArray[np.intp], NDArray[np.bool_]]:
+        key = (model, numframes, chunklen)
+        if key not in self._segments:
+            starts, ends = segment_bounds(numframes, ratio)
+            filled = starts <= ends
+            for array in (starts, ends, filled):
+                array.flags.writeable = False
+            self._segments[key] = (starts, ends, filled)
+        return self._segments[key]
+
+
+@lru_cache(maxsize=None)
+def get_plan(fs: int, fps: int | None = None, **params: FrameParams) -> AnalysisPlan:
+    """
+    Return the shared AnalysisPlan for a sample rate, fps and settings.
+    
+    Args:
+        fs: Sample rate in Hz.
+        fps: Output frames per second (None if only the models are run).
+        **params: Model settings overriding the defaults, by AnalysisPlan
+                  field name (e.g. harmonic=HarmonicParams(...)).
+    
+    Returns:
+        The cached plan for these arguments.
+    
+    Raises:
+        ValueError: If fs or fps is not positive.
+    """
+    return AnalysisPlan(fs, fps, **params)
+
+
+def segment_bounds(
+    numframes: int,
+    ratio: float
+) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+    """
+    Find which analysis frames make up each output (fps) frame.
+    
+    An output frame is emitted whenever frame_idx % ratio wraps around,
+    and at the last analysis frame. Each output frame covers the analysis
+    frames since the previous one was emitted; the very first analysis
+    frame is never part of a window.
+    
+    Args:
+        numframes: Number of analysis frames in the chunk.
+        ratio: Analysis frames per output frame.
+    
+    Returns:
+        Tuple of (starts, ends), inclusive analysis frame indices for each
+        output frame. A window with start > end is empty.
+    """
+    # Trigger output at frame boundaries
+    trigger = np.zeros(numframes, dtype=bool)
+    trigger[segment_triggers(0, numframes, ratio)] = True
+    trigger[-1] = True
+    
+    ends: NDArray[np.intp] = np.flatnonzero(trigger)
+    starts: NDArray[np.intp] = np.empty_like(ends)
+    starts[0] = 1
+    starts[1:] = ends[:-1] + 1
+    return starts, ends
+
+
+def segment_triggers(start: int, stop: int, ratio: float) -> NDArray[np.intp]:
+    """
+    Find the analysis frames in [start, stop) at which frame_idx % ratio
+    wraps around, i.e. that end an output frame.
+    
+    segment_bounds() for a range of an unbounded stream of frames: the
+    result doesn't depend on how the stream is split into ranges.
+    
+    Args:
+        start: First analysis frame index.
+        stop: Analysis frame index after the last.
+        ratio: Analysis frames per output frame.
+    
+    Returns:
+        Trigger frame indices in increasing order.
+    """
+    first = max(start, 1)
+    if first >= stop:
+        return np.empty(0, dtype=np.intp)
+    r: NDArray[np.float64] = np.arange(first - 1, stop) % ratio
+    return first + np.flatnonzero(r[1:] < r[:-1])
+
+
+@lru_cache(maxsize=None)
+def bin_frequencies(fs: int, N: int) -> NDArray[np.float64]:
+    """
+    Frequency in Hz of every positive-frequency bin of an N-point FFT.
+    
+    Args:
+        fs: Sample rate in Hz.
+        N: FFT size.
+    
+    Returns:
+        Read-only array of N // 2 + 1 bin frequencies.
+    """
+    freqs = fs * np.arange(N // 2 + 1) / N
+    freqs.flags.writeable = False
+    return freqs
@@ -0,0 +1,305 @@
+"""
+Audio file input for the analysis pipeline.
+
+This module gives the analysis stages stereo audio as chunks on demand,
+instead of whole channels held in memory:
+
+- WavSource memory-maps the sample data of a WAV file and decodes only the
+  chunk that is asked for, so peak memory follows the chunk size rather
+  than the file length (hour-long 96 kHz recordings included).
+- ArraySource wraps left/right arrays that are already in memory.
+
+Both implement the AudioSource protocol used by analysis() and
+worker_processor(). region() returns a lightweight source for a sample
+range; a WavSource region pickles as its path and range, so worker
+processes map the file themselves instead of receiving samples.
+
+Supported WAV sample formats:
+- 8-bit unsigned PCM
+- 16-bit, 24-bit and 32-bit signed PCM
+- 32-bit and 64-bit IEEE float
+
+Mono files give the same samples for both channels. Integer samples are
+scaled to [-1, 1) with the same factors as sms-tools'
+utilFunctions.wavread, so results match the previous pipeline.
+
+Example usage:
+    from audio_source import WavSource
+    source = WavSource('stems/Song/Song Bass.wav')
+    left, right = source.read(0, source.fs * 2)  # first two seconds
+"""
+from __future__ import annotations
+
+import struct
+from pathlib import Path
+from typing import Any, Protocol
+
+import numpy as np
+from numpy.typing import NDArray
+from smstools.models import utilFunctions as UF
+
+
+# WAV format tags
+WAVE_FORMAT_PCM: int = 0x0001
+WAVE_FORMAT_IEEE_FLOAT: int = 0x0003
+WAVE_FORMAT_EXTENSIBLE: int = 0xFFFE
+
+
+class AudioSource(Protocol):
+    """Stereo audio that can be read in sample ranges."""
+
+    def __len__(self) -> int:
+        """Number of samples per channel."""
+        ...
+
+    def read(self, start: int, stop: int) -> tuple[NDArray[Any], NDArray[Any]]:
+        """Return (left, right) float samples for [start, stop)."""
+        ...
+
+    def region(self, start: int, stop: int) -> AudioSource:
+        """Return a source covering samples [start, stop) of this one."""
+        ...
+
+
+class ArraySource:
+    """
+    AudioSource over left/right sample arrays already in memory.
+
+    Args:
+        x: Left channel samples.
+        x2: Right channel samples (same length as x).
+
+    Raises:
+        ValueError: If the channels differ in length.
+    """
+
+    def __init__(self, x: NDArray[Any], x2: NDArray[Any]) -> None:
+        if len(x) != len(x2):
+            raise ValueError(
+                f"Channel lengths differ: {len(x)} and {len(x2)} samples"
+            )
+        self.x = x
+        self.x2 = x2
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def read(self, start: int, stop: int) -> tuple[NDArray[Any], NDArray[Any]]:
+        """Return views of both channels for samples [start, stop)."""
+        return self.x[start:stop], self.x2[start:stop]
+
+    def region(self, start: int, stop: int) -> ArraySource:
+        """Return a source over samples [start, stop) sharing this one's memory."""
+        return ArraySource(self.x[start:stop], self.x2[start:stop])
+
+
+class WavSource:
+    """
+    AudioSource backed by a memory-mapped WAV file.
+
+    Only the RIFF header is parsed up front. Samples are decoded per read()
+    call, so memory use is proportional to the requested range: each
+    channel of the requested range is converted to its own float32 array
+    (float64 WAVs included).
+
+    Args:
+        path: Path to the WAV file.
+        start: First sample (per channel) to expose, e.g. to trim an intro.
+        stop: Sample after the last one to expose. Defaults to the file end.
+
+    Attributes:
+        path: Path to the WAV file.
+        fs: Sample rate in Hz.
+        channels: Number of channels in the file.
+        start: First exposed sample.
+        stop: Sample after the last exposed one.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        ValueError: If the file is not a supported WAV file.
+
+    Example:
+        >>> source = WavSource('stem.wav', start=44100)  # skip first second
+        >>> left, right = source.read(0, 88200)
+    """
+
+    def __init__(self, path: str | Path, start: int = 0, stop: int | None = None) -> None:
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError(f"Audio file not found: {self.path}")
+
+        (self.fs, self.channels, self._dtype, self._samplewidth,
+         self._offset, self._frames) = _parse_wav_header(self.path)
+
+        self.start = min(max(start, 0), self._frames)
+        self.stop = self._frames if stop is None else min(max(stop, self.start), self._frames)
+        self._data: np.memmap | None = None
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Pickle as path and range; the mapping is reopened on first read
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def read(self, start: int, stop: int) -> tuple[NDArray[Any], NDArray[Any]]:
+        """
+        Decode samples [start, stop) relative to this source's start.
+
+        Args:
+            start: First sample to read.
+            stop: Sample after the last one to read (clamped to the end).
+
+        Returns:
+            Tuple of (left, right) contiguous float32 arrays in [-1, 1]. For
+            mono files both are the same array.
+        """
+        start = min(max(start, 0), len(self)) + self.start
+        stop = min(max(stop, 0), len(self)) + self.start
+        frames = self._map()[start:max(stop, start)]
+
+        if self._samplewidth == 3:
+            samples = _decode_int24(frames, self.channels)
+        elif self._dtype.kind == 'f':
+            samples = frames
+        else:
+            samples = _to_float(frames)
+
+        # Copy each channel out of the interleaved frames
+        left = np.ascontiguousarray(samples[:, 0], dtype=np.float32)
+        if self.channels == 1:
+            return left, left
+        return left, np.ascontiguousarray(samples[:, 1], dtype=np.float32)
+
+    def region(self, start: int, stop: int) -> WavSource:
+        """Return a source over samples [start, stop) of this one, without reading them."""
+        region = WavSource.__new__(WavSource)
+        region.__dict__.update(self.__getstate__())
+        region.start = min(max(start, 0), len(self)) + self.start
+        region.stop = min(max(stop, 0), len(self)) + self.start
+        region.stop = max(region.stop, region.start)
+        return region
+
+    def _map(self) -> np.memmap:
+        """Open (or reuse) the memory mapping of the sample data."""
+        if self._data is None:
+            if self._samplewidth == 3:
+                shape = (self._frames, self.channels * 3)
+            else:
+                shape = (self._frames, self.channels)
+            self._data = np.memmap(
+                self.path, dtype=self._dtype, mode='r',
+                offset=self._offset, shape=shape
+            )
+        return self._data
+
+
+def _parse_wav_header(path: Path) -> tuple[int, int, np.dtype, int, int, int]:
+    """
+    Parse the RIFF header of a WAV file.
+
+    Args:
+        path: Path to the WAV file.
+
+    Returns:
+        Tuple of (fs, channels, dtype, samplewidth, data_offset, frames).
+        For 24-bit files dtype is uint8 and samplewidth is 3.
+
+    Raises:
+        ValueError: If the file is not a supported little-endian WAV file.
+    """
+    filesize = path.stat().st_size
+    with open(path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise ValueError(f"Not a RIFF/WAVE file: {path}")
+
+        fmt: tuple[int, int, int, int, int] | None = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in WAV file: {path}")
+            chunkid, chunksize = struct.unpack('<4sI', header)
+
+            if chunkid == b'fmt ':
+                body = f.read(chunksize)
+                if len(body) < 16:
+                    raise ValueError(f"Truncated WAV fmt chunk: {path}")
+                formattag, channels, fs, _, blockalign, bits = struct.unpack('<HHIIHH', body[:16])
+                if formattag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    formattag = struct.unpack('<H', body[24:26])[0]
+                fmt = (formattag, channels, fs, blockalign, bits)
+                if chunksize % 2:
+                    f.seek(1, 1)
+            elif chunkid == b'data':
+                if fmt is None:
+                    raise ValueError(f"WAV data chunk before fmt chunk: {path}")
+                offset = f.tell()
+                # Some writers leave the size unset for streamed files
+                datasize = min(chunksize, filesize - offset)
+                break
+            else:
+                f.seek(chunksize + chunksize % 2, 1)
+
+    formattag, channels, fs, blockalign, bits = fmt
+    samplewidth = bits // 8
+
+    if formattag == WAVE_FORMAT_PCM and samplewidth in (1, 2, 3, 4):
+        dtype = np.dtype({1: 'u1', 2: '<i2', 3: 'u1', 4: '<i4'}[samplewidth])
+    elif formattag == WAVE_FORMAT_IEEE_FLOAT and samplewidth in (4, 8):
+        dtype = np.dtype({4: '<f4', 8: '<f8'}[samplewidth])
+    else:
+        raise ValueError(
+            f"Unsupported WAV sample format (tag {formattag}, {bits} bits): {path}"
+        )
+
+    if channels < 1 or blockalign != channels * samplewidth:
+        raise ValueError(f"Unsupported WAV block layout: {path}")
+
+    return fs, channels, dtype, samplewidth, offset, datasize // blockalign
+
+
+def _decode_int24(frames: NDArray[np.uint8], channels: int) -> NDArray[np.float32]:
+    """
+    Decode packed 24-bit PCM bytes to float32.
+
+    Samples are first left-justified into int32, as scipy.io.wavfile does,
+    so scaling matches other readers.
+
+    Args:
+        frames: Raw bytes, shape (frames, channels * 3).
+        channels: Number of channels.
+
+    Returns:
+        Float32 samples, shape (frames, channels).
+    """
+    b = frames.reshape(len(frames), channels, 3).astype(np.int32)
+    samples = (b[..., 0] << 8) | (b[..., 1] << 16) | (b[..., 2] << 24)
+    return _to_float(samples)
+
+
+def _to_float(data: NDArray[np.generic]) -> NDArray[np.float32]:
+    """
+    Convert integer WAV samples to float32 in [-1, 1].
+
+    Args:
+        data: Integer samples.
+
+    Returns:
+        Float32 samples with the same shape.
+
+    Raises:
+        ValueError: If the sample type is not supported.
+    """
+    dtype = data.dtype.name
+
+    # 8-bit PCM is unsigned and centred on 128
+    if dtype == 'uint8':
+        return ((data - 128.0) / 128).astype(np.float32, copy=False)
+
+    if dtype not in UF.norm_fact:
+        raise ValueError(f"Unsupported WAV sample format: {dtype}")
+
+    return (data / UF.norm_fact[dtype]).astype(np.float32, copy=False)
@@ -8,33 +8,69 @@ frames with their centroids.
 
 The K-means algorithm:
 1. Takes normalized STFT (Short-Time Fourier Transform) samples from stereo audio
-2. Combines non-quiet samples from both channels as training data
-3. Downsamples for efficiency (every 4th sample)
+2. Combines non-quiet samples from both channels as training data, taking
+   each frame from a randomly chosen channel
+3. Samples uniformly down to a memory cap if there are too many frames
 4. Clusters samples into centroidcount groups
 5. Returns centroids representing the spectral "fingerprints" of the audio
 
+Two clustering modes are available:
+- 'full': scikit-learn's full-batch KMeans over all training frames.
+- 'minibatch': MiniBatchKMeans fed shuffled batches of frames with
+  partial_fit(), so only one batch is copied into a dense array at a time.
+  Suited to long stems and catalog-wide runs.
+
+Both report the inertia (sum of squared distances of the training frames
+to their nearest centroid), so the modes can be compared.
+
+kmeans() samples and clusters a single stem. To train one codebook over
+several stems, sample each stem with training_set() and cluster the
+concatenated frames with kmeans_fit().
+
 Example usage:
     centroids = kmeans(24, 1, stft_left, stft_right, non_quiet_indices)
+    centroids = kmeans(24, 1, stft_left, stft_right, non_quiet_indices,
+                       mode='minibatch', batch_size=2048)
+    
+    frames = np.concatenate([training_set(l, r, nq, budget) for l, r, nq in stems])
+    centroids = kmeans_fit(frames, 24, 1)
 """
 from __future__ import annotations
 
 import numpy as np
 from numpy.typing import NDArray
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 
 
 # Default number of iterations per update count for K-means convergence
 # This multiplier ensures adequate convergence while maintaining reasonable performance
 KMEANS_ITERATIONS_MULTIPLIER: int = 100
 
+# Clustering modes
+KMEANS_MODES: tuple[str, ...] = ('full', 'minibatch')
+
+# Frames per mini-batch, and per block when computing inertia
+DEFAULT_BATCH_SIZE: int = 1024
+
+# Convergence tolerance, relative to the mean per-bin variance of the data
+# (scikit-learn's KMeans default)
+DEFAULT_TOL: float = 1e-4
+
+# Maximum size of the training matrix; larger training sets are sampled down
+DEFAULT_MAX_TRAINING_BYTES: int = 64 * 1024**2
+
 
 def kmeans(
     centroidcount: int,
     vqupdatecount: int,
-    stftsamples_normalized: list[list[float]],
-    stftsamples_normalized2: list[list[float]],
-    nonquietsamples: list[int]
-) -> list[list[float]]:
+    stftsamples_normalized: NDArray[np.float64],
+    stftsamples_normalized2: NDArray[np.float64],
+    nonquietsamples: NDArray[np.intp],
+    mode: str = 'full',
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    tol: float = DEFAULT_TOL,
+    max_training_bytes: int = DEFAULT_MAX_TRAINING_BYTES
+) -> NDArray[np.float64]:
     """
     Perform K-means clustering on normalized STFT samples.
     
@@ -49,81 +85,302 @@ def kmeans(
         vqupdatecount: Number of update iterations for K-means convergence.
                       Higher values produce better results but take longer.
                       Multiplied by KMEANS_ITERATIONS_MULTIPLIER for actual iterations.
-        stftsamples_normalized: Normalized STFT samples from left channel.
-                               Each sample is a list of frequency bin values.
+        stftsamples_normalized: Normalized STFT samples from left channel,
+                               shape (frames, bins).
         stftsamples_normalized2: Normalized STFT samples from right channel.
                                 Same structure as left channel samples.
         nonquietsamples: Indices of samples that are not quiet/silent.
                         Used to filter out noise when selecting training data.
+        mode: 'full' for full-batch KMeans, or 'minibatch' to stream
+              batches of frames through MiniBatchKMeans.
+        batch_size: Frames per mini-batch ('minibatch' mode only). Must be
+                    at least centroidcount.
+        tol: Convergence tolerance on the centroid shift between
+             iterations (epochs in 'minibatch' mode), relative to the mean
+             per-bin variance of the training data.
+        max_training_bytes: Memory cap for the training matrix. Larger
+                            training sets are sampled uniformly down to it.
     
     Returns:
-        List of centroids, where each centroid is a list of frequency bin values.
-        The length matches centroidcount, and each centroid has the same
-        dimensionality as the input STFT samples.
+        Array of centroids with shape (centroidcount, bins). Each centroid
+        has the same dimensionality as the input STFT samples.
     
     Raises:
-        ValueError: If centroidcount is larger than the number of samples.
+        ValueError: If centroidcount is larger than the number of training
+                    samples, the mode is unknown, or batch_size is smaller
+                    than centroidcount in 'minibatch' mode.
     
     Example:
-        >>> stft_left = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], ...]
-        >>> stft_right = [[0.15, 0.25, 0.35], [0.45, 0.55, 0.65], ...]
-        >>> non_quiet = [0, 1, 5, 10, 15]
+        >>> stft_left = np.array([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], ...])
+        >>> stft_right = np.array([[0.15, 0.25, 0.35], [0.45, 0.55, 0.65], ...])
+        >>> non_quiet = np.array([0, 1, 5, 10, 15])
         >>> centroids = kmeans(4, 1, stft_left, stft_right, non_quiet)
         >>> len(centroids)
         4
     """
-    if not stftsamples_normalized:
+    if len(stftsamples_normalized) == 0:
         raise ValueError("stftsamples_normalized cannot be empty")
     
-    if centroidcount <= 0:
-        raise ValueError(f"centroidcount must be positive, got {centroidcount}")
+    training_data = training_set(
+        stftsamples_normalized, stftsamples_normalized2, nonquietsamples,
+        max_training_bytes, min_samples=centroidcount
+    )
+    return kmeans_fit(
+        training_data, centroidcount, vqupdatecount,
+        mode=mode, batch_size=batch_size, tol=tol
+    )
+
+
+def kmeans_fit(
+    training_data: NDArray[np.float64],
+    centroidcount: int,
+    vqupdatecount: int,
+    mode: str = 'full',
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    tol: float = DEFAULT_TOL
+) -> NDArray[np.float64]:
+    """
+    Cluster a prepared training matrix into centroidcount centroids.
     
-    # Convert to numpy arrays for efficient processing
-    samples_array: NDArray[np.float64] = np.array(stftsamples_normalized)
-    samples_array2: NDArray[np.float64] = np.array(stftsamples_normalized2)
+    Args:
+        training_data: Training frames, shape (n, bins), e.g. from
+                       training_set().
+        centroidcount: Number of clusters (centroids) to create.
+        vqupdatecount: Number of update iterations, multiplied by
+                       KMEANS_ITERATIONS_MULTIPLIER.
+        mode: 'full' or 'minibatch', as in kmeans().
+        batch_size: Frames per mini-batch ('minibatch' mode only).
+        tol: Convergence tolerance, as in kmeans().
     
-    # Create combined training data from non-quiet samples of both channels
-    # Randomly select from left or right channel as in original implementation
-    training_indices: NDArray[np.int64] = np.array(nonquietsamples)
-    np.random.seed(42)  # For reproducibility
-    channel_selection: NDArray[np.int64] = np.random.randint(0, 2, len(training_indices))
+    Returns:
+        Array of centroids with shape (centroidcount, bins).
     
-    training_data: list[NDArray[np.float64]] = []
-    for i, idx in enumerate(training_indices):
-        if channel_selection[i] == 0:
-            training_data.append(samples_array[idx])
-        else:
-            training_data.append(samples_array2[idx])
+    Raises:
+        ValueError: If centroidcount is not positive or larger than the
+                    number of training samples, the mode is unknown, or
+                    batch_size is smaller than centroidcount in 'minibatch'
+                    mode.
+    """
+    if centroidcount <= 0:
+        raise ValueError(f"centroidcount must be positive, got {centroidcount}")
     
-    training_data_array: NDArray[np.float64] = np.array(training_data)
+    if mode not in KMEANS_MODES:
+        raise ValueError(f"mode must be one of {KMEANS_MODES}, got {mode!r}")
     
-    # Downsample for efficiency (as in original implementation)
-    # Takes every 4th sample to reduce computation time
-    stftsamples_normalized_downsized: NDArray[np.float64] = samples_array[::4]
+    if tol < 0:
+        raise ValueError(f"tol must not be negative, got {tol}")
     
     # Validate we have enough samples for the requested number of centroids
-    n_samples = len(stftsamples_normalized_downsized)
+    n_samples = len(training_data)
     if centroidcount > n_samples:
         raise ValueError(
             f"centroidcount ({centroidcount}) cannot be larger than "
             f"number of samples ({n_samples})"
         )
     
-    # Initialize and fit KMeans
-    # Using 'k-means++' for smarter initialization (better than random)
-    # max_iter controls convergence iterations
-    kmeans_model = KMeans(
+    max_iter: int = vqupdatecount * KMEANS_ITERATIONS_MULTIPLIER
+    
+    if mode == 'minibatch':
+        centroids = _minibatch_kmeans(
+            training_data, centroidcount, max_iter, batch_size, tol
+        )
+        inertia = kmeans_inertia(training_data, centroids, batch_size)
+    else:
+        # Initialize and fit KMeans
+        # Using 'k-means++' for smarter initialization (better than random)
+        # max_iter controls convergence iterations
+        kmeans_model = KMeans(
+            n_clusters=centroidcount,
+            init='k-means++',
+            n_init=1,  # Single initialization (original used 1 iteration)
+            max_iter=max_iter,
+            tol=tol,
+            random_state=42
+        )
+        
+        # Fit on the sampled training frames
+        kmeans_model.fit(training_data)
+        centroids = kmeans_model.cluster_centers_
+        inertia = float(kmeans_model.inertia_)
+    
+    print(f"kmeans clustering complete: {centroidcount} centroids created "
+          f"from {n_samples} frames ({mode}, inertia {inertia:.6g})")
+    
+    return centroids
+
+
+def training_set(
+    stftsamples_normalized: NDArray[np.float64],
+    stftsamples_normalized2: NDArray[np.float64],
+    nonquietsamples: NDArray[np.intp],
+    max_training_bytes: int = DEFAULT_MAX_TRAINING_BYTES,
+    min_samples: int = 0
+) -> NDArray[np.float64]:
+    """
+    Sample a stem's non-quiet stereo frames for training.
+    
+    Args:
+        stftsamples_normalized: Left channel frames, shape (frames, bins).
+        stftsamples_normalized2: Right channel frames, same shape.
+        nonquietsamples: Indices of the non-quiet frames.
+        max_training_bytes: Memory cap for the returned matrix (at least
+                            min_samples rows are always kept).
+        min_samples: With fewer non-quiet frames than this, sample from
+                     all frames instead.
+    
+    Returns:
+        Training matrix, shape (n, bins).
+    """
+    samples_array: NDArray[np.float64] = np.asarray(stftsamples_normalized)
+    samples_array2: NDArray[np.float64] = np.asarray(stftsamples_normalized2)
+    
+    # Train on non-quiet frames. With too few of them to place every
+    # centroid, fall back to all frames.
+    training_indices: NDArray[np.intp] = np.asarray(nonquietsamples)
+    if len(training_indices) < min_samples:
+        training_indices = np.arange(len(samples_array))
+    
+    rowbytes = samples_array.shape[1] * samples_array.itemsize
+    max_samples = max(min_samples, max_training_bytes // max(rowbytes, 1))
+    return training_samples(
+        samples_array, samples_array2, training_indices, max_samples,
+        np.random.default_rng(42)  # For reproducibility
+    )
+
+
+def training_samples(
+    samples: NDArray[np.float64],
+    samples2: NDArray[np.float64],
+    indices: NDArray[np.intp],
+    max_samples: int,
+    rng: np.random.Generator
+) -> NDArray[np.float64]:
+    """
+    Build the k-means training matrix from stereo frames.
+    
+    Each selected frame is taken from the left or the right channel at
+    random. When there are more candidate frames than max_samples, a
+    uniform random subset of max_samples frames is kept (the same
+    distribution a reservoir sample gives, drawn in one step since the
+    candidates are known up front), in time order. Only the kept rows are
+    ever copied.
+    
+    Args:
+        samples: Left channel frames, shape (frames, bins).
+        samples2: Right channel frames, same shape.
+        indices: Candidate frame indices (e.g. the non-quiet frames).
+        max_samples: Maximum number of rows in the result.
+        rng: Random generator for the subset and the channel choice.
+    
+    Returns:
+        Training matrix, shape (min(len(indices), max_samples), bins).
+    """
+    if len(indices) > max_samples:
+        keep = np.sort(rng.choice(len(indices), size=max_samples, replace=False))
+        indices = indices[keep]
+    
+    right = rng.integers(0, 2, len(indices)).astype(bool)
+    training = np.empty((len(indices), samples.shape[1]), dtype=samples.dtype)
+    training[~right] = samples[indices[~right]]
+    training[right] = samples2[indices[right]]
+    return training
+
+
+def kmeans_inertia(
+    samples: NDArray[np.float64],
+    centroids: NDArray[np.float64],
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> float:
+    """
+    Sum of squared distances of samples to their nearest centroid.
+    
+    Computed block by block, so memory stays bounded by batch_size rows.
+    
+    Args:
+        samples: Frames, shape (n, bins).
+        centroids: Centroids, shape (k, bins).
+        batch_size: Frames per block.
+    
+    Returns:
+        The inertia, the quantity k-means minimizes. Lower is better for
+        the same data and centroid count.
+    """
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    total = 0.0
+    for start in range(0, len(samples), batch_size):
+        block = np.asarray(samples[start:start + batch_size], dtype=np.float64)
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2
+        distances = centroid_norms - 2.0 * (block @ centroids.T)
+        nearest = distances.min(axis=1) + np.einsum('ij,ij->i', block, block)
+        total += float(np.maximum(nearest, 0.0).sum())
+    return total
+
+
+def _minibatch_kmeans(
+    samples: NDArray[np.float64],
+    centroidcount: int,
+    max_iter: int,
+    batch_size: int,
+    tol: float
+) -> NDArray[np.float64]:
+    """
+    Cluster samples with MiniBatchKMeans, streaming shuffled batches.
+    
+    Each epoch visits every frame once in a fresh random order. Only the
+    current batch is gathered into a dense array, so samples can be a
+    strided view or memory-mapped without being copied whole.
+    
+    Args:
+        samples: Training frames, shape (n, bins).
+        centroidcount: Number of clusters.
+        max_iter: Maximum number of epochs.
+        batch_size: Frames per batch.
+        tol: Stop once the squared centroid shift over an epoch is at most
+             tol times the mean per-bin variance of the samples.
+    
+    Returns:
+        Centroids, shape (centroidcount, bins).
+    
+    Raises:
+        ValueError: If batch_size is smaller than centroidcount.
+    """
+    if batch_size < centroidcount:
+        raise ValueError(
+            f"batch_size ({batch_size}) must be at least centroidcount ({centroidcount})"
+        )
+    
+    # Scale tol like KMeans does: by the mean variance of the data per bin
+    count = len(samples)
+    sums = np.zeros(samples.shape[1])
+    squares = np.zeros(samples.shape[1])
+    for start in range(0, count, batch_size):
+        block = samples[start:start + batch_size]
+        sums += block.sum(axis=0)
+        squares += np.einsum('ij,ij->j', block, block)
+    variance = float(np.mean(squares / count - (sums / count) ** 2))
+    threshold = tol * max(variance, 0.0)
+    
+    model = MiniBatchKMeans(
         n_clusters=centroidcount,
         init='k-means++',
-        n_init=1,  # Single initialization (original used 1 iteration)
-        max_iter=vqupdatecount * KMEANS_ITERATIONS_MULTIPLIER,
+        n_init=1,
+        batch_size=batch_size,
         random_state=42
     )
+    rng = np.random.default_rng(42)
     
-    # Fit on downsampled data
-    kmeans_model.fit(stftsamples_normalized_downsized)
-    
-    print(f"kmeans clustering complete: {centroidcount} centroids created")
+    previous: NDArray[np.float64] | None = None
+    for epoch in range(max_iter):
+        order = rng.permutation(count)
+        for start in range(0, count, batch_size):
+            # The first batch also seeds k-means++ (it has at least
+            # centroidcount frames, since batch_size and count both do)
+            batch = np.sort(order[start:start + batch_size])
+            model.partial_fit(samples[batch])
+        
+        centroids = model.cluster_centers_
+        if previous is not None and np.sum((centroids - previous) ** 2) <= threshold:
+            break
+        previous = centroids.copy()
     
-    # Return centroids as list of lists (matching original interface)
-    return kmeans_model.cluster_centers_.tolist()
+    return model.cluster_centers_
@@ -0,0 +1,517 @@
+"""
+Live feature server: analyzes audio as it plays and pushes the
+visualization frames to WebSocket clients.
+
+The rest of the pipeline precomputes analysis files for the frontend.
+This module drives live installations instead: it reads stereo audio in
+real time, runs it through a StreamingAnalyzer and sends every frame to
+the connected clients as soon as it is computed, at the visualization
+fps. It only needs the standard library (asyncio, with a minimal
+WebSocket implementation) and listens on localhost by default.
+
+Audio comes from a WAV file, read at playback speed, or from stdin as
+raw interleaved stereo float32 samples at STDIN_FS, e.g.:
+
+    ffmpeg -i input.wav -f f32le -ac 2 -ar 44100 - | python live_server.py - stem.json
+
+Frames are quantized against the codebook of an exported stem (its
+_analysis.json, with the centroids in its data file or the song's shared
+codebook file), so a client can draw them with that stem's centroids.
+
+Protocol (one WebSocket connection per client, ws://HOST:PORT/):
+- On connect the server sends a text message with the stream settings:
+  {"fs", "fps", "byte_num_range", "pitchmin", "pitchmax", "centroids",
+   "frame_bytes", "fields"}
+- Each frame follows as a binary message of FRAME_DTYPE (little-endian):
+  frame number (uint32), then volume, balance, width, centroid index
+  and pitch (uint16), scaled as in the exported data files. Volume and
+  width are scaled to their peak so far, since the song's maximums are
+  not known until it ends.
+- When the audio ends the server closes the connection.
+
+Backpressure: a frame is a few bytes, so socket buffers alone would hold
+minutes of them for a client that stopped reading, and deliver them all
+late. The server follows every frame with a ping carrying the number of
+frames sent so far, and stops writing to a client once more than
+CLIENT_WINDOW_FRAMES of them are unanswered by its pong. Frames then
+wait in the client's queue, which keeps at most CLIENT_QUEUE_FRAMES
+(dropping the oldest), and frames older than MAX_FRAME_AGE_FRAMES frame
+periods are discarded instead of sent. Dropped frames are counted in
+the client's log line on disconnect. A slow or stalled client gets at
+most a window of late frames, never holds up the others and never makes
+the server buffer without bound.
+
+Usage:
+    python live_server.py <audio.wav | -> <stem_analysis.json>
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from analysis_format import read_sections
+from analysis_plan import get_plan
+from audio_source import WavSource
+from streaming import StreamFrames, StreamingAnalyzer
+
+
+# Network settings; keep HOST on the loopback interface unless the
+# installation needs clients on other machines
+HOST: str = '127.0.0.1'
+PORT: int = 3002
+
+# Sample rate of raw stdin audio
+STDIN_FS: int = 44100
+
+# Frames queued per client before the oldest are dropped
+CLIENT_QUEUE_FRAMES: int = 8
+
+# Frames sent to a client but not yet acknowledged (by the pong to the
+# ping after them) before the server stops writing to it
+CLIENT_WINDOW_FRAMES: int = 3
+
+# Queued frames older than this many frame periods are dropped, not sent
+MAX_FRAME_AGE_FRAMES: int = 2
+
+# Exported values are scaled to 0..EXPORT_RANGE, as in the data files
+EXPORT_RANGE: int = 65535
+
+# Binary frame message layout
+FRAME_DTYPE = np.dtype([
+    ('frame', '<u4'),
+    ('volume', '<u2'),
+    ('balance', '<u2'),
+    ('width', '<u2'),
+    ('centroid_index', '<u2'),
+    ('pitch', '<u2'),
+])
+
+# RFC 6455 handshake GUID and opcodes
+WEBSOCKET_GUID: str = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OPCODE_TEXT: int = 0x1
+OPCODE_BINARY: int = 0x2
+OPCODE_CLOSE: int = 0x8
+OPCODE_PING: int = 0x9
+OPCODE_PONG: int = 0xA
+
+# Largest client message accepted (clients only send control frames)
+MAX_CLIENT_MESSAGE: int = 1 << 16
+
+
+def load_codebook(json_path: str | Path) -> tuple[NDArray[np.float64], dict[str, Any]]:
+    """
+    Read the centroids a stem was quantized against from its exported files.
+    
+    Args:
+        json_path: The stem's _analysis.json file.
+    
+    Returns:
+        Tuple of (centroids, track): centroids of shape (centroids, bins)
+        scaled back to [0, 1], and the JSON's track metadata.
+    
+    Raises:
+        ValueError: If the stem is entirely quiet (no codebook) or its
+                    data file has no centroids.
+    """
+    json_path = Path(json_path)
+    with open(json_path, encoding='utf-8') as f:
+        data = json.load(f)
+    track = data['track']
+    if track.get('allquietsamples'):
+        raise ValueError(f"{json_path.name}: quiet stem, no codebook exported")
+    
+    if 'codebook' in track:
+        # Shared codebook file: the centroids alone, uint16
+        shape = track['codebook']['centroids']
+        values = np.fromfile(json_path.parent / track['codebook']['file'], dtype='<u2')
+    else:
+        shapes = {name: shape for entry in data['structure'].values() for name, shape in entry.items()}
+        shape = shapes['centroids']
+        datafile = json_path.parent / f"{track['filename']}_analysis.data"
+        if track.get('data_format', 1) == 1:
+            # Sections back to back, in structure order
+            offset = 0
+            for entry in data['structure'].values():
+                (name, (rows, columns)), = entry.items()
+                if name == 'centroids':
+                    break
+                offset += rows * columns
+            values = np.fromfile(datafile, dtype='<u2', count=shape[0] * shape[1], offset=offset * 2)
+        else:
+            values = read_sections(np.fromfile(datafile, dtype=np.uint8))['centroids']
+    
+    if shape[0] == 0 or values.size != shape[0] * shape[1]:
+        raise ValueError(f"{json_path.name}: no centroids of shape {shape} found")
+    centroids = values.reshape(shape).astype(np.float64) / track['byte_num_range']
+    return centroids, track
+
+
+class FrameEncoder:
+    """
+    Scales StreamFrames to FRAME_DTYPE messages.
+    
+    Args:
+        fs: Sample rate in Hz.
+        fps: Frames per second.
+    
+    Attributes:
+        maxf0: Pitch that scales to EXPORT_RANGE.
+        maxvolume: Peak volume so far.
+        maxwidth: Peak width so far.
+    """
+    
+    def __init__(self, fs: int, fps: int) -> None:
+        self.maxf0 = get_plan(fs, fps).harmonic.maxf0
+        self.maxvolume = 0.0
+        self.maxwidth = 0.0
+    
+    def encode(self, frames: StreamFrames) -> list[bytes]:
+        """
+        Encode frames, one message each.
+        
+        Returns:
+            The binary messages, in frame order.
+        """
+        if len(frames) == 0:
+            return []
+        self.maxvolume = max(self.maxvolume, float(frames.volumes.max()))
+        self.maxwidth = max(self.maxwidth, float(frames.widths.max()))
+        
+        records = np.zeros(len(frames), dtype=FRAME_DTYPE)
+        records['frame'] = np.arange(frames.start, frames.start + len(frames))
+        records['volume'] = _scale(frames.volumes / (self.maxvolume or 1.0) * EXPORT_RANGE)
+        records['balance'] = _scale(np.round(frames.balances * (EXPORT_RANGE / 2)) + (EXPORT_RANGE // 2))
+        records['width'] = _scale(frames.widths / (self.maxwidth or 1.0) * EXPORT_RANGE)
+        records['centroid_index'] = frames.indexes
+        records['pitch'] = _scale(frames.pitch / self.maxf0 * EXPORT_RANGE)
+        return [record.tobytes() for record in records]
+
+
+class LiveServer:
+    """
+    WebSocket server that broadcasts frames to every connected client.
+    
+    Args:
+        hello: Stream settings sent to each client as it connects.
+        max_age: Seconds after broadcast() a frame is dropped rather
+                 than sent.
+        host: Interface to listen on.
+        port: TCP port.
+    
+    Attributes:
+        clients: Connected clients.
+    """
+    
+    def __init__(
+        self,
+        hello: dict[str, Any],
+        max_age: float,
+        host: str = HOST,
+        port: int = PORT
+    ) -> None:
+        self.hello = json.dumps(hello).encode('utf-8')
+        self.max_age = max_age
+        self.host = host
+        self.port = port
+        self.clients: set[_Client] = set()
+        self._server: asyncio.AbstractServer | None = None
+    
+    async def start(self) -> None:
+        """Start listening."""
+        self._server = await asyncio.start_server(self._connect, self.host, self.port)
+        print(f"Live feature server on ws://{self.host}:{self.port}/")
+    
+    def broadcast(self, messages: list[bytes]) -> None:
+        """Queue binary messages for every client, dropping what slow clients can't take."""
+        pushed = time.perf_counter()
+        for client in self.clients:
+            for message in messages:
+                client.offer(pushed, message)
+    
+    async def close(self) -> None:
+        """Close every connection and stop listening."""
+        if self._server is not None:
+            self._server.close()
+        clients = list(self.clients)
+        for client in clients:
+            client.finish()
+        await asyncio.gather(*(client.done.wait() for client in clients))
+        if self._server is not None:
+            await self._server.wait_closed()
+    
+    async def _connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve one connection, from handshake to close."""
+        peer = writer.get_extra_info('peername')
+        try:
+            if not await _handshake(reader, writer):
+                return
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            writer.close()
+            return
+        
+        client = _Client(writer, self.max_age)
+        client.send(OPCODE_TEXT, self.hello)
+        self.clients.add(client)
+        print(f"Client {peer} connected")
+        
+        sender = asyncio.create_task(client.run())
+        try:
+            await _receive(reader, client)
+        finally:
+            self.clients.discard(client)
+            client.finish()
+            await sender
+            print(f"Client {peer} disconnected ({client.dropped} frames dropped)")
+
+
+class _Client:
+    """One WebSocket connection, with its bounded frame queue and send window."""
+    
+    def __init__(self, writer: asyncio.StreamWriter, max_age: float) -> None:
+        self.writer = writer
+        self.max_age = max_age
+        self.queue: asyncio.Queue[tuple[float, bytes] | None] = asyncio.Queue(CLIENT_QUEUE_FRAMES)
+        self.dropped = 0
+        self.closing = False
+        self.done = asyncio.Event()
+        # Frames sent, and frames the client has acknowledged with a pong
+        self.sent = 0
+        self.acked = 0
+        self._ackevent = asyncio.Event()
+    
+    def offer(self, pushed: float, message: bytes) -> None:
+        """Queue a frame broadcast at perf_counter() time pushed, dropping the oldest queued one if full."""
+        if self.closing:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait((pushed, message))
+    
+    def acknowledge(self, count: int) -> None:
+        """Record a pong: the client has read the first count frames."""
+        if self.acked < count <= self.sent:
+            self.acked = count
+            self._ackevent.set()
+    
+    def finish(self) -> None:
+        """Send the queued frames that are still current, then close."""
+        if self.closing:
+            return
+        self.closing = True
+        self._ackevent.set()
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(None)
+    
+    def send(self, opcode: int, payload: bytes) -> None:
+        """Write one unmasked, unfragmented message."""
+        self.writer.write(_frame_header(opcode, len(payload)) + payload)
+    
+    async def run(self) -> None:
+        """Send queued frames until finish()."""
+        try:
+            while (item := await self.queue.get()) is not None:
+                pushed, message = item
+                if time.perf_counter() - pushed > self.max_age:
+                    self.dropped += 1
+                    continue
+                self.sent += 1
+                self.send(OPCODE_BINARY, message)
+                self.send(OPCODE_PING, struct.pack('!I', self.sent))
+                await self.writer.drain()
+                # A client that hasn't read the last window of frames gets no
+                # more; new frames wait (and age) in the queue meanwhile
+                while self.sent - self.acked >= CLIENT_WINDOW_FRAMES and not self.closing:
+                    self._ackevent.clear()
+                    await self._ackevent.wait()
+            self.send(OPCODE_CLOSE, struct.pack('!H', 1000))
+            await self.writer.drain()
+        except (OSError, RuntimeError):
+            pass  # Connection lost
+        finally:
+            self.writer.close()
+            self.done.set()
+
+
+async def serve(
+    source: str,
+    stem_json: str | Path,
+    host: str = HOST,
+    port: int = PORT
+) -> None:
+    """
+    Analyze audio in real time and push its frames to WebSocket clients.
+    
+    Returns when the audio ends, after closing every connection.
+    
+    Args:
+        source: WAV file path, or '-' for raw stereo float32 on stdin at
+                STDIN_FS.
+        stem_json: Exported _analysis.json of the stem whose codebook
+                   the frames are quantized against.
+        host: Interface to listen on.
+        port: TCP port.
+    
+    Raises:
+        ValueError: If the codebook doesn't match the audio's sample rate
+                    (see StreamingAnalyzer) or the stem has none.
+    """
+    centroids, track = load_codebook(stem_json)
+    fps = track['fps']
+    wav = None if source == '-' else WavSource(source)
+    fs = STDIN_FS if wav is None else wav.fs
+    analyzer = StreamingAnalyzer(fs, fps, centroids)
+    encoder = FrameEncoder(fs, fps)
+    plan = get_plan(fs, fps)
+    
+    server = LiveServer({
+        'fs': fs,
+        'fps': fps,
+        'byte_num_range': EXPORT_RANGE,
+        'pitchmin': plan.harmonic.minf0,
+        'pitchmax': plan.harmonic.maxf0,
+        'centroids': list(centroids.shape),
+        'frame_bytes': FRAME_DTYPE.itemsize,
+        'fields': list(FRAME_DTYPE.names),
+    }, MAX_FRAME_AGE_FRAMES / fps, host, port)
+    await server.start()
+    
+    # One frame's worth of samples at a time keeps latency near the bound
+    blocklen = -(-fs // fps)
+    blocks = _wav_blocks(wav, blocklen) if wav is not None else _stdin_blocks(blocklen)
+    try:
+        async for left, right in blocks:
+            # Analysis runs in a thread, so clients are served meanwhile
+            frames = await asyncio.to_thread(analyzer.push, left, right)
+            server.broadcast(encoder.encode(frames))
+        server.broadcast(encoder.encode(analyzer.flush()))
+    finally:
+        await server.close()
+    
+    print(f"Stream ended after {analyzer.emitted} frames, max latency "
+          f"{analyzer.max_latency * 1000:.0f} ms (bound {analyzer.latency_bound * 1000:.0f} ms)")
+
+
+async def _wav_blocks(wav: WavSource, blocklen: int):
+    """Yield (left, right) blocks of a WAV file at playback speed."""
+    started = time.perf_counter()
+    for start in range(0, len(wav), blocklen):
+        stop = min(start + blocklen, len(wav))
+        # Wait until the block has "played"
+        delay = started + stop / wav.fs - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        left, right = wav.read(start, stop)
+        yield np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64)
+
+
+async def _stdin_blocks(blocklen: int):
+    """Yield (left, right) blocks of raw stereo float32 samples from stdin, as they arrive."""
+    framebytes = 2 * 4
+    stdin = sys.stdin.buffer
+    pending = b''
+    while True:
+        # read1 returns what is available, so blocks are not held back
+        chunk = await asyncio.to_thread(stdin.read1, blocklen * framebytes - len(pending))
+        if not chunk:
+            break
+        pending += chunk
+        usable = len(pending) - len(pending) % framebytes
+        if usable:
+            samples = np.frombuffer(pending[:usable], dtype='<f4').reshape(-1, 2).astype(np.float64)
+            pending = pending[usable:]
+            yield samples[:, 0], samples[:, 1]
+
+
+async def _handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+    """
+    Answer a WebSocket opening handshake.
+    
+    Returns:
+        True if the connection was upgraded; False after an HTTP error
+        response.
+    """
+    request = await reader.readuntil(b'\r\n\r\n')
+    lines = request.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    
+    key = headers.get('sec-websocket-key')
+    if not lines[0].startswith('GET ') or 'websocket' not in headers.get('upgrade', '').lower() or not key:
+        writer.write(b'HTTP/1.1 426 Upgrade Required\r\nSec-WebSocket-Version: 13\r\n'
+                     b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        writer.close()
+        return False
+    
+    accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('latin-1')).digest())
+    writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                 b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+    await writer.drain()
+    return True
+
+
+async def _receive(reader: asyncio.StreamReader, client: _Client) -> None:
+    """Handle client messages (pings and close) until the connection ends."""
+    try:
+        while not client.closing:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length, = struct.unpack('!H', await reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack('!Q', await reader.readexactly(8))
+            if length > MAX_CLIENT_MESSAGE:
+                break
+            mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+            
+            if opcode == OPCODE_CLOSE:
+                break
+            if opcode == OPCODE_PING:
+                client.send(OPCODE_PONG, payload)
+            elif opcode == OPCODE_PONG and len(payload) == 4:
+                client.acknowledge(struct.unpack('!I', payload)[0])
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+
+
+def _frame_header(opcode: int, length: int) -> bytes:
+    """Header of a final, unmasked WebSocket frame."""
+    if length < 126:
+        return struct.pack('!BB', 0x80 | opcode, length)
+    if length < 1 << 16:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length)
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+
+def _scale(values: NDArray[np.float64]) -> NDArray[np.uint16]:
+    """Round and clip scaled values to uint16."""
+    return np.clip(np.round(values), 0, EXPORT_RANGE).astype(np.uint16)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Push live analysis frames to WebSocket clients.")
+    parser.add_argument('source', help="WAV file, or - for raw stereo float32 on stdin")
+    parser.add_argument('stem_json', help="exported _analysis.json whose codebook to quantize against")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    asyncio.run(serve(args.source, args.stem_json, args.host, args.port))
@@ -6,12 +6,24 @@ audio stems and generates visualization data. It performs the complete workflow:
 
 1. Discover audio files in the source directory
 2. Generate MP3 files from WAV masters for web playback
-3. Split stereo files into left/right channels for analysis
+3. Map stereo stems so analysis reads left/right chunks on demand
 4. Run spectral analysis (STFT, harmonics) via the analysis module
 5. Perform K-means clustering to find spectral "fingerprints"
 6. Vector quantize samples to their nearest centroids
 7. Export binary data files and JSON metadata for the frontend
 
+Stems whose audio and parameters are unchanged since a previous run are
+copied from a content-addressed analysis cache instead (see
+analysis_cache.py); the cache key is recorded in each stem's JSON. The
+cache also keeps each stage's output (analysis arrays, centroids,
+assignments), so changing a clustering or export setting reruns only the
+stages downstream of it.
+
+Optionally, all stems of a song share one codebook: k-means runs once over
+frames sampled from every stem, each stem is quantized against the
+result, and the centroids are written once to {song}_codebook.data, which
+every stem's JSON references instead of carrying its own centroids.
+
 The output consists of:
 - MP3 audio file for web playback
 - JSON metadata files with track info and data structure
@@ -24,21 +36,70 @@ Configure source/destination paths and parameters in the analyze() function.
 """
 from __future__ import annotations
 
+import glob
+import hashlib
 import json
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, fields
 from pathlib import Path
 from subprocess import CalledProcessError, check_output
 from typing import Any
 
 import numpy as np
 from numpy.typing import NDArray
-from smstools.models import utilFunctions as UF
 
-from analysis import analysis
-from kmeans import kmeans
+from analysis import NOISE_THRESHOLD, AnalysisResult, analysis
+from analysis_cache import AnalysisCache
+from analysis_format import (
+    ANALYSIS_FORMAT_VERSION, allocate_sections, encode_deltas, pack_bundle, write_precompressed
+)
+from analysis_plan import get_plan
+from audio_source import AudioSource, WavSource
+from kmeans import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_TRAINING_BYTES, DEFAULT_TOL, KMEANS_ITERATIONS_MULTIPLIER,
+    kmeans, kmeans_fit, training_set
+)
 from vector_quantize import vector_quantize
 
 
+# Clustering settings
+CENTROID_COUNT: int = 24  # Number of spectral "fingerprints"
+VQ_UPDATE_COUNT: int = 1  # K-means iterations multiplier
+KMEANS_MODE: str = 'full'  # 'full', or 'minibatch' for long stems / catalog runs
+KMEANS_BATCH_SIZE: int = DEFAULT_BATCH_SIZE  # Frames per mini-batch
+KMEANS_TOL: float = DEFAULT_TOL  # Convergence tolerance
+KMEANS_MAX_TRAINING_BYTES: int = DEFAULT_MAX_TRAINING_BYTES  # Training matrix memory cap
+VQ_METHOD: str = 'blocked'  # 'blocked', or 'pruned' (exact, slower unless the codebook is huge and frames very coherent)
+
+# Export settings
+EXPORT_RANGE: int = 65535  # Exported values are scaled to 0..EXPORT_RANGE (uint16 max)
+EXPORT_VERSION: int = 3  # Bump when _export_results() output changes
+DATA_FORMAT: int = ANALYSIS_FORMAT_VERSION  # 1 writes the legacy headerless uint16 layout
+SEGMENT_SECONDS: int = 0  # > 0 splits per-frame data into files of this many seconds
+CODEBOOK_SUFFIX: str = '_codebook.data'  # Shared codebook file, after the song name
+BUNDLE_SUFFIX: str = '_bundle.data'  # Song bundle file, after the song name
+
+
+@dataclass(frozen=True, eq=False)
+class SharedCodebook:
+    """
+    Codebook shared by all stems of a song.
+    
+    Attributes:
+        key: Cache key of the codebook (covers every stem's analysis and
+             the clustering settings).
+        filename: Codebook file name, relative to the stem JSON files.
+        centroids: Centroids, shape (centroidcount, bins).
+    """
+    key: str
+    filename: str
+    centroids: NDArray[np.float64]
+
+
 def analyze() -> None:
     """
     Main analysis function that processes audio files for visualization.
@@ -49,12 +110,16 @@ def analyze() -> None:
     The function:
     1. Lists all WAV files matching the master filename pattern
     2. Creates an MP3 version of the master file for web playback
-    3. For each stem file:
-       - Splits stereo to left/right channels
+    3. With sharedcodebook, analyzes every stem and clusters frames
+       sampled from all of them into one codebook for the song
+    4. For each stem file (several at once, longest first):
+       - Maps the stereo file and reads it chunk by chunk
        - Performs STFT and harmonic analysis
-       - Clusters spectral frames using K-means
+       - Clusters spectral frames using K-means (unless shared)
        - Vector quantizes frames to centroids
        - Exports JSON metadata and binary data files
+    5. With bundle, packs the output files of every stem into one file,
+       so the frontend loads the song with a single request
     
     Configuration (modify these values as needed):
         thename: Song/project name (folder name)
@@ -65,12 +130,28 @@ def analyze() -> None:
         writemp3: Whether to generate MP3 file
         limit: Maximum number of stems to process
         skipcount: Number of stems to skip (for partial processing)
+        stemworkers: Maximum number of stems processed concurrently
+        workers: Number of processes used to analyze each stem's chunks
+        cachefolder: Analysis cache folder, or None to always re-analyze
+        cachemaxbytes: Cache size above which old entries are evicted
+        sharedcodebook: Train one codebook for all stems of the song
+        bundle: Also write a song bundle of all stem outputs
     
     Output files:
-        - _analysis_files.json: List of processed audio files
+        - _analysis_files.json: List of processed audio files (and the
+          song bundle, if any)
         - {masterfile}.mp3: Compressed audio for web playback
+        - {masterfile}_codebook.data: Shared centroids (sharedcodebook only)
         - {stemfile}_analysis.json: Metadata and structure info
-        - {stemfile}_analysis.data: Binary visualization data
+        - {stemfile}_analysis.data: Binary visualization data, with .gz
+          and .br compressed copies for static serving
+        - {stemfile}_analysis.NNNN.data: Time segments of the per-frame
+          data (SEGMENT_SECONDS > 0 only), also precompressed
+        - {masterfile}_bundle.data: Every stem's JSON and data files in
+          one file (bundle only), also precompressed
+    
+    Raises:
+        ValueError: If SEGMENT_SECONDS > 0 with a DATA_FORMAT below 2.
     """
     # Configuration
     thename: str = 'Details'
@@ -86,6 +167,27 @@ def analyze() -> None:
     writemp3: bool = True  # Whether to generate MP3 file
     fps: int = 24  # Target frames per second for visualization
     
+    # Concurrency: stemworkers stems run at once, each fanning its chunks
+    # out over workers processes, so the total stays near the core count
+    cpucount: int = os.cpu_count() or 1
+    stemworkers: int = min(4, cpucount)  # Stems analyzed concurrently
+    workers: int = max(1, cpucount // stemworkers)  # Chunk processes per stem
+    
+    # Unchanged stems are served from the analysis cache
+    cachefolder: str | None = '/Users/tometz/Documents/Clients/Audiovis/cache/'
+    cachemaxbytes: int = 4 * 1024**3
+    cache = AnalysisCache(cachefolder, cachemaxbytes) if cachefolder else None
+    
+    # One k-means codebook for the whole song instead of one per stem
+    sharedcodebook: bool = False
+    
+    # Also pack all stem outputs into one file, fetched in one request
+    bundle: bool = False
+    
+    # Fail before any stem is analyzed rather than at its export
+    if SEGMENT_SECONDS > 0 and DATA_FORMAT < 2:
+        raise ValueError("Segmented export (SEGMENT_SECONDS > 0) needs DATA_FORMAT 2 or later")
+    
     # File discovery
     audiofiles: list[str] = _discover_audio_files(
         TheFolder, masterfile, masterfilestring, limit=100
@@ -93,9 +195,11 @@ def analyze() -> None:
     
     # Save list of audio files to JSON
     _save_file_list(TheDestFolder, masterfile, audiofiles)
+    listedfiles: list[str] = audiofiles
     
     # Skip some files if needed (for partial/incremental processing)
-    # Set skipcount > 0 to resume processing after a certain number of already-processed files
+    # Set skipcount > 0 to resume processing after a certain number of already-processed files.
+    # With the analysis cache enabled, unchanged stems are cheap to re-run anyway.
     skipcount: int = 0
     if skipcount > 0:
         audiofiles = audiofiles[skipcount:]
@@ -105,14 +209,40 @@ def analyze() -> None:
     if writemp3:
         _create_mp3(TheFolder, TheDestFolder, masterfile, startingpos)
     
-    # Process each audio stem
-    total_tracks = len(audiofiles)
-    for i, filename in enumerate(audiofiles, start=1):
-        print(f"\n[{i}/{total_tracks}] Processing: {filename}")
-        _process_stem(
-            filename, TheFolder, TheDestFolder, masterfilestring,
-            startingpos, fps
+    # A shared codebook needs every stem's analysis twice (for training,
+    # then for quantizing), so keep them in a temporary cache if there is
+    # no analysis cache
+    tempcache: tempfile.TemporaryDirectory[str] | None = None
+    if sharedcodebook and cache is None:
+        tempcache = tempfile.TemporaryDirectory(prefix='audiovis-')
+        cache = AnalysisCache(tempcache.name, sys.maxsize)
+    
+    # Analysis keys of the stems, once computed for the shared codebook
+    analysiskeys: dict[str, str] = {}
+    try:
+        codebook: SharedCodebook | None = None
+        if sharedcodebook:
+            codebook, analysiskeys = _train_shared_codebook(
+                audiofiles, TheFolder, TheDestFolder, masterfilestring,
+                startingpos, fps, stemworkers, workers, cache
+            )
+        
+        # Process the audio stems, longest first
+        _schedule_stems(
+            audiofiles, TheFolder, TheDestFolder, masterfilestring,
+            startingpos, fps, stemworkers, workers, cache, codebook, analysiskeys
         )
+        
+        # Point the frontend at the bundle once it is written
+        if bundle:
+            songbundle = _write_bundle(TheDestFolder, masterfilestring, listedfiles)
+            _save_file_list(TheDestFolder, masterfile, listedfiles, songbundle)
+    finally:
+        # The training pass pinned the analyses for the quantization pass
+        if cache is not None:
+            cache.unpin(analysiskeys.values())
+        if tempcache is not None:
+            tempcache.cleanup()
 
 
 def _discover_audio_files(
@@ -155,7 +285,12 @@ def _discover_audio_files(
     return audiofiles
 
 
-def _save_file_list(dest_folder: str, masterfile: str, audiofiles: list[str]) -> None:
+def _save_file_list(
+    dest_folder: str,
+    masterfile: str,
+    audiofiles: list[str],
+    bundle: dict[str, str] | None = None
+) -> None:
     """
     Save list of audio files to JSON for the frontend.
     
@@ -163,6 +298,8 @@ def _save_file_list(dest_folder: str, masterfile: str, audiofiles: list[str]) ->
         dest_folder: Destination directory for the JSON file.
         masterfile: Name of the master audio file.
         audiofiles: List of stem audio filenames.
+        bundle: Song bundle from _write_bundle(), listed for the frontend
+                to load the stems from.
     """
     mp3file = masterfile[:-4] + '.mp3' if masterfile.endswith('.wav') else masterfile
     
@@ -170,12 +307,62 @@ def _save_file_list(dest_folder: str, masterfile: str, audiofiles: list[str]) ->
         'mp3file': mp3file,
         'audiofiles': audiofiles
     }]
+    if bundle is not None:
+        data[0]['bundle'] = bundle
     
     output_path = Path(dest_folder) / '_analysis_files.json'
     with open(output_path, 'w', encoding='utf-8') as outfile:
         json.dump(data, outfile, indent=2)
 
 
+def _write_bundle(dest_folder: str, masterfilestring: str, audiofiles: list[str]) -> dict[str, str]:
+    """
+    Pack the exported files of every stem into one song bundle.
+    
+    The bundle holds each stem's _analysis.json, its data file and data
+    segments, and the shared codebook, under the names the frontend would
+    otherwise request them by. It is written with precompressed copies,
+    like the data files.
+    
+    Args:
+        dest_folder: Output folder of the stems.
+        masterfilestring: Song name (master filename without extension).
+        audiofiles: Stem filenames, as listed in _analysis_files.json.
+    
+    Returns:
+        Dictionary with the bundle's 'file' name and a 'version' that
+        changes with its contents (for cache busting).
+    """
+    dest_path = Path(dest_folder)
+    files: dict[str, bytes] = {}
+    for filename in audiofiles:
+        jsonfile = f'{filename}_analysis.json'
+        try:
+            contents = (dest_path / jsonfile).read_bytes()
+        except FileNotFoundError:
+            print(f"Warning: {jsonfile} not found, leaving {filename} out of the bundle")
+            continue
+        files[jsonfile] = contents
+        
+        track = json.loads(contents)['track']
+        if track['allquietsamples']:
+            continue
+        names = [f'{filename}_analysis.data']
+        names += [segment['file'] for segment in track.get('segments', [])]
+        if 'codebook' in track:
+            names.append(track['codebook']['file'])
+        for name in names:
+            if name not in files:
+                files[name] = (dest_path / name).read_bytes()
+    
+    bundlefile = f'{masterfilestring}{BUNDLE_SUFFIX}'
+    packed = pack_bundle(files)
+    write_precompressed(dest_path / bundlefile, packed)
+    print(f"{bundlefile}: {len(files)} files, {packed.size} bytes")
+    
+    return {'file': bundlefile, 'version': hashlib.sha256(packed).hexdigest()}
+
+
 def _create_mp3(
     source_folder: str,
     dest_folder: str,
@@ -227,17 +414,143 @@ def _create_mp3(
         pass  # File may not exist if previous step failed
 
 
+def _schedule_stems(
+    audiofiles: list[str],
+    source_folder: str,
+    dest_folder: str,
+    masterfilestring: str,
+    startingpos: int,
+    fps: int,
+    stemworkers: int,
+    workers: int = 1,
+    cache: AnalysisCache | None = None,
+    codebook: SharedCodebook | None = None,
+    analysiskeys: dict[str, str] | None = None
+) -> dict[str, float]:
+    """
+    Run _process_stem() for every stem with at most stemworkers at once.
+    
+    Stems are started longest-first (by file size, which is proportional
+    to duration for stems rendered in the same format) so the long ones
+    don't end up running alone at the end of the batch.
+    
+    Args:
+        audiofiles: Stem filenames to process.
+        source_folder: Directory containing source WAV files.
+        dest_folder: Directory for output files.
+        masterfilestring: Master file base name.
+        startingpos: Start position in seconds for trimming.
+        fps: Target frames per second for visualization.
+        stemworkers: Maximum number of stems processed concurrently.
+        workers: Number of processes used for each stem's chunk analysis.
+        cache: Analysis cache to serve unchanged stems from, if any.
+        codebook: Shared codebook to quantize every stem against, if any.
+        analysiskeys: Analysis cache keys already computed for stems, by
+                      filename, so their files are not hashed again.
+    
+    Returns:
+        Dictionary mapping each stem filename to its wall time in seconds.
+    
+    Raises:
+        ValueError: If stemworkers is not positive.
+    """
+    if stemworkers <= 0:
+        raise ValueError(f"stemworkers must be positive, got {stemworkers}")
+    analysiskeys = analysiskeys or {}
+    
+    source_path = Path(source_folder)
+    ordered = sorted(
+        audiofiles,
+        key=lambda filename: (source_path / filename).stat().st_size,
+        reverse=True
+    )
+    
+    total_tracks = len(ordered)
+    walltimes: dict[str, float] = {}
+    starttime = time.perf_counter()
+    runstart = time.time()
+    
+    if stemworkers == 1 or total_tracks <= 1:
+        for i, filename in enumerate(ordered, start=1):
+            print(f"\n[{i}/{total_tracks}] Processing: {filename}")
+            walltimes[filename] = _timed_process_stem(
+                filename, source_folder, dest_folder, masterfilestring,
+                startingpos, fps, workers, cache, codebook, analysiskeys.get(filename)
+            )
+    else:
+        with ProcessPoolExecutor(max_workers=min(stemworkers, total_tracks)) as pool:
+            futures = {
+                pool.submit(
+                    _timed_process_stem, filename, source_folder, dest_folder,
+                    masterfilestring, startingpos, fps, workers, cache, codebook,
+                    analysiskeys.get(filename)
+                ): filename
+                for filename in ordered
+            }
+            for i, future in enumerate(as_completed(futures), start=1):
+                filename = futures[future]
+                walltimes[filename] = future.result()
+                print(f"\n[{i}/{total_tracks}] Finished: {filename} "
+                      f"({walltimes[filename]:.1f}s)")
+    
+    # Per-stem wall time report
+    print(f"\nProcessed {total_tracks} stems in {time.perf_counter() - starttime:.1f}s "
+          f"({stemworkers} stem workers x {workers} chunk workers)")
+    for filename in ordered:
+        print(f"  {walltimes[filename]:8.1f}s  {filename}")
+    
+    if cache is not None:
+        stats = cache.stats(since=runstart)
+        print(f"Analysis cache: {stats['hit']} hits, {stats['miss']} misses, "
+              f"{stats['evict']} evictions")
+    
+    return walltimes
+
+
+def _timed_process_stem(
+    filename: str,
+    source_folder: str,
+    dest_folder: str,
+    masterfilestring: str,
+    startingpos: int,
+    fps: int,
+    workers: int = 1,
+    cache: AnalysisCache | None = None,
+    codebook: SharedCodebook | None = None,
+    analysiskey: str | None = None
+) -> float:
+    """
+    Run _process_stem() and return its wall time in seconds.
+    
+    Module-level so it can be submitted to a process pool.
+    """
+    starttime = time.perf_counter()
+    _process_stem(
+        filename, source_folder, dest_folder, masterfilestring,
+        startingpos, fps, workers, cache, codebook, analysiskey
+    )
+    return time.perf_counter() - starttime
+
+
 def _process_stem(
     filename: str,
     source_folder: str,
     dest_folder: str,
     masterfilestring: str,
     startingpos: int,
-    fps: int
+    fps: int,
+    workers: int = 1,
+    cache: AnalysisCache | None = None,
+    codebook: SharedCodebook | None = None,
+    analysiskey: str | None = None
 ) -> None:
     """
     Process a single audio stem file and export visualization data.
     
+    With a cache, the stem is served from it on a hit (outputs that
+    already carry the current cache key are left as they are), and
+    analyzed, exported and added to the cache on a miss.
+    
     Args:
         filename: Name of the stem audio file.
         source_folder: Directory containing source WAV files.
@@ -245,102 +558,321 @@ def _process_stem(
         masterfilestring: Master file base name (unused but kept for API).
         startingpos: Start position in seconds for trimming.
         fps: Target frames per second for visualization.
+        workers: Number of processes used for chunk analysis.
+        cache: Analysis cache, or None to always analyze.
+        codebook: Shared codebook to quantize against instead of
+                  clustering the stem on its own, if any.
+        analysiskey: The stem's analysis cache key, if already computed.
     """
-    # Split stereo file into left and right channels using sox
-    fileleft = f'_Split_{filename}.l.wav'
-    fileright = f'_Split_{filename}.r.wav'
+    audio_path = Path(source_folder) / filename
+    source = _open_stem(audio_path, startingpos)
+    if source is None:
+        return
+    fs = source.fs
     
-    source_path = Path(source_folder)
+    stagekeys: dict[str, str] | None = None
+    if cache is not None:
+        stagekeys = _stage_keys(
+            cache, audio_path, filename, fs, fps, startingpos, codebook, analysiskey
+        )
+        if cache.fetch(stagekeys['export'], dest_folder, filename):
+            print(f"{filename}: served from analysis cache")
+            return
     
-    soxleft = ['sox', str(source_path / filename), str(source_path / fileleft), 'remix', '1']
-    soxright = ['sox', str(source_path / filename), str(source_path / fileright), 'remix', '2']
+    # Perform analysis
+    result = _analyze_and_cluster(
+        filename, fs, fps, source, workers, cache, stagekeys, codebook
+    )
     
-    try:
-        check_output(soxleft)
-        check_output(soxright)
-    except CalledProcessError as e:
-        print(f"Warning: Failed to split {filename}: {e}")
-        return
+    # Export results
+    cachekey = stagekeys['export'] if stagekeys else None
+    _export_results(filename, dest_folder, fs, fps, result, cachekey, codebook)
+    
+    if cache is not None:
+        cache.store(cachekey, dest_folder, filename)
+
+
+def _stage_keys(
+    cache: AnalysisCache,
+    audio_path: Path,
+    filename: str,
+    fs: int,
+    fps: int,
+    startingpos: int,
+    codebook: SharedCodebook | None = None,
+    analysiskey: str | None = None
+) -> dict[str, str]:
+    """
+    Compute the cache key of every pipeline stage of a stem.
+    
+    Each stage's key covers its own settings and, through the previous
+    stage's key, everything upstream of it, so a changed setting only
+    invalidates its own stage and the ones after it. With a shared
+    codebook, the cluster stage's settings are the codebook's key.
+    
+    Args:
+        cache: Analysis cache.
+        audio_path: Path to the stem's WAV file.
+        filename: Stem filename (recorded in the exported JSON).
+        fs: Sample rate in Hz.
+        fps: Target frames per second.
+        startingpos: Start position in seconds for trimming.
+        codebook: Shared codebook the stem is quantized against, if any.
+        analysiskey: The analysis stage's key, if already computed; it
+                     is the only one that hashes the audio file.
+    
+    Returns:
+        Dictionary with 'analysis', 'cluster' (centroids and assignments)
+        and 'export' keys.
+    """
+    if analysiskey is None:
+        analysiskey = cache.key(audio_path, {
+            'fps': fps,
+            'startingpos': startingpos,
+            'plan': get_plan(fs, fps),
+            'noise_threshold': NOISE_THRESHOLD,
+        })
+    exportsettings: dict[str, Any] = {
+        'filename': filename,
+        'export_range': EXPORT_RANGE,
+        'export_version': EXPORT_VERSION,
+        'data_format': DATA_FORMAT,
+        'segment_seconds': SEGMENT_SECONDS,
+    }
+    if codebook is not None:
+        clustersettings: dict[str, Any] = {'codebook': codebook.key}
+        exportsettings['codebook_file'] = codebook.filename
+    else:
+        clustersettings = _cluster_settings()
+    clusterkey = cache.derive(analysiskey, {**clustersettings, 'vq_method': VQ_METHOD})
+    exportkey = cache.derive(clusterkey, exportsettings)
+    return {'analysis': analysiskey, 'cluster': clusterkey, 'export': exportkey}
+
+
+def _cluster_settings() -> dict[str, Any]:
+    """Settings that affect k-means centroids, for cache keys."""
+    return {
+        'centroidcount': CENTROID_COUNT,
+        'vqupdatecount': VQ_UPDATE_COUNT,
+        'kmeans_iterations_multiplier': KMEANS_ITERATIONS_MULTIPLIER,
+        'kmeans_mode': KMEANS_MODE,
+        'kmeans_batch_size': KMEANS_BATCH_SIZE,
+        'kmeans_tol': KMEANS_TOL,
+        'kmeans_max_training_bytes': KMEANS_MAX_TRAINING_BYTES,
+    }
+
+
+def _open_stem(audio_path: Path, startingpos: int) -> AudioSource | None:
+    """
+    Map a stereo WAV stem, skipping the intro portion.
+    
+    Samples are decoded chunk by chunk during analysis.
     
-    # Read the WAV files
+    Args:
+        audio_path: Path to the stem's WAV file.
+        startingpos: Start position in seconds for trimming.
+    
+    Returns:
+        The audio source, or None (with a warning) if it can't be read.
+    """
     try:
-        fs, x = UF.wavread(str(source_path / fileleft))
-        fs, x2 = UF.wavread(str(source_path / fileright))
-    except Exception as e:
-        print(f"Warning: Failed to read {filename}: {e}")
-        os.remove(source_path / fileleft)
-        os.remove(source_path / fileright)
-        return
+        source = WavSource(audio_path)
+        return source.region(startingpos * source.fs, len(source))
+    except (OSError, ValueError) as e:
+        print(f"Warning: Failed to read {audio_path.name}: {e}")
+        return None
+
+
+def _train_shared_codebook(
+    audiofiles: list[str],
+    source_folder: str,
+    dest_folder: str,
+    masterfilestring: str,
+    startingpos: int,
+    fps: int,
+    stemworkers: int,
+    workers: int,
+    cache: AnalysisCache
+) -> tuple[SharedCodebook | None, dict[str, str]]:
+    """
+    Cluster frames sampled from all stems of a song into one codebook.
+    
+    Every stem is analyzed (or its analysis loaded from the cache) and
+    contributes a sample of its non-quiet frames, with the total training
+    matrix kept within KMEANS_MAX_TRAINING_BYTES. K-means runs once over
+    all of them. The centroids are cached under a key covering every
+    stem's analysis key and the clustering settings, so an unchanged song
+    is not clustered again. The codebook file is written to dest_folder.
+    
+    Args:
+        audiofiles: Stem filenames.
+        source_folder: Directory containing source WAV files.
+        dest_folder: Directory for output files.
+        masterfilestring: Master file base name, used to name the codebook.
+        startingpos: Start position in seconds for trimming.
+        fps: Target frames per second for visualization.
+        stemworkers: Maximum number of stems analyzed concurrently.
+        workers: Number of processes used for each stem's chunk analysis.
+        cache: Analysis cache; the stems' analyses are stored in it for
+               the quantization pass, and pinned so that pass finds them
+               (the caller unpins them once the stems are processed).
     
-    # Delete split files (no longer needed)
-    os.remove(source_path / fileleft)
-    os.remove(source_path / fileright)
+    Returns:
+        Tuple of (codebook, analysiskeys): the shared codebook, or None
+        (with a warning) if the stems have fewer non-quiet frames than
+        CENTROID_COUNT altogether, and each stem's analysis cache key by
+        filename, for the quantization pass to reuse.
+    """
+    jobs: list[tuple[Any, ...]] = []
+    for filename in audiofiles:
+        audio_path = Path(source_folder) / filename
+        source = _open_stem(audio_path, startingpos)
+        if source is not None:
+            keys = _stage_keys(cache, audio_path, filename, source.fs, fps, startingpos)
+            jobs.append((filename, source_folder, startingpos, fps, workers, cache, keys))
+    analysiskeys = {job[0]: job[-1]['analysis'] for job in jobs}
+    # Pinned before the analyses are stored, so neither the training
+    # workers nor the quantization pass evict them
+    cache.pin(analysiskeys.values())
     
-    # Trim audio to remove intro portion
-    delta = startingpos * fs
-    x = x[delta:]
-    x2 = x2[delta:]
+    codebookkey = cache.derive('shared-codebook', {
+        'analyses': [keys['analysis'] for *_, keys in jobs],
+        **_cluster_settings(),
+    })
     
-    # Perform analysis
-    result = _analyze_and_cluster(filename, fs, fps, x, x2)
+    label = f'{masterfilestring}{CODEBOOK_SUFFIX}'
+    arrays = cache.load_arrays(codebookkey, 'centroids', label)
+    if arrays is not None:
+        print(f"{label}: reusing cached centroids")
+        centroids = arrays['centroids']
+    else:
+        # Split the training budget evenly between the stems
+        budget = KMEANS_MAX_TRAINING_BYTES // max(len(jobs), 1)
+        jobs = [job + (budget,) for job in jobs]
+        if stemworkers == 1 or len(jobs) <= 1:
+            samples = [_stem_training_set(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=min(stemworkers, len(jobs))) as pool:
+                samples = list(pool.map(_stem_training_set, *zip(*jobs)))
+        
+        samples = [sample for sample in samples if len(sample)]
+        if sum(len(sample) for sample in samples) < CENTROID_COUNT:
+            print(f"Warning: too few non-quiet frames for a shared codebook, "
+                  f"clustering each stem on its own")
+            return None, analysiskeys
+        
+        centroids = kmeans_fit(
+            np.concatenate(samples), CENTROID_COUNT, VQ_UPDATE_COUNT,
+            mode=KMEANS_MODE, batch_size=KMEANS_BATCH_SIZE, tol=KMEANS_TOL
+        )
+        cache.save_arrays(codebookkey, 'centroids', {'centroids': centroids}, label)
     
-    # Export results
-    _export_results(filename, dest_folder, fs, fps, result)
+    packed = np.empty(centroids.size, dtype=np.uint16)
+    _pack(packed, centroids.ravel() * EXPORT_RANGE, label)
+    write_precompressed(Path(dest_folder) / label, packed)
+    
+    return SharedCodebook(codebookkey, label, centroids), analysiskeys
+
+
+def _stem_training_set(
+    filename: str,
+    source_folder: str,
+    startingpos: int,
+    fps: int,
+    workers: int,
+    cache: AnalysisCache,
+    stagekeys: dict[str, str],
+    max_training_bytes: int
+) -> NDArray[np.float64]:
+    """
+    Analyze a stem and sample its frames for shared codebook training.
+    
+    Module-level so it can be submitted to a process pool.
+    
+    Returns:
+        Training frames of the stem, at most max_training_bytes of them.
+    """
+    source = _open_stem(Path(source_folder) / filename, startingpos)
+    if source is None:
+        return np.empty((0, 0))
+    analysisresult = _analyze_stem(filename, source.fs, fps, source, workers, cache, stagekeys)
+    return training_set(
+        analysisresult.stft, analysisresult.stft2, analysisresult.nonquietsamples,
+        max_training_bytes
+    )
 
 
 def _analyze_and_cluster(
     filename: str,
     fs: int,
     fps: int,
-    x: NDArray[np.float64],
-    x2: NDArray[np.float64]
+    source: AudioSource,
+    workers: int = 1,
+    cache: AnalysisCache | None = None,
+    stagekeys: dict[str, str] | None = None,
+    codebook: SharedCodebook | None = None
 ) -> dict[str, Any]:
     """
     Perform spectral analysis and K-means clustering on audio.
     
+    With a cache, each stage's output is loaded from it when present and
+    stored in it when computed, so only stages whose settings changed run.
+    With a shared codebook, the stem is quantized against its centroids
+    and not clustered on its own.
+    
     Args:
         filename: Name of the audio file (for logging).
         fs: Sample rate in Hz.
         fps: Target frames per second.
-        x: Left channel audio samples.
-        x2: Right channel audio samples.
+        source: Stereo audio source.
+        workers: Number of processes used for chunk analysis.
+        cache: Analysis cache for stage artifacts, if any.
+        stagekeys: Stage keys from _stage_keys() (required with a cache).
+        codebook: Shared codebook, if any.
     
     Returns:
-        Dictionary containing analysis results and clustering data.
+        Dictionary containing the AnalysisResult ('analysis') and the
+        clustering data ('centroids', 'stftvqarray') as numpy arrays.
     """
-    # Run spectral analysis
-    (stftsamples_normalized, stftsamples_normalized2, harmonicsamples,
-     harmonicchunks, volumes, balances, widths, nonquietsamples) = analysis(
-        filename, fs, fps, x, x2
-    )
+    analysisresult = _analyze_stem(filename, fs, fps, source, workers, cache, stagekeys)
+    nonquietsamples = analysisresult.nonquietsamples
     
     result: dict[str, Any] = {
-        'stftsamples_normalized': stftsamples_normalized,
-        'stftsamples_normalized2': stftsamples_normalized2,
-        'harmonicsamples': harmonicsamples,
-        'harmonicchunks': harmonicchunks,
-        'volumes': volumes,
-        'balances': balances,
-        'widths': widths,
-        'nonquietsamples': nonquietsamples,
+        'analysis': analysisresult,
         'allquietsamples': False,
-        'centroids': [],
-        'stftvqarray': []
+        'centroids': np.empty((0, analysisresult.stft.shape[1])),
+        'stftvqarray': np.empty(0, dtype=np.intp)
     }
     
     # Check if there are any non-quiet samples to cluster
     if len(nonquietsamples) > 0:
-        # K-Means clustering
-        centroidcount: int = 24  # Number of spectral "fingerprints"
-        vqupdatecount: int = 1   # K-means iterations multiplier
-        
-        centroids = kmeans(
-            centroidcount, vqupdatecount,
-            stftsamples_normalized, stftsamples_normalized2, nonquietsamples
-        )
+        # K-Means clustering, unless the song shares one codebook
+        if codebook is not None:
+            centroids = codebook.centroids
+        else:
+            arrays = _load_stage(cache, stagekeys, 'cluster', 'centroids', filename)
+            if arrays is not None:
+                centroids = arrays['centroids']
+            else:
+                centroids = kmeans(
+                    CENTROID_COUNT, VQ_UPDATE_COUNT,
+                    analysisresult.stft, analysisresult.stft2, nonquietsamples,
+                    mode=KMEANS_MODE, batch_size=KMEANS_BATCH_SIZE, tol=KMEANS_TOL,
+                    max_training_bytes=KMEANS_MAX_TRAINING_BYTES
+                )
+                _save_stage(cache, stagekeys, 'cluster', 'centroids', filename,
+                            {'centroids': centroids})
         
         # Vector Quantization - assign each sample to nearest centroid
-        stftvqarray = vector_quantize(stftsamples_normalized, centroidcount, centroids)
+        arrays = _load_stage(cache, stagekeys, 'cluster', 'assignments', filename)
+        if arrays is not None:
+            stftvqarray = arrays['stftvqarray']
+        else:
+            stftvqarray = vector_quantize(
+                analysisresult.stft, CENTROID_COUNT, centroids, method=VQ_METHOD
+            )
+            _save_stage(cache, stagekeys, 'cluster', 'assignments', filename,
+                        {'stftvqarray': stftvqarray})
         
         result['centroids'] = centroids
         result['stftvqarray'] = stftvqarray
@@ -351,25 +883,123 @@ def _analyze_and_cluster(
     return result
 
 
+def _analyze_stem(
+    filename: str,
+    fs: int,
+    fps: int,
+    source: AudioSource,
+    workers: int = 1,
+    cache: AnalysisCache | None = None,
+    stagekeys: dict[str, str] | None = None
+) -> AnalysisResult:
+    """
+    Run spectral analysis on a stem, or load it from the cache.
+    
+    Args:
+        filename: Name of the audio file (for logging).
+        fs: Sample rate in Hz.
+        fps: Target frames per second.
+        source: Stereo audio source.
+        workers: Number of processes used for chunk analysis.
+        cache: Analysis cache, if any.
+        stagekeys: Stage keys from _stage_keys() (required with a cache).
+    
+    Returns:
+        The stem's analysis.
+    """
+    arrays = _load_stage(cache, stagekeys, 'analysis', 'analysis', filename)
+    if arrays is not None:
+        return AnalysisResult(**arrays)
+    
+    analysisresult = analysis(filename, fs, fps, source, workers)
+    _save_stage(cache, stagekeys, 'analysis', 'analysis', filename, {
+        field.name: getattr(analysisresult, field.name)
+        for field in fields(analysisresult)
+    })
+    return analysisresult
+
+
+def _load_stage(
+    cache: AnalysisCache | None,
+    stagekeys: dict[str, str] | None,
+    stage: str,
+    name: str,
+    filename: str
+) -> dict[str, NDArray[Any]] | None:
+    """
+    Load a stage artifact of a stem from the cache, if there is one.
+    
+    Args:
+        cache: Analysis cache, or None.
+        stagekeys: Stage keys from _stage_keys().
+        stage: Stage the artifact belongs to ('analysis' or 'cluster').
+        name: Artifact name.
+        filename: Stem filename, for logging.
+    
+    Returns:
+        The stored arrays, or None if there is no cache or no artifact.
+    """
+    if cache is None or stagekeys is None:
+        return None
+    arrays = cache.load_arrays(stagekeys[stage], name, filename)
+    if arrays is not None:
+        print(f"{filename}: reusing cached {name}")
+    return arrays
+
+
+def _save_stage(
+    cache: AnalysisCache | None,
+    stagekeys: dict[str, str] | None,
+    stage: str,
+    name: str,
+    filename: str,
+    arrays: dict[str, NDArray[Any]]
+) -> None:
+    """Store a stage artifact of a stem in the cache, if there is one."""
+    if cache is not None and stagekeys is not None:
+        cache.save_arrays(stagekeys[stage], name, arrays, filename)
+
+
 def _export_results(
     filename: str,
     dest_folder: str,
     fs: int,
     fps: int,
-    result: dict[str, Any]
+    result: dict[str, Any],
+    cachekey: str | None = None,
+    codebook: SharedCodebook | None = None
 ) -> None:
     """
     Export analysis results to JSON metadata and binary data files.
     
     Output format:
-        JSON file contains structure description and track metadata.
-        Binary file contains packed uint16 values in order:
+        JSON file contains structure description and track metadata,
+        including the binary format version (track.data_format).
+        Binary file contains these sections in order:
         - volume (len x 1)
         - balance (len x 1)
         - width (len x 1)
         - centroids (centroidcount x fftsize)
         - centroid_indexes (len x 1)
         - pitch (len x 1)
+        In format 2 and later (see analysis_format.py) the file starts with
+        a header and section table, and centroid indexes are uint8 for
+        codebooks of up to 256 centroids; everything else is uint16. From
+        format 3, sections that compress better as differences between
+        consecutive values are stored delta-encoded. Format 1 is the
+        sections alone, all uint16, back to back.
+        The data file is written along with precompressed .gz (and, with
+        the brotli package, .br) copies.
+        With SEGMENT_SECONDS > 0 the data file holds only the centroids,
+        and the per-frame sections (all but the centroids) go to one file
+        per SEGMENT_SECONDS of audio, {filename}_analysis.NNNN.data. The
+        JSON's track.segments lists every segment's first frame, frame
+        count and file, so a player can start after the first segment and
+        seek without loading the rest. Segmenting needs format 2 or later.
+        Values are rounded, and anything outside the section's integer
+        range is clipped with a warning.
+        With a shared codebook the centroids section is empty (0 x fftsize)
+        and track.codebook names the codebook file and its shape instead.
     
     Args:
         filename: Name of the source audio file.
@@ -377,6 +1007,9 @@ def _export_results(
         fs: Sample rate in Hz.
         fps: Target frames per second.
         result: Analysis results dictionary from _analyze_and_cluster.
+        cachekey: Analysis cache key of the stem, recorded in the JSON
+                  so stale outputs can be detected.
+        codebook: Shared codebook the stem was quantized against, if any.
     """
     dest_path = Path(dest_folder)
     allquietsamples = result['allquietsamples']
@@ -385,25 +1018,29 @@ def _export_results(
     data: dict[str, Any] = {}
     
     if not allquietsamples:
-        stftsamples_normalized = result['stftsamples_normalized']
-        harmonicsamples = result['harmonicsamples']
-        harmonicchunks = result['harmonicchunks']
-        volumes = result['volumes']
-        balances = result['balances']
-        widths = result['widths']
+        analysisresult: AnalysisResult = result['analysis']
+        volumes = analysisresult.volumes
+        balances = analysisresult.balances
+        widths = analysisresult.widths
+        pitch = analysisresult.pitch
         centroids = result['centroids']
         stftvqarray = result['stftvqarray']
+        indexdtype = np.uint16 if DATA_FORMAT == 1 else \
+            np.min_scalar_type(max(len(centroids) - 1, 0))
+        
+        # Shared centroids are exported once, to the codebook file
+        if codebook is not None:
+            centroids = centroids[:0]
         
-        length = len(stftsamples_normalized)
+        length = len(analysisresult)
         centroidcount = len(centroids)
         
         # Scale values to 16-bit integer range
-        multiplier: int = 65535  # uint16 max
+        multiplier: int = EXPORT_RANGE
         
         # Find max values for normalization
-        maxvolume = max(volumes) if volumes else 1.0
-        maxbalance = max((abs(b) for b in balances), default=1.0)
-        maxwidth = max(widths) if widths else 1.0
+        maxvolume = float(volumes.max()) if len(volumes) else 1.0
+        maxwidth = float(widths.max()) if len(widths) else 1.0
         
         # Prevent division by zero
         if maxvolume == 0:
@@ -411,41 +1048,45 @@ def _export_results(
         if maxwidth == 0:
             maxwidth = 1.0
         
-        # Scale volumes, balances, widths to uint16 range
-        scaled_volumes: list[int] = []
-        scaled_balances: list[int] = []
-        scaled_widths: list[int] = []
-        
-        for i in range(len(volumes)):
-            scaled_volumes.append(int(round(float(volumes[i]) / maxvolume * multiplier)))
-            scaled_balances.append(int(round(balances[i] * (multiplier / 2)) + (multiplier // 2)))
-            scaled_widths.append(int(round(float(widths[i]) / maxwidth * multiplier)))
-        
-        # Scale centroids to uint16 range
-        scaled_centroids: list[list[int]] = []
-        for i in range(centroidcount):
-            scaled_centroid: list[int] = []
-            for j in range(len(centroids[0])):
-                scaled_centroid.append(int(round(centroids[i][j] * multiplier)))
-            scaled_centroids.append(scaled_centroid)
+        # Pitch is scaled by the harmonic model's f0 range
+        harmonic = get_plan(fs, fps).harmonic
+        minf0 = harmonic.minf0
+        maxf0 = harmonic.maxf0
         
-        # Process harmonic data
-        nH = len(harmonicchunks[0][0][0]) if harmonicchunks else 0
-        minf0: int = 30
-        maxf0: int = 3000
-        
-        # Scale harmonic frequencies
-        scaled_harmonics: list[int] = []
-        for i in range(len(harmonicsamples)):
-            value = float(harmonicsamples[i][0][0]) / maxf0
-            scaled_harmonics.append(int(round(value * multiplier)))
+        # Scaled sections in file order, packed into preallocated file buffers
+        sections: list[tuple[str, Any, NDArray[np.float64]]] = [
+            ('volume', np.uint16, volumes / maxvolume * multiplier),
+            ('balance', np.uint16, np.round(balances * (multiplier / 2)) + (multiplier // 2)),
+            ('width', np.uint16, widths / maxwidth * multiplier),
+            ('centroids', np.uint16, centroids.ravel() * multiplier),
+            ('centroid_indexes', indexdtype, stftvqarray),
+            ('pitch', np.uint16, pitch / maxf0 * multiplier),
+        ]
+        datafiles: dict[str, NDArray[Any]] = {}
+        segments: list[dict[str, Any]] = []
+        if SEGMENT_SECONDS > 0:
+            # Centroids up front, then the per-frame sections by time segment
+            datafiles[f'{filename}_analysis.data'] = _pack_sections(
+                filename, [section for section in sections if section[0] == 'centroids']
+            )
+            segmentframes = SEGMENT_SECONDS * fps
+            for index, start in enumerate(range(0, length, segmentframes)):
+                end = min(start + segmentframes, length)
+                segmentfile = f'{filename}_analysis.{index:04d}.data'
+                datafiles[segmentfile] = _pack_sections(filename, [
+                    (name, dtype, values[start:end])
+                    for name, dtype, values in sections if name != 'centroids'
+                ])
+                segments.append({'start': start, 'frames': end - start, 'file': segmentfile})
+        else:
+            datafiles[f'{filename}_analysis.data'] = _pack_sections(filename, sections)
         
         # Build structure description
         data['structure'] = {
             0: {'volume': [length, 1]},
             1: {'balance': [length, 1]},
             2: {'width': [length, 1]},
-            3: {'centroids': [centroidcount, len(centroids[0])]},
+            3: {'centroids': [centroidcount, centroids.shape[1]]},
             4: {'centroid_indexes': [length, 1]},
             5: {'pitch': [length, 1]},
         }
@@ -454,42 +1095,95 @@ def _export_results(
             'fs': fs,
             'fps': fps,
             'byte_num_range': multiplier,
-            'stft_size': len(stftsamples_normalized[0]),
+            'stft_size': analysisresult.stft.shape[1],
             'maxvolume': maxvolume,
             'allquietsamples': allquietsamples,
             'pitchmin': minf0,
-            'pitchmax': maxf0
+            'pitchmax': maxf0,
+            'data_format': DATA_FORMAT
         }
+        if segments:
+            data['track']['segment_frames'] = SEGMENT_SECONDS * fps
+            data['track']['segments'] = segments
+        if codebook is not None:
+            data['track']['codebook'] = {
+                'file': codebook.filename,
+                'centroids': list(codebook.centroids.shape),
+                'cache_key': codebook.key,
+            }
     else:
         data['track'] = {
             'allquietsamples': allquietsamples
         }
     
+    if cachekey is not None:
+        data['track']['cache_key'] = cachekey
+    
     # Write JSON metadata
     json_path = dest_path / f'{filename}_analysis.json'
     with open(json_path, 'w', encoding='utf-8') as outfile:
         json.dump(data, outfile, sort_keys=True, indent=2)
     
-    # Write binary data file
+    # Write binary data files, replacing the segments of an earlier export
+    for stale in dest_path.glob(f'{glob.escape(filename)}_analysis.[0-9]*.data*'):
+        stale.unlink()
     if not allquietsamples:
-        # Flatten centroids for binary output
-        flat_stft_clusters: list[int] = [x for sublist in scaled_centroids for x in sublist]
-        
-        # Combine all data in order
-        combined_lists = (
-            scaled_volumes +
-            scaled_balances +
-            scaled_widths +
-            flat_stft_clusters +
-            stftvqarray +
-            scaled_harmonics
-        )
-        
-        # Write as uint16 binary
-        data_path = dest_path / f'{filename}_analysis.data'
-        with open(data_path, mode='wb') as fileobj:
-            off = np.array(combined_lists, dtype=np.uint16)
-            off.tofile(fileobj)
+        for datafile, packed in datafiles.items():
+            write_precompressed(dest_path / datafile, packed)
+
+
+def _pack_sections(
+    filename: str,
+    sections: list[tuple[str, Any, NDArray[Any]]]
+) -> NDArray[Any]:
+    """
+    Pack scaled sections into one preallocated DATA_FORMAT file buffer.
+    
+    Args:
+        filename: Stem filename, for warnings.
+        sections: (name, element type, scaled values) in file order. The
+                  element type is ignored for format 1 (all uint16).
+    
+    Returns:
+        The file contents (uint16 values for format 1, bytes otherwise).
+    """
+    if DATA_FORMAT == 1:
+        packed = np.empty(sum(values.size for *_, values in sections), dtype=np.uint16)
+        views = {}
+        head = 0
+        for name, _, values in sections:
+            views[name] = packed[head:head + values.size]
+            head += values.size
+    else:
+        packed, views = allocate_sections([
+            (name, dtype, values.size) for name, dtype, values in sections
+        ], version=DATA_FORMAT)
+    for name, _, values in sections:
+        _pack(views[name], values, f'{filename} {name}')
+    if DATA_FORMAT >= 3:
+        encode_deltas(packed)
+    return packed
+
+
+def _pack(
+    out: NDArray[np.unsignedinteger],
+    values: NDArray[Any],
+    name: str
+) -> None:
+    """
+    Round values into an integer buffer, clipping anything out of range.
+    
+    Args:
+        out: Destination section of the output buffer (e.g. uint16).
+        values: Scaled values, already in the buffer type's range when valid.
+        name: Section name used in the warning message.
+    """
+    limits = np.iinfo(out.dtype)
+    rounded = np.round(values)
+    outofrange = np.count_nonzero((rounded < limits.min) | (rounded > limits.max))
+    if outofrange:
+        print(f"Warning: {name}: clipped {outofrange} values outside the {out.dtype} range")
+    np.clip(rounded, limits.min, limits.max, out=out, casting='unsafe')
 
 
 # Run the analysis when executed directly
@@ -15,34 +15,62 @@ Each analysis model extracts different features useful for audio visualization:
 - Harmonic models track pitched content and overtones
 - Residual analysis captures noise and transients
 
+Model settings (window, FFT and hop sizes, thresholds, f0 ranges) come
+from an AnalysisPlan. The STFT, F0, harmonic and HPR models take their
+framed spectra from a SpectralFrontEnd, so calls on the same chunk with the
+same framing share one set of FFTs.
+
 Example usage:
     from processor import processor
-    result = processor(44100, audio_chunk, 'TheSTFT', plot=False)
+    frontend = SpectralFrontEnd(audio_chunk)
+    result = processor(44100, audio_chunk, 'TheSTFT', False, frontend, get_plan(44100))
 """
 from __future__ import annotations
 
+from dataclasses import dataclass, field
 from typing import Any, Literal
 
 import matplotlib.pyplot as plt
 import numpy as np
 from numpy.typing import NDArray
-from scipy.signal import get_window
 from smstools.models import harmonicModel as HM
 from smstools.models import hprModel as HPR
 from smstools.models import sineModel as SM
 from smstools.models import stft as STFT
+from smstools.models import utilFunctions as UF
+
+from analysis_plan import (
+    MODEL_HARMONIC, MODEL_SINE, MODEL_STFT, AnalysisPlan, F0Params, FrameParams,
+    HarmonicParams, SineParams, analysis_window, bin_frequencies, get_plan
+)
+from spectral_frontend import SpectralFrontEnd
 
 
 # Type for analysis method selection
 AnalysisType = Literal['TheSTFT', 'TheSM', 'TheF0', 'TheHM', 'TheHPR']
 
 
+@dataclass
+class HarmonicState:
+    """
+    What the harmonic model carries from one frame to the next.
+    
+    Attributes:
+        f0stable: Previous stable f0, used to favour continuity (0 if none).
+        hfreqp: Harmonic frequencies of the previous frame.
+    """
+    f0stable: float = 0
+    hfreqp: NDArray[np.float64] | list[float] = field(default_factory=list)
+
+
 def processor(
     fs: int,
     xchunk: NDArray[np.float64],
     analysis: AnalysisType,
-    plot: bool
-) -> list[list[float]]:
+    plot: bool,
+    frontend: SpectralFrontEnd | None = None,
+    plan: AnalysisPlan | None = None
+) -> list[NDArray[np.float64]]:
     """
     Analyze a chunk of audio using a specified spectral model.
     
@@ -60,9 +88,15 @@ def processor(
                  - 'TheHM': Harmonic Model (tracks harmonics)
                  - 'TheHPR': Harmonic Plus Residual (harmonics + noise)
         plot: If True, display matplotlib plots of the analysis results.
+        frontend: Spectral front-end for xchunk. Pass the same one to every
+                 call on a chunk so models with the same window, FFT and
+                 hop sizes reuse its spectra instead of recomputing them.
+                 A private one is created when omitted.
+        plan: Analysis plan holding the model settings. Defaults to the
+              shared plan for fs.
     
     Returns:
-        List of analysis results, structure depends on analysis type:
+        List of numpy arrays, structure depends on analysis type:
         - TheSTFT: [mX] where mX is magnitude spectrogram
         - TheSM: [tfreq, tmag, tphase] - sine track frequencies, magnitudes, phases
         - TheF0: [f0] - fundamental frequency over time
@@ -79,25 +113,30 @@ def processor(
         >>> len(result[0])  # Number of STFT frames
         86
     """
+    if frontend is None:
+        frontend = SpectralFrontEnd(xchunk)
+    if plan is None:
+        plan = get_plan(fs)
+    
     # Short-Time Fourier Transform Analysis
     if analysis == 'TheSTFT':
-        return _analyze_stft(fs, xchunk, plot)
+        return _analyze_stft(fs, xchunk, plot, frontend, plan.stft)
     
     # Sinusoidal Model Analysis
     if analysis == 'TheSM':
-        return _analyze_sinusoidal(fs, xchunk, plot)
+        return _analyze_sinusoidal(fs, xchunk, plot, plan.sine)
     
     # Fundamental Frequency Detection
     if analysis == 'TheF0':
-        return _analyze_f0(fs, xchunk, plot)
+        return _analyze_f0(fs, xchunk, plot, frontend, plan.f0)
     
     # Harmonic Model Analysis
     if analysis == 'TheHM':
-        return _analyze_harmonic(fs, xchunk, plot)
+        return _analyze_harmonic(fs, xchunk, plot, frontend, plan.harmonic)
     
     # Harmonic Plus Residual Analysis
     if analysis == 'TheHPR':
-        return _analyze_hpr(fs, xchunk, plot)
+        return _analyze_hpr(fs, xchunk, plot, frontend, plan.hpr, plan.hpr_residual)
     
     raise ValueError(f"Unknown analysis type: {analysis}")
 
@@ -105,8 +144,10 @@ def processor(
 def _analyze_stft(
     fs: int,
     xchunk: NDArray[np.float64],
-    plot: bool
-) -> list[list[float]]:
+    plot: bool,
+    frontend: SpectralFrontEnd,
+    params: FrameParams
+) -> list[NDArray[np.float64]]:
     """
     Short-Time Fourier Transform analysis.
     
@@ -123,30 +164,28 @@ def _analyze_stft(
         fs: Sample rate in Hz.
         xchunk: Audio samples.
         plot: Whether to display visualization.
+        frontend: Spectral front-end for xchunk.
+        params: Framing; the window size sets frequency resolution and
+                the hop size time resolution.
     
     Returns:
         [mX] where mX is the magnitude spectrogram (frames x frequency bins).
     """
-    # 'hann' is the scipy name for Hanning window (scipy >= 1.1 deprecated 'hanning')
-    window: str = 'hann'
-    M: int = 2048      # Window size: affects frequency resolution
-    N: int = 2048      # FFT size: zero-padded if > M
-    H: int = 512       # Hop size: affects time resolution
-    w: NDArray[np.float64] = get_window(window, M)
-    mX, pX = STFT.stftAnal(xchunk, w, N, H)
+    mX, pX = frontend.spectra(params, MODEL_STFT)
     
     if plot:
-        y = STFT.stftSynth(mX, pX, M, H)
-        _plot_stft(fs, xchunk, mX, N, H, y)
+        y = STFT.stftSynth(mX, pX, params.M, params.H)
+        _plot_stft(fs, xchunk, mX, params.N, params.H, y)
     
-    return [mX.tolist()]
+    return [mX]
 
 
 def _analyze_sinusoidal(
     fs: int,
     xchunk: NDArray[np.float64],
-    plot: bool
-) -> list[list[float]]:
+    plot: bool,
+    params: SineParams
+) -> list[NDArray[np.float64]]:
     """
     Sinusoidal Model analysis with sine tracking.
     
@@ -163,38 +202,33 @@ def _analyze_sinusoidal(
         fs: Sample rate in Hz.
         xchunk: Audio samples.
         plot: Whether to display visualization.
+        params: Sinusoidal model settings.
     
     Returns:
         [tfreq, tmag, tphase] - tracked frequencies, magnitudes, and phases.
     """
-    window: str = 'hamming'
-    M: int = 2001           # Window size
-    N: int = 2048           # FFT size
-    t: int = -80            # Threshold in negative dB for peak detection
-    minSineDur: float = 0.02  # Minimum duration of sines in seconds
-    maxnSines: int = 150    # Maximum number of sines per frame
-    freqDevOffset: int = 10  # Minimum frequency deviation at 0Hz
-    freqDevSlope: float = 0.001  # Slope increase of min freq deviation
-    Ns: int = 512           # Synthesis FFT size
-    H: int = 128            # Hop size
-    w: NDArray[np.float64] = get_window(window, M)
+    p = params
+    w: NDArray[np.float64] = analysis_window(p.window, p.M, MODEL_SINE)
     
     tfreq, tmag, tphase = SM.sineModelAnal(
-        xchunk, fs, w, N, H, t, maxnSines, minSineDur, freqDevOffset, freqDevSlope
+        xchunk, fs, w, p.N, p.H, p.t, p.maxnSines, p.minSineDur,
+        p.freqDevOffset, p.freqDevSlope
     )
     
     if plot:
-        y = SM.sineModelSynth(tfreq, tmag, tphase, Ns, H, fs)
-        _plot_sinusoidal(fs, xchunk, tfreq, H, y)
+        y = SM.sineModelSynth(tfreq, tmag, tphase, p.Ns, p.H, fs)
+        _plot_sinusoidal(fs, xchunk, tfreq, p.H, y)
     
-    return [tfreq.tolist(), tmag.tolist(), tphase.tolist()]
+    return [tfreq, tmag, tphase]
 
 
 def _analyze_f0(
     fs: int,
     xchunk: NDArray[np.float64],
-    plot: bool
-) -> list[list[float]]:
+    plot: bool,
+    frontend: SpectralFrontEnd,
+    params: F0Params
+) -> list[NDArray[np.float64]]:
     """
     Fundamental frequency (pitch) detection using TWM algorithm.
     
@@ -212,33 +246,47 @@ def _analyze_f0(
         fs: Sample rate in Hz.
         xchunk: Audio samples.
         plot: Whether to display visualization.
+        frontend: Spectral front-end for xchunk.
+        params: F0 detection settings.
     
     Returns:
         [f0] - fundamental frequency values over time.
+    
+    Raises:
+        ValueError: If the f0 range is negative or above Nyquist.
     """
-    M: int = 1024           # Window size
-    N: int = 1024           # FFT size
-    H: int = 128            # Hop size
-    t: int = -90            # Threshold in negative dB
-    minf0: int = 130        # Minimum F0 frequency in Hz
-    maxf0: int = 5000       # Maximum F0 frequency in Hz
-    f0et: int = 7           # F0 error threshold
-    window: str = 'blackman'
-    w: NDArray[np.float64] = get_window(window, M)
-    
-    f0 = HM.f0Detection(xchunk, fs, w, N, H, t, minf0, maxf0, f0et)
+    p = params
+    if p.minf0 < 0:
+        raise ValueError("Minimum fundamental frequency (minf0) smaller than 0")
+    if p.maxf0 >= fs / 2.0:
+        raise ValueError("Maximum fundamental frequency (maxf0) bigger than Nyquist frequency")
+    
+    # f0Detection stops one hop earlier than stftAnal framing when the
+    # last frame would be centred exactly on the final padded sample
+    mX, pX = frontend.spectra(p, MODEL_HARMONIC)
+    numframes: int = len(range((p.M + 1) // 2, p.M // 2 + len(xchunk), p.H))
+    
+    f0: NDArray[np.float64] = np.zeros(numframes)
+    f0stable: float = 0  # Previous stable f0, used to favour continuity
+    for i in range(numframes):
+        ipfreq, ipmag, _ = _spectral_peaks(mX[i], pX[i], fs, p.N, p.t)
+        f0t = UF.f0Twm(ipfreq, ipmag, p.f0et, p.minf0, p.maxf0, f0stable)
+        f0stable = f0t if f0t > 0 and abs(f0t - f0stable) < p.f0et else 0
+        f0[i] = f0t
     
     if plot:
-        _plot_f0(fs, xchunk, f0, H)
+        _plot_f0(fs, xchunk, f0, p.H)
     
-    return [f0.tolist()]
+    return [f0]
 
 
 def _analyze_harmonic(
     fs: int,
     xchunk: NDArray[np.float64],
-    plot: bool
-) -> list[list[float]]:
+    plot: bool,
+    frontend: SpectralFrontEnd,
+    params: HarmonicParams
+) -> list[NDArray[np.float64]]:
     """
     Harmonic Model analysis for tracking harmonic partials.
     
@@ -256,40 +304,31 @@ def _analyze_harmonic(
         fs: Sample rate in Hz.
         xchunk: Audio samples.
         plot: Whether to display visualization.
+        frontend: Spectral front-end for xchunk.
+        params: Harmonic model settings.
     
     Returns:
         [hfreq, hmag, hphase] - harmonic frequencies, magnitudes, and phases.
     """
-    window: str = 'blackman'
-    M: int = 2048           # Window size
-    N: int = 2048           # FFT size
-    t: int = -90            # Threshold in negative dB
-    minSineDur: float = 0.1  # Minimum duration of harmonics
-    nH: int = 10            # Maximum number of harmonics
-    minf0: int = 30         # Minimum F0 in Hz
-    maxf0: int = 3000       # Maximum F0 in Hz
-    f0et: int = 7           # F0 error threshold
-    harmDevSlope: float = 0.01  # Harmonic deviation slope
-    H: int = 128            # Hop size
-    w: NDArray[np.float64] = get_window(window, M)
-    
-    hfreq, hmag, hphase = HM.harmonicModelAnal(
-        xchunk, fs, w, N, H, t, nH, minf0, maxf0, f0et, harmDevSlope, minSineDur
+    hfreq, hmag, hphase = _harmonic_model(
+        frontend.spectra(params, MODEL_HARMONIC), fs, params
     )
     
     if plot:
-        Ns: int = 512       # Synthesis FFT size
-        y = SM.sineModelSynth(hfreq, hmag, hphase, Ns, H, fs)
-        _plot_harmonic(fs, xchunk, hfreq, H, y)
+        y = SM.sineModelSynth(hfreq, hmag, hphase, params.Ns, params.H, fs)
+        _plot_harmonic(fs, xchunk, hfreq, params.H, y)
     
-    return [hfreq.tolist(), hmag.tolist(), hphase.tolist()]
+    return [hfreq, hmag, hphase]
 
 
 def _analyze_hpr(
     fs: int,
     xchunk: NDArray[np.float64],
-    plot: bool
-) -> list[list[float]]:
+    plot: bool,
+    frontend: SpectralFrontEnd,
+    params: HarmonicParams,
+    residual: FrameParams
+) -> list[NDArray[np.float64]]:
     """
     Harmonic Plus Residual (HPR) model analysis.
     
@@ -306,38 +345,162 @@ def _analyze_hpr(
         fs: Sample rate in Hz.
         xchunk: Audio samples.
         plot: Whether to display visualization.
+        frontend: Spectral front-end for xchunk.
+        params: Harmonic model settings for the harmonic part.
+        residual: Framing of the residual STFT.
     
     Returns:
         [hfreq, hmag, hphase, mXr, pXr] - harmonics + residual spectrogram.
     """
-    window: str = 'blackman'
-    M: int = 2048           # Window size
-    N: int = 2048           # FFT size
-    t: int = -100           # Threshold in negative dB
-    minSineDur: float = 0.1  # Minimum duration of harmonics
-    nH: int = 48            # Maximum number of harmonics
-    minf0: int = 30         # Minimum F0 in Hz
-    maxf0: int = 700        # Maximum F0 in Hz
-    f0et: int = 5           # F0 error threshold
-    harmDevSlope: float = 0.01  # Harmonic deviation slope
-    H: int = 128            # Hop size
-    w: NDArray[np.float64] = get_window(window, M)
-    
-    hfreq, hmag, hphase, xr = HPR.hprModelAnal(
-        xchunk, fs, w, N, H, t, minSineDur, nH, minf0, maxf0, f0et, harmDevSlope
+    # Same framing as the harmonic model, so its spectra are reused
+    hfreq, hmag, hphase = _harmonic_model(
+        frontend.spectra(params, MODEL_HARMONIC), fs, params
     )
+    xr = UF.sineSubtraction(xchunk, params.Ns, params.H, hfreq, hmag, hphase, fs)
     
     # Analyze residual with STFT
-    M_res: int = 1024
-    N_res: int = 1024
-    H_res: int = 512
-    w_res: NDArray[np.float64] = get_window(window, M_res)
-    mXr, pXr = STFT.stftAnal(xr, w_res, N_res, H_res)
+    mXr, pXr = SpectralFrontEnd(xr).spectra(residual, MODEL_STFT)
     
     if plot:
-        _plot_hpr(fs, xchunk, hfreq, H, mXr, N, xr)
+        _plot_hpr(fs, xchunk, hfreq, params, mXr, xr)
     
-    return [hfreq.tolist(), hmag.tolist(), hphase.tolist(), mXr.tolist(), pXr.tolist()]
+    return [hfreq, hmag, hphase, mXr, pXr]
+
+
+def _spectral_peaks(
+    mX: NDArray[np.float64],
+    pX: NDArray[np.float64],
+    fs: int,
+    N: int,
+    t: float
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Detect and interpolate the spectral peaks of one frame.
+    
+    Args:
+        mX: Magnitude spectrum in dB.
+        pX: Phase spectrum.
+        fs: Sample rate in Hz.
+        N: FFT size.
+        t: Peak threshold in negative dB.
+    
+    Returns:
+        Tuple of (frequencies in Hz, magnitudes, phases) of the peaks.
+    """
+    ploc = UF.peakDetection(mX, t)
+    iploc, ipmag, ipphase = UF.peakInterp(mX, pX, ploc)
+    ipfreq = fs * iploc / N
+    return ipfreq, ipmag, ipphase
+
+
+def _harmonic_model(
+    spectra: tuple[NDArray[np.float64], NDArray[np.float64]],
+    fs: int,
+    params: HarmonicParams
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Harmonic model analysis over precomputed framed spectra.
+    
+    Same per-frame steps as sms-tools' harmonicModelAnal (peak detection,
+    TWM f0 estimation, harmonic detection and track cleaning), reading the
+    spectra from the front-end instead of computing a DFT per frame.
+    
+    Args:
+        spectra: (mX, pX) framed spectra from SpectralFrontEnd.spectra().
+        fs: Sample rate in Hz.
+        params: Harmonic model settings the spectra were framed with.
+    
+    Returns:
+        Tuple of (hfreq, hmag, hphase), each of shape (frames, nH).
+    
+    Raises:
+        ValueError: If minSineDur is negative.
+    """
+    if params.minSineDur < 0:
+        raise ValueError("Minimum duration of sine tracks smaller than 0")
+    
+    mX, pX = spectra
+    return clean_harmonic_tracks(*harmonic_detection(mX, pX, fs, params), fs, params)
+
+
+def harmonic_detection(
+    mX: NDArray[np.float64],
+    pX: NDArray[np.float64],
+    fs: int,
+    params: HarmonicParams,
+    state: HarmonicState | None = None
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Detect the harmonics of every frame, without track cleaning.
+    
+    Args:
+        mX: Magnitude spectra (dB), shape (frames, N // 2 + 1).
+        pX: Phase spectra, same shape.
+        fs: Sample rate in Hz.
+        params: Harmonic model settings the spectra were framed with.
+        state: State left by the previous frames of the same signal, for
+               analyzing it a few frames at a time. Updated in place. A
+               fresh state (the start of a signal) when omitted.
+    
+    Returns:
+        Tuple of (hfreq, hmag, hphase), each of shape (frames, nH).
+    """
+    p = params
+    state = state if state is not None else HarmonicState()
+    numframes: int = len(mX)
+    xhfreq: NDArray[np.float64] = np.zeros((numframes, p.nH))
+    xhmag: NDArray[np.float64] = np.zeros((numframes, p.nH))
+    xhphase: NDArray[np.float64] = np.zeros((numframes, p.nH))
+    
+    for i in range(numframes):
+        ipfreq, ipmag, ipphase = _spectral_peaks(mX[i], pX[i], fs, p.N, p.t)
+        f0t = UF.f0Twm(ipfreq, ipmag, p.f0et, p.minf0, p.maxf0, state.f0stable)
+        state.f0stable = f0t if f0t > 0 and abs(f0t - state.f0stable) < p.f0et else 0
+        hfreq, hmag, hphase = HM.harmonicDetection(
+            ipfreq, ipmag, ipphase, f0t, p.nH, state.hfreqp, fs, p.harmDevSlope
+        )
+        xhfreq[i], xhmag[i], xhphase[i] = hfreq, hmag, hphase
+        state.hfreqp = hfreq
+    
+    return xhfreq, xhmag, xhphase
+
+
+def clean_harmonic_tracks(
+    hfreq: NDArray[np.float64],
+    hmag: NDArray[np.float64],
+    hphase: NDArray[np.float64],
+    fs: int,
+    params: HarmonicParams
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Delete harmonic tracks shorter than minSineDur.
+    
+    Whether a frame's harmonic survives only depends on the frames up to
+    min_track_frames() - 1 before and after it, so a stream can be cleaned
+    a window at a time.
+    
+    Args:
+        hfreq: Harmonic frequencies, shape (frames, nH). Not modified.
+        hmag: Harmonic magnitudes, same shape. Modified in place.
+        hphase: Harmonic phases, same shape. Modified in place.
+        fs: Sample rate in Hz.
+        params: Harmonic model settings.
+    
+    Returns:
+        Tuple of (hfreq, hmag, hphase), with deleted harmonics zeroed.
+    """
+    hfreq = SM.cleaningSineTracks(hfreq.copy(), min_track_frames(fs, params))
+    
+    # Zero out magnitudes and phases of deleted harmonics
+    mask = hfreq == 0
+    hmag[mask] = 0
+    hphase[mask] = 0
+    return hfreq, hmag, hphase
+
+
+def min_track_frames(fs: int, params: HarmonicParams) -> int:
+    """Shortest harmonic track kept by clean_harmonic_tracks(), in frames."""
+    return round(fs * params.minSineDur / params.H)
 
 
 def _plot_stft(
@@ -364,7 +527,7 @@ def _plot_stft(
     plt.subplot(4, 1, 2)
     numFrames: int = int(mX[:, 0].size)
     frmTime = H * np.arange(numFrames) / float(fs)
-    binFreq = fs * np.arange(int(N * maxplotfreq / fs)) / N
+    binFreq = bin_frequencies(fs, N)[:int(N * maxplotfreq / fs)]
     plt.pcolormesh(frmTime, binFreq, np.transpose(mX[:, :int(N * maxplotfreq / fs) + 1]))
     plt.xlabel('time (sec)')
     plt.ylabel('frequency (Hz)')
@@ -485,20 +648,19 @@ def _plot_hpr(
     fs: int,
     xchunk: NDArray[np.float64],
     hfreq: NDArray[np.float64],
-    H: int,
+    params: HarmonicParams,
     mXr: NDArray[np.float64],
-    N: int,
     xr: NDArray[np.float64]
 ) -> None:
     """Plot harmonic plus residual analysis results."""
-    window: str = 'blackman'
-    Ns: int = 512
-    M: int = 2048
-    N_plot: int = 2048
-    H_plot: int = 128
-    w: NDArray[np.float64] = get_window(window, M)
-    mXr_plot, pXr = STFT.stftAnal(xr, w, N_plot, H_plot)
-    y, yh = HPR.hprModelSynth(hfreq, np.zeros_like(hfreq), np.zeros_like(hfreq), xr, Ns, H, fs)
+    # Residual spectrogram at the harmonic model's framing for display
+    H: int = params.H
+    N_plot: int = params.N
+    H_plot: int = params.H
+    mXr_plot, pXr = SpectralFrontEnd(xr).spectra(params, MODEL_STFT)
+    y, yh = HPR.hprModelSynth(
+        hfreq, np.zeros_like(hfreq), np.zeros_like(hfreq), xr, params.Ns, H, fs
+    )
     
     plt.figure(figsize=(12, 9))
     maxplotfreq: float = 5000.0
@@ -516,7 +678,7 @@ def _plot_hpr(
     maxplotbin: int = int(N_plot * maxplotfreq / fs)
     numFrames: int = int(mXr_plot[:, 0].size)
     frmTime = H_plot * np.arange(numFrames) / float(fs)
-    binFreq = np.arange(maxplotbin + 1) * float(fs) / N_plot
+    binFreq = bin_frequencies(fs, N_plot)[:maxplotbin + 1]
     plt.pcolormesh(frmTime, binFreq, np.transpose(mXr_plot[:, :maxplotbin + 1]))
     plt.autoscale(tight=True)
     
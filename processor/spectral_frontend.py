@@ -0,0 +1,171 @@
+"""
+Shared spectral front-end for the analysis models.
+
+Every analysis model starts by windowing the audio chunk into overlapping
+frames and taking the DFT of each one. SpectralFrontEnd computes those
+framed spectra once per framing (FrameParams) for a chunk and
+keeps them for the chunk's lifetime, so models that share a configuration
+(e.g. the harmonic model and the HPR model) reuse the same FFTs. Spectra
+for a configuration are computed for all frames in one batched FFT
+instead of one call per frame.
+
+Framing and scaling follow sms-tools' stftAnal/dftAnal: the signal is
+padded with half a window of zeros on each side, every frame is
+zero-phase windowed with the sum-normalized window, and magnitudes are
+returned in dB with phases unwrapped. The harmonic models (f0Detection,
+harmonicModelAnal) normalize their window differently from stftAnal;
+spectra() takes the model family so results stay bit-identical to
+sms-tools for both. Windows come precomputed from analysis_plan.
+
+Example usage:
+    frontend = SpectralFrontEnd(xchunk)
+    mX, pX = frontend.spectra(HARMONIC_PARAMS, MODEL_HARMONIC)
+"""
+from __future__ import annotations
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from numpy.typing import NDArray
+from scipy.fft import rfft
+
+from analysis_plan import MODEL_STFT, FrameParams, analysis_window
+
+
+# Threshold below which FFT components are zeroed before computing phase
+PHASE_TOLERANCE: float = 1e-14
+
+
+class SpectralFrontEnd:
+    """
+    Cache of framed magnitude/phase spectra for one audio chunk.
+    
+    Args:
+        x: Audio samples of the chunk.
+    
+    Attributes:
+        x: Audio samples of the chunk.
+    """
+    
+    def __init__(self, x: NDArray[np.floating]) -> None:
+        self.x = x
+        self._cache: dict[tuple[FrameParams, str],
+                          tuple[NDArray[np.float64], NDArray[np.float64]]] = {}
+    
+    def spectra(
+        self,
+        params: FrameParams,
+        model: str = MODEL_STFT
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Return the framed spectra for a framing, computing them once.
+        
+        Args:
+            params: Window name, window size, FFT size and hop size.
+            model: MODEL_STFT to match stftAnal, or MODEL_HARMONIC to match
+                   the per-frame DFTs of f0Detection and harmonicModelAnal.
+        
+        Returns:
+            Tuple of (mX, pX): magnitude in dB and unwrapped phase, each of
+            shape (frames, N // 2 + 1). Frames match sms-tools' stftAnal.
+        
+        Raises:
+            ValueError: If the model family is unknown.
+        """
+        key = (FrameParams(params.window, params.M, params.N, params.H), model)
+        if key not in self._cache:
+            w = analysis_window(params.window, params.M, model)
+            self._cache[key] = frame_spectra(self.x, w, params.N, params.H)
+        return self._cache[key]
+
+
+def frame_spectra(
+    x: NDArray[np.floating],
+    w: NDArray[np.float64],
+    N: int,
+    H: int
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Compute the magnitude and phase spectra of every frame of a signal.
+    
+    Equivalent to sms-tools' stftAnal(x, w, N, H), but with all frames
+    windowed and transformed in one batch.
+    
+    Args:
+        x: Input signal.
+        w: Analysis window, as passed to dftAnal (normalized by the model).
+        N: FFT size (>= window size).
+        H: Hop size.
+    
+    Returns:
+        Tuple of (mX, pX), each of shape (frames, N // 2 + 1).
+    
+    Raises:
+        ValueError: If the hop size is not positive or N is smaller than
+            the window.
+    """
+    M: int = w.size
+    if H <= 0:
+        raise ValueError(f"Hop size (H={H}) smaller or equal to 0")
+    if N < M:
+        raise ValueError(f"FFT size (N={N}) smaller than window size (M={M})")
+    
+    hM1: int = (M + 1) // 2
+    hM2: int = M // 2
+    hN: int = N // 2 + 1
+    
+    # Center the first window at sample 0 and analyze up to the last sample
+    padded = np.concatenate((np.zeros(hM2), x, np.zeros(hM2)))
+    if padded.size < 2 * hM1:
+        return np.empty((0, hN)), np.empty((0, hN))
+    numframes: int = 1 + (padded.size - 2 * hM1) // H
+    frames = sliding_window_view(padded, M)[::H][:numframes]
+    return window_spectra(frames, w, N)
+
+
+def window_spectra(
+    frames: NDArray[np.floating],
+    w: NDArray[np.float64],
+    N: int
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Compute the magnitude and phase spectra of already framed samples.
+    
+    The per-frame half of frame_spectra(), for callers that frame the
+    signal themselves (e.g. from a stream, without zero padding).
+    
+    Args:
+        frames: Frames of window length, shape (frames, M).
+        w: Analysis window, as passed to dftAnal (normalized by the model).
+        N: FFT size (>= window size).
+    
+    Returns:
+        Tuple of (mX, pX), each of shape (frames, N // 2 + 1).
+    """
+    M: int = w.size
+    numframes: int = len(frames)
+    hM1: int = (M + 1) // 2
+    hM2: int = M // 2
+    hN: int = N // 2 + 1
+    
+    # dftAnal normalizes the window it is given once more
+    w = w / np.sum(w)
+    xw = frames * w
+    
+    # Zero-phase windowing: the second half of the frame goes to the start
+    # of the FFT buffer and the first half to the end
+    fftbuffer = np.zeros((numframes, N))
+    fftbuffer[:, :hM1] = xw[:, hM2:]
+    if hM2 > 0:
+        fftbuffer[:, -hM2:] = xw[:, :hM2]
+    
+    X = rfft(fftbuffer, n=N, axis=1)[:, :hN]
+    
+    absX = np.abs(X)
+    np.maximum(absX, np.finfo(float).eps, out=absX)
+    mX = 20 * np.log10(absX)
+    
+    X.real[np.abs(X.real) < PHASE_TOLERANCE] = 0.0
+    X.imag[np.abs(X.imag) < PHASE_TOLERANCE] = 0.0
+    pX = np.unwrap(np.angle(X), axis=1)
+    
+    return mX, pX
@@ -0,0 +1,468 @@
+"""
+Real-time streaming analysis of stereo audio.
+
+analysis() needs the whole stem up front and analyzes it in CHUNK_SECONDS
+chunks. StreamingAnalyzer instead takes audio a block at a time (e.g.
+from a sound card callback) and emits the visualization features (volume,
+balance, width, codebook index and pitch) at the target fps as soon as
+the audio they depend on has arrived:
+
+- Incoming samples go to a ring buffer that keeps the analysis windows'
+  overlap between blocks, so each STFT and harmonic model frame is
+  computed once, as soon as its whole window is in.
+- Analysis frames are grouped into output frames by the same frame -> fps
+  reduction as the offline analysis (worker_processor's stft_features()
+  and harmonic_features()), with segment bounds over the whole stream
+  (segment_triggers()) instead of per chunk.
+- The harmonic model carries its state from block to block
+  (HarmonicState) and deletes short tracks over a sliding window, which
+  takes min_track_frames() harmonic frames of lookahead.
+- STFT frames are normalized as in analysis() and quantized against a
+  precomputed codebook, e.g. the centroids of an earlier kmeans() run.
+
+The stream is analyzed as one signal, while analysis() restarts at every
+CHUNK_SECONDS chunk. Frames of the first chunk match the offline output;
+after that the harmonic state and the grouping of analysis frames into
+output frames carry over chunk boundaries, so later frames (pitch in
+particular) can differ from the offline output anywhere in a chunk, not
+only near its boundaries. Values are not scaled to the song's maximums
+either, which are only known at the end.
+
+Latency: latency_bound is the most audio, in seconds, that can arrive
+after the end of a frame's period before the frame can be computed. The
+frames returned by push() carry their measured latency, which also
+counts the processing time and the size of the blocks pushed.
+
+Example usage:
+    analyzer = StreamingAnalyzer(44100, 24, centroids)
+    for left, right in blocks:
+        frames = analyzer.push(left, right)
+        ...  # frames.volumes, frames.indexes, ...
+    frames = analyzer.flush()
+"""
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from numpy.typing import NDArray
+
+from analysis import normalize_frames
+from analysis_plan import MODEL_HARMONIC, MODEL_STFT, FrameParams, get_plan, segment_triggers
+from processor import HarmonicState, clean_harmonic_tracks, harmonic_detection, min_track_frames
+from spectral_frontend import window_spectra
+from vector_quantize import VQ_METHODS, vector_quantize
+from worker_processor import harmonic_features, stft_features
+
+
+@dataclass
+class StreamFrames:
+    """
+    Output frames emitted by one StreamingAnalyzer call.
+    
+    Attributes:
+        start: Index of the first frame in the stream.
+        volumes: Volume level for each frame.
+        balances: Stereo balance for each frame.
+        widths: Stereo width for each frame.
+        indexes: Index of the nearest codebook centroid for each frame.
+        pitch: Frequency of the first harmonic for each frame in Hz.
+        latencies: Seconds from the end of each frame's period in the
+                   audio to the frame being returned.
+    """
+    start: int
+    volumes: NDArray[np.float64]
+    balances: NDArray[np.float64]
+    widths: NDArray[np.float64]
+    indexes: NDArray[np.unsignedinteger]
+    pitch: NDArray[np.float64]
+    latencies: NDArray[np.float64]
+    
+    def __len__(self) -> int:
+        """Number of frames."""
+        return len(self.volumes)
+
+
+class RingBuffer:
+    """
+    Fixed-size stereo sample buffer, addressed by stream position.
+    
+    Args:
+        capacity: Samples per channel kept; older ones are overwritten.
+    
+    Attributes:
+        capacity: Samples per channel kept.
+        end: Stream position after the last sample written.
+    """
+    
+    def __init__(self, capacity: int) -> None:
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.end = 0
+        self._data: NDArray[np.float64] = np.zeros((2, capacity))
+    
+    def write(self, left: NDArray[np.floating], right: NDArray[np.floating]) -> None:
+        """
+        Append samples to both channels.
+        
+        Raises:
+            ValueError: If the channels differ in length or hold more
+                        samples than the buffer.
+        """
+        count = len(left)
+        if len(right) != count:
+            raise ValueError(f"Channel lengths differ: {count} and {len(right)}")
+        if count > self.capacity:
+            raise ValueError(f"Cannot write {count} samples to a buffer of {self.capacity}")
+        
+        position = self.end % self.capacity
+        first = min(count, self.capacity - position)
+        self._data[0, position:position + first] = left[:first]
+        self._data[1, position:position + first] = right[:first]
+        self._data[0, :count - first] = left[first:]
+        self._data[1, :count - first] = right[first:]
+        self.end += count
+    
+    def read(self, start: int, stop: int) -> NDArray[np.float64]:
+        """
+        Copy the samples at stream positions [start, stop).
+        
+        Positions before the stream start read as zeros.
+        
+        Returns:
+            Array of shape (2, stop - start).
+        
+        Raises:
+            ValueError: If part of the range was overwritten or is not
+                        written yet.
+        """
+        if stop > self.end or max(start, 0) < self.end - self.capacity:
+            raise ValueError(f"Samples {start}:{stop} not in the buffer (holds "
+                             f"{max(self.end - self.capacity, 0)}:{self.end})")
+        samples = np.zeros((2, stop - start))
+        position = max(start, 0)
+        while position < stop:
+            index = position % self.capacity
+            count = min(stop - position, self.capacity - index)
+            samples[:, position - start:position - start + count] = self._data[:, index:index + count]
+            position += count
+        return samples
+
+
+class StreamingAnalyzer:
+    """
+    Incremental analysis of a stereo stream into visualization frames.
+    
+    Args:
+        fs: Sample rate in Hz.
+        fps: Output frames per second.
+        centroids: Codebook to quantize the left channel spectra with,
+                   shape (centroids, bins), as returned by kmeans().
+        vq_method: Vector quantization method (see vector_quantize()).
+    
+    Attributes:
+        fs: Sample rate in Hz.
+        fps: Output frames per second.
+        centroids: Codebook.
+        emitted: Number of frames emitted so far.
+        latency_bound: Worst-case seconds of audio between the end of a
+                       frame's period and the frame being computable.
+        max_latency: Largest latency measured so far in seconds.
+    
+    Raises:
+        ValueError: If fs or fps is not positive, the codebook doesn't
+                    match the STFT size, or the method is unknown.
+    """
+    
+    def __init__(
+        self,
+        fs: int,
+        fps: int,
+        centroids: NDArray[np.float64],
+        vq_method: str = 'blocked'
+    ) -> None:
+        self.plan = get_plan(fs, fps)
+        self.fs = fs
+        self.fps = fps
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        bins = self.plan.stft.N // 2
+        if self.centroids.ndim != 2 or len(self.centroids) == 0 or self.centroids.shape[1] != bins:
+            raise ValueError(f"centroids must have shape (k, {bins}), got {self.centroids.shape}")
+        if vq_method not in VQ_METHODS:
+            raise ValueError(f"vq_method must be one of {VQ_METHODS}, got {vq_method!r}")
+        self.vq_method = vq_method
+        
+        # Harmonic frames a track is checked over on either side of a frame
+        self._cleanframes = min_track_frames(fs, self.plan.harmonic)
+        
+        # Pushed audio is analyzed at most one output frame at a time, so
+        # the buffer needs a window plus a hop plus one frame's samples
+        self._blocklen = math.ceil(fs / fps)
+        models = (self.plan.stft, self.plan.harmonic)
+        self._buffer = RingBuffer(
+            max(p.M for p in models) + max(p.H for p in models) + self._blocklen
+        )
+        self._stft = _ModelStream(self.plan.stft, MODEL_STFT, fs / fps / self.plan.stft.H)
+        self._harmonic = _ModelStream(self.plan.harmonic, MODEL_HARMONIC, fs / fps / self.plan.harmonic.H)
+        self._states = (HarmonicState(), HarmonicState())
+        
+        self.emitted = 0
+        self.max_latency = 0.0
+        self.latency_bound = max(
+            self.plan.stft.H + (self.plan.stft.M + 1) // 2,
+            self._cleanframes * self.plan.harmonic.H + (self.plan.harmonic.M + 1) // 2
+        ) / fs
+        self._final = False
+    
+    def push(self, left: NDArray[np.floating], right: NDArray[np.floating]) -> StreamFrames:
+        """
+        Add a block of samples and return the frames it completes.
+        
+        Args:
+            left: Left channel samples, in [-1, 1].
+            right: Right channel samples, same length.
+        
+        Returns:
+            The completed frames (possibly none).
+        
+        Raises:
+            ValueError: If the channels differ in length or the stream was
+                        flushed.
+        """
+        if self._final:
+            raise ValueError("Cannot push to a flushed stream")
+        if len(left) != len(right):
+            raise ValueError(f"Channel lengths differ: {len(left)} and {len(right)}")
+        
+        arrival = time.perf_counter()
+        arrived = self._buffer.end + len(left)
+        frames = []
+        for start in range(0, len(left), self._blocklen):
+            self._buffer.write(left[start:start + self._blocklen], right[start:start + self._blocklen])
+            self._analyze()
+            frames.append(self._emit(arrived, arrival))
+        return self._join(frames)
+    
+    def flush(self) -> StreamFrames:
+        """
+        End the stream and return the frames still pending.
+        
+        The stream is padded with silence after its last sample, as
+        analysis() pads each chunk. No more samples can be pushed.
+        
+        Returns:
+            The remaining frames.
+        """
+        if self._final:
+            return self._join([])
+        self._final = True
+        arrival = time.perf_counter()
+        self._analyze()
+        for stream in (self._stft, self._harmonic):
+            stream.finish()
+        return self._emit(self._buffer.end, arrival)
+    
+    def _analyze(self) -> None:
+        """Compute the analysis frames whose windows are complete."""
+        mX, _ = self._spectra(self._stft)
+        self._stft.append(mX[:len(mX) // 2], mX[len(mX) // 2:])
+        
+        mX, pX = self._spectra(self._harmonic)
+        if len(mX):
+            p = self.plan.harmonic
+            half = len(mX) // 2
+            left = harmonic_detection(mX[:half], pX[:half], self.fs, p, self._states[0])
+            right = harmonic_detection(mX[half:], pX[half:], self.fs, p, self._states[1])
+            self._harmonic.append(*left, *right)
+    
+    def _spectra(self, stream: _ModelStream) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Spectra of a model's new frames, both channels stacked.
+        
+        Frames are framed as in frame_spectra(): frame k is centered on
+        sample k * H, with zeros before the stream (and, once flushed,
+        after it).
+        
+        Returns:
+            Tuple of (mX, pX) for the left channel's frames followed by
+            the right channel's.
+        """
+        p = stream.params
+        hM1, hM2 = (p.M + 1) // 2, p.M // 2
+        padded = hM2 + self._buffer.end + (hM2 if self._final else 0)
+        stop = 1 + (padded - 2 * hM1) // p.H if padded >= 2 * hM1 else 0
+        if stop <= stream.computed:
+            empty = np.empty((0, p.N // 2 + 1))
+            return empty, empty
+        
+        start = stream.computed * p.H - hM2
+        samples = self._buffer.read(start, min((stop - 1) * p.H - hM2 + p.M, self._buffer.end))
+        if samples.shape[1] < (stop - 1 - stream.computed) * p.H + p.M:
+            samples = np.pad(samples, ((0, 0), (0, (stop - 1 - stream.computed) * p.H + p.M - samples.shape[1])))
+        
+        frames = sliding_window_view(samples, p.M, axis=1)[:, ::p.H][:, :stop - stream.computed]
+        w = self.plan.window(p, stream.model)
+        return window_spectra(frames.reshape(-1, p.M), w, p.N)
+    
+    def _emit(self, arrived: int, arrival: float) -> StreamFrames:
+        """
+        Reduce the complete output frames and quantize them.
+        
+        Args:
+            arrived: Stream position after the last sample pushed.
+            arrival: perf_counter() time the samples were pushed.
+        """
+        # Harmonic tracks are checked up to _cleanframes - 1 frames on
+        # either side of a frame (up to the end, once flushed)
+        margin = self._cleanframes - 1
+        count = min(self._stft.complete(0), self._harmonic.complete(0 if self._final else margin))
+        if count == 0:
+            return self._join([])
+        
+        (mX, mX2), starts, ends, filled = self._stft.window(count, 0)
+        maximum, _, volumes, balances, widths = stft_features(
+            mX[starts[0]:ends[-1] + 1], mX2[starts[0]:ends[-1] + 1], starts - starts[0], filled
+        )
+        self._stft.consume(count, 0)
+        
+        (hfreq, hmag, hphase, hfreq2, hmag2, hphase2), starts, ends, filled = self._harmonic.window(count, margin)
+        hfreq, hmag, _ = clean_harmonic_tracks(hfreq, hmag.copy(), hphase.copy(), self.fs, self.plan.harmonic)
+        hfreq2, hmag2, _ = clean_harmonic_tracks(hfreq2, hmag2.copy(), hphase2.copy(), self.fs, self.plan.harmonic)
+        frames = slice(starts[0], ends[-1] + 1)
+        harmonics = harmonic_features(
+            hfreq[frames], hmag[frames], hfreq2[frames], hmag2[frames],
+            starts - starts[0], ends - starts[0], filled
+        )
+        self._harmonic.consume(count, margin)
+        
+        normalized, _, _ = normalize_frames(maximum)
+        indexes = vector_quantize(
+            normalized, len(self.centroids), self.centroids, method=self.vq_method, verbose=False
+        )
+        
+        # Frame n's period ends at (n + 1) / fps seconds into the stream
+        periodends = np.round((np.arange(self.emitted, self.emitted + count) + 1) * self.fs / self.fps)
+        latencies = np.maximum(arrived - periodends, 0) / self.fs + (time.perf_counter() - arrival)
+        self.max_latency = max(self.max_latency, float(latencies.max()))
+        
+        frames = StreamFrames(
+            start=self.emitted,
+            volumes=volumes,
+            balances=balances,
+            widths=widths,
+            indexes=indexes,
+            pitch=np.ascontiguousarray(harmonics[:, 0, 0]),
+            latencies=latencies
+        )
+        self.emitted += count
+        return frames
+    
+    def _join(self, frames: list[StreamFrames]) -> StreamFrames:
+        """Join consecutive StreamFrames (no frames, starting at emitted, if empty)."""
+        frames = [f for f in frames if len(f)]
+        if len(frames) == 1:
+            return frames[0]
+        if not frames:
+            frames = [StreamFrames(
+                start=self.emitted,
+                volumes=np.empty(0),
+                balances=np.empty(0),
+                widths=np.empty(0),
+                indexes=np.empty(0, dtype=np.min_scalar_type(len(self.centroids) - 1)),
+                pitch=np.empty(0),
+                latencies=np.empty(0)
+            )]
+        return StreamFrames(
+            start=frames[0].start,
+            volumes=np.concatenate([f.volumes for f in frames]),
+            balances=np.concatenate([f.balances for f in frames]),
+            widths=np.concatenate([f.widths for f in frames]),
+            indexes=np.concatenate([f.indexes for f in frames]),
+            pitch=np.concatenate([f.pitch for f in frames]),
+            latencies=np.concatenate([f.latencies for f in frames])
+        )
+
+
+class _ModelStream:
+    """
+    Analysis frames of one model that are not reduced to output frames
+    yet, with the output frame segments over them.
+    
+    Args:
+        params: Framing of the model.
+        model: Model family, for the analysis window.
+        ratio: Analysis frames per output frame.
+    
+    Attributes:
+        params: Framing of the model.
+        model: Model family.
+        ratio: Analysis frames per output frame.
+        computed: Number of analysis frames computed so far.
+    """
+    
+    def __init__(self, params: FrameParams, model: str, ratio: float) -> None:
+        self.params = params
+        self.model = model
+        self.ratio = ratio
+        self.computed = 0
+        # Stored arrays (one per quantity) start at stream frame _base
+        self._base = 0
+        self._arrays: list[NDArray[np.float64]] = []
+        # Last frame of every pending output frame, and the first frame of
+        # the next one (frame 0 is never part of one, as in segment_bounds())
+        self._ends: list[int] = []
+        self._next = 1
+    
+    def append(self, *arrays: NDArray[np.float64]) -> None:
+        """Store newly computed frames, one array per quantity."""
+        count = len(arrays[0])
+        if count == 0:
+            return
+        self._arrays = list(arrays) if not self._arrays else [
+            np.concatenate((stored, new)) for stored, new in zip(self._arrays, arrays)
+        ]
+        self._ends.extend(segment_triggers(self.computed, self.computed + count, self.ratio).tolist())
+        self.computed += count
+    
+    def finish(self) -> None:
+        """End the last output frame at the last analysis frame, as segment_bounds() does."""
+        last = self._ends[-1] if self._ends else self._next - 1
+        if self.computed - 1 > last:
+            self._ends.append(self.computed - 1)
+    
+    def complete(self, lookahead: int) -> int:
+        """Number of pending output frames computed up to lookahead frames past their end."""
+        return sum(1 for end in self._ends if end + lookahead < self.computed)
+    
+    def window(
+        self,
+        count: int,
+        lookback: int
+    ) -> tuple[list[NDArray[np.float64]], NDArray[np.intp], NDArray[np.intp], NDArray[np.bool_]]:
+        """
+        Stored frames and segment bounds of the next count output frames.
+        
+        Returns:
+            Tuple of (arrays, starts, ends, filled): the stored arrays from
+            up to lookback frames before the first output frame on, and
+            the segment bounds relative to them.
+        """
+        ends = np.array(self._ends[:count], dtype=np.intp)
+        starts = np.empty_like(ends)
+        starts[0] = self._next
+        starts[1:] = ends[:-1] + 1
+        first = max(self._next - lookback, self._base)
+        arrays = [array[first - self._base:] for array in self._arrays]
+        return arrays, starts - first, ends - first, starts <= ends
+    
+    def consume(self, count: int, lookback: int) -> None:
+        """Drop the next count output frames, keeping lookback frames before the rest."""
+        self._next = self._ends[count - 1] + 1
+        del self._ends[:count]
+        first = max(self._next - lookback, self._base)
+        self._arrays = [array[first - self._base:] for array in self._arrays]
+        self._base = first
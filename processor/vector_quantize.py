@@ -8,25 +8,72 @@ of centroids rather than storing the full spectral data.
 
 The process:
 1. Takes normalized STFT samples and pre-computed centroids from K-means
-2. Computes Euclidean distance from each sample to all centroids
+2. Streams the samples in tiles of frames, computing squared distances to
+   the centroids in float32 as ||c||^2 - 2 x.c (||x||^2 is the same for
+   every centroid, so it doesn't change the nearest one)
 3. Assigns each sample to the nearest centroid
-4. Returns array of centroid indices for efficient storage and rendering
+4. Returns array of centroid indices in the smallest unsigned integer type
+   that holds them, for efficient storage and rendering
+
+Memory use is bounded by the tile sizes, whatever the stem length, and
+large codebooks are processed a block of centroids at a time.
+
+The 'pruned' method returns the exact float64 nearest centroids, as
+scipy's cdist finds them, computing far fewer distances on coherent
+frames. Frames near each other in time usually map to the same or a
+neighbouring centroid, so each frame guesses the centroid of a nearby
+frame, and centroids too far from the guess to be nearer (by the triangle
+inequality: d(x, c_j) >= d(c_g, c_j) - d(x, c_g)) are skipped. Gathering
+the few distances it needs costs more per distance than the blocked
+matrix product, though: on 20000 frames of 1025 bins it only beats
+'blocked' with thousands of centroids and runs of ~100 frames that share
+a centroid, and is slower otherwise. Incoherent samples fall back to a
+full search.
 
 Example usage:
     assignments = vector_quantize(stft_samples, 24, centroids)
+    assignments = vector_quantize(stft_samples, 4096, centroids, method='pruned')
 """
 from __future__ import annotations
 
 import numpy as np
 from numpy.typing import NDArray
-from scipy.spatial.distance import cdist
+
+
+# Frames per tile
+VQ_BLOCK_SIZE: int = 4096
+
+# Centroids per tile; larger codebooks are searched block by block
+VQ_CENTROID_BLOCK_SIZE: int = 1024
+
+# Assignment methods
+VQ_METHODS: tuple[str, ...] = ('blocked', 'pruned')
+
+# Candidates above which a guessed centroid is too far from a frame to
+# narrow its search
+VQ_PRUNE_RESTART: int = 4
+
+# Frames between anchor frames, which are searched in full and give the
+# frames around them their guesses
+VQ_PRUNE_ANCHOR_SPACING: int = 16
+
+# Share of frames searched in full (other than anchors) above which the
+# rest of the samples are searched in full directly, without guesses
+VQ_PRUNE_FALLBACK: float = 0.25
+
+# Relative slack on the pruning bounds, well above float64 rounding error,
+# so centroids at (nearly) equal distance are always compared directly
+VQ_PRUNE_SLACK: float = 1e-9
 
 
 def vector_quantize(
-    stftsamples_normalized: list[list[float]],
+    stftsamples_normalized: NDArray[np.float64],
     centroidcount: int,
-    centroids: list[list[float]]
-) -> list[int]:
+    centroids: NDArray[np.float64],
+    block_size: int = VQ_BLOCK_SIZE,
+    method: str = 'blocked',
+    verbose: bool = True
+) -> NDArray[np.unsignedinteger]:
     """
     Assign each sample to its nearest centroid using Euclidean distance.
     
@@ -35,50 +82,393 @@ def vector_quantize(
     This allows the visualization to use compact centroid indices instead
     of full spectral data for each frame.
     
+    With the 'blocked' method, distances are computed in float32, tile by
+    tile, so at most block_size x VQ_CENTROID_BLOCK_SIZE distances exist at
+    a time. Samples nearly equidistant from two centroids may be assigned
+    differently than with float64 distances. The 'pruned' method walks the
+    frames in order and only computes the distances its bounds can't rule
+    out, in float64; it pays off for codebooks well beyond 24 centroids.
+    
     Args:
-        stftsamples_normalized: Normalized STFT samples to quantize.
-                               Each sample is a list of frequency bin values.
+        stftsamples_normalized: Normalized STFT samples to quantize,
+                               shape (frames, bins).
         centroidcount: Number of centroids (unused but kept for API compatibility
                       with the original interface). The actual centroid count
-                      is determined by the length of the centroids list.
-        centroids: List of centroid vectors from K-means clustering.
-                  Each centroid has the same dimensionality as the samples.
+                      is determined by the number of centroid rows.
+        centroids: Centroid vectors from K-means clustering, shape
+                  (centroidcount, bins).
+        block_size: Frames per tile.
+        method: 'blocked' for the tiled brute-force search, or 'pruned' for
+                the bound-pruned exact search.
+        verbose: Print a summary line when done (off for callers that
+                 quantize a few frames at a time).
     
     Returns:
-        List of cluster assignments, one integer index per sample.
-        Each index corresponds to the nearest centroid in the centroids list.
+        Array of cluster assignments, one integer index per sample, in the
+        smallest unsigned integer type that holds every centroid index
+        (uint8 for up to 256 centroids). Each index corresponds to the
+        nearest centroid row.
     
     Raises:
-        ValueError: If samples or centroids are empty.
+        ValueError: If samples or centroids are empty, block_size is not
+                    positive, or the method is unknown.
     
     Example:
-        >>> samples = [[0.1, 0.2], [0.8, 0.9], [0.15, 0.25]]
-        >>> centroids = [[0.1, 0.2], [0.8, 0.85]]
+        >>> samples = np.array([[0.1, 0.2], [0.8, 0.9], [0.15, 0.25]])
+        >>> centroids = np.array([[0.1, 0.2], [0.8, 0.85]])
         >>> assignments = vector_quantize(samples, 2, centroids)
         >>> assignments
-        [0, 1, 0]  # First and third samples assigned to centroid 0
+        array([0, 1, 0], dtype=uint8)  # First and third samples assigned to centroid 0
     """
-    if not stftsamples_normalized:
+    if len(stftsamples_normalized) == 0:
         raise ValueError("stftsamples_normalized cannot be empty")
     
-    if not centroids:
+    if len(centroids) == 0:
         raise ValueError("centroids cannot be empty")
     
-    # Convert to numpy arrays for efficient computation
-    samples_array: NDArray[np.float64] = np.array(stftsamples_normalized)
-    centroids_array: NDArray[np.float64] = np.array(centroids)
+    if block_size <= 0:
+        raise ValueError(f"block_size must be positive, got {block_size}")
+    
+    if method not in VQ_METHODS:
+        raise ValueError(f"method must be one of {VQ_METHODS}, got {method!r}")
+    
+    samples_array: NDArray[np.float64] = np.asarray(stftsamples_normalized)
+    if method == 'pruned':
+        return _pruned_vector_quantize(samples_array, np.asarray(centroids), block_size, verbose)
+    
+    centroids_array: NDArray[np.float32] = np.asarray(centroids, dtype=np.float32)
+    centroid_norms: NDArray[np.float32] = np.einsum(
+        'ij,ij->i', centroids_array, centroids_array
+    )
     
-    # Compute pairwise Euclidean distances between samples and centroids
-    # distances shape: (num_samples, num_centroids)
-    distances: NDArray[np.float64] = cdist(
-        samples_array,
-        centroids_array,
-        metric='euclidean'
+    assignments = np.empty(
+        len(samples_array), dtype=np.min_scalar_type(len(centroids_array) - 1)
     )
+    for start in range(0, len(samples_array), block_size):
+        block = np.asarray(samples_array[start:start + block_size], dtype=np.float32)
+        assignments[start:start + len(block)] = _nearest_centroids(
+            block, centroids_array, centroid_norms
+        )
+    
+    if verbose:
+        print(f"vector_quantize complete: {len(samples_array)} samples assigned to {len(centroids)} centroids")
+    
+    return assignments
+
+
+def _nearest_centroids(
+    block: NDArray[np.float32],
+    centroids: NDArray[np.float32],
+    centroid_norms: NDArray[np.float32]
+) -> NDArray[np.intp]:
+    """
+    Find the nearest centroid of each frame in a tile.
     
-    # Assign each sample to the nearest centroid (smallest distance)
-    assignments: NDArray[np.int64] = np.argmin(distances, axis=1)
+    Args:
+        block: Frames, shape (n, bins).
+        centroids: Centroids, shape (k, bins).
+        centroid_norms: Squared norms of the centroids, shape (k,).
+    
+    Returns:
+        Index of the nearest centroid per frame. Ties go to the lowest
+        index, as with argmin.
+    """
+    rows = np.arange(len(block))
+    nearest = np.zeros(len(block), dtype=np.intp)
+    best = np.full(len(block), np.inf, dtype=np.float32)
+    
+    for start in range(0, len(centroids), VQ_CENTROID_BLOCK_SIZE):
+        end = start + VQ_CENTROID_BLOCK_SIZE
+        # Squared distance up to the per-frame constant ||x||^2
+        distances = block @ centroids[start:end].T
+        distances *= -2.0
+        distances += centroid_norms[start:end]
+        
+        candidates = distances.argmin(axis=1)
+        values = distances[rows, candidates]
+        better = values < best
+        nearest[better] = candidates[better] + start
+        best[better] = values[better]
+    
+    return nearest
+
+
+def _pruned_vector_quantize(
+    samples: NDArray[np.float64],
+    centroids: NDArray[np.float64],
+    block_size: int,
+    verbose: bool = True
+) -> NDArray[np.unsignedinteger]:
+    """
+    Exact nearest-centroid search pruned with triangle-inequality bounds.
+    
+    Works a tile of frames at a time, with array operations over all the
+    frames of a step:
+    
+    1. Anchor frames, every VQ_PRUNE_ANCHOR_SPACING frames, are searched
+       in full (_full_search()).
+    2. Every other frame guesses the nearest centroid g of the anchor
+       before it, then of the anchor after it. Any centroid j with
+       d(c_g, c_j) > 2 d(x, c_g) is farther from the frame than c_g, so
+       only the stored neighbours of g within that distance (plus slack)
+       are compared (_bounded_search()). If there are more than
+       VQ_PRUNE_RESTART of them, the guess doesn't help.
+    3. Frames that neither guess helps with come in stretches of
+       consecutive frames. The first frame of each stretch is searched in
+       full (a restart), and guesses for the rest of its stretch.
+    4. Frames still left are searched in full. So are all the frames left
+       after step 2 once they are more than VQ_PRUNE_FALLBACK of the tile.
+    
+    Once restarts exceed VQ_PRUNE_FALLBACK of the frames so far, the
+    frames are not coherent enough for the bounds to pay off, and the
+    remaining tiles are searched in full directly. Ties go to the lowest
+    index, as with argmin.
+    
+    Args:
+        samples: Frames, shape (n, bins).
+        centroids: Centroids, shape (k, bins).
+        block_size: Frames per tile.
+        verbose: Print a summary line when done.
+    
+    Returns:
+        Index of the nearest centroid per frame, in the smallest unsigned
+        integer type that holds every centroid index.
+    """
+    centroids = np.asarray(centroids, dtype=np.float64)
+    count = len(centroids)
+    assignments = np.zeros(len(samples), dtype=np.min_scalar_type(count - 1))
+    if count == 1:
+        return assignments
+    
+    norms = np.einsum('ij,ij->i', centroids, centroids)
+    neighbours, neighbourdistances = _nearest_neighbours(
+        centroids, norms, min(VQ_PRUNE_RESTART + 1, count - 1)
+    )
     
-    print(f"vector_quantize complete: {len(samples_array)} samples assigned to {len(centroids)} centroids")
+    computed = 0
+    restarts = 0
+    fallback = False
+    for start in range(0, len(samples), block_size):
+        block = np.asarray(samples[start:start + block_size], dtype=np.float64)
+        if fallback:
+            nearest, tilecomputed = _full_search(block, centroids, norms)
+        else:
+            nearest, tilecomputed, tilerestarts = _pruned_tile(
+                block, centroids, norms, neighbours, neighbourdistances
+            )
+            restarts += tilerestarts
+            fallback = restarts > VQ_PRUNE_FALLBACK * (start + len(block))
+        assignments[start:start + len(block)] = nearest
+        computed += tilecomputed
     
-    return assignments.tolist()
+    if verbose:
+        print(f"vector_quantize complete: {len(samples)} samples assigned to {count} centroids "
+              f"(pruned, {computed / (len(samples) * count):.1%} of distances computed"
+              f"{', full search after too many restarts' if fallback else ''})")
+    
+    return assignments
+
+
+def _pruned_tile(
+    block: NDArray[np.float64],
+    centroids: NDArray[np.float64],
+    norms: NDArray[np.float64],
+    neighbours: NDArray[np.intp],
+    neighbourdistances: NDArray[np.float64]
+) -> tuple[NDArray[np.intp], int, int]:
+    """
+    Nearest centroids of a tile of frames, guessed from anchor frames.
+    
+    See _pruned_vector_quantize() for the steps.
+    
+    Returns:
+        Tuple of (nearest, computed, restarts): the nearest centroid per
+        frame, the number of distances computed and the number of frames
+        searched in full other than anchors.
+    """
+    n = len(block)
+    nearest = np.full(n, -1, dtype=np.intp)
+    anchors = np.arange(0, n, VQ_PRUNE_ANCHOR_SPACING)
+    nearest[anchors], computed = _full_search(block[anchors], centroids, norms)
+    
+    # Guess from the anchor before each frame, then from the one after it
+    before = anchors[np.arange(n) // VQ_PRUNE_ANCHOR_SPACING]
+    after = np.minimum(before + VQ_PRUNE_ANCHOR_SPACING, anchors[-1])
+    restarts = 0
+    for guessframes in (before, after, None):
+        rows = np.flatnonzero(nearest < 0)
+        if len(rows) == 0 or (guessframes is not before and len(rows) > VQ_PRUNE_FALLBACK * n):
+            # Done, or too incoherent for guesses to pay off
+            break
+        if guessframes is None:
+            # The first frame of each stretch of unresolved frames guesses
+            # for the rest of it
+            firsts = rows[np.r_[True, np.diff(rows) > 1]]
+            nearest[firsts], firstcomputed = _full_search(block[firsts], centroids, norms)
+            computed += firstcomputed
+            restarts += len(firsts)
+            rows = np.setdiff1d(rows, firsts, assume_unique=True)
+            guessframes = np.zeros(n, dtype=np.intp)
+            guessframes[rows] = firsts[np.searchsorted(firsts, rows, side='right') - 1]
+        found, rowcomputed = _bounded_search(
+            block[rows], nearest[guessframes[rows]], centroids, neighbours, neighbourdistances
+        )
+        nearest[rows] = found
+        computed += rowcomputed
+    
+    rows = np.flatnonzero(nearest < 0)
+    if len(rows):
+        nearest[rows], leftcomputed = _full_search(block[rows], centroids, norms)
+        computed += leftcomputed
+        restarts += len(rows)
+    return nearest, computed, restarts
+
+
+def _bounded_search(
+    frames: NDArray[np.float64],
+    guesses: NDArray[np.intp],
+    centroids: NDArray[np.float64],
+    neighbours: NDArray[np.intp],
+    neighbourdistances: NDArray[np.float64]
+) -> tuple[NDArray[np.intp], int]:
+    """
+    Nearest centroids of frames whose guess bounds the search.
+    
+    Only the guess and its stored neighbours within twice the frame's
+    distance to it can be nearest. Frames with more than VQ_PRUNE_RESTART
+    such neighbours are not searched.
+    
+    Returns:
+        Tuple of (nearest, computed): the nearest centroid per frame (-1
+        for frames not searched) and the number of distances computed.
+    """
+    guessdistances = _row_distances(frames, centroids[guesses])
+    limits = 2.0 * guessdistances * (1.0 + VQ_PRUNE_SLACK)
+    # Neighbours are sorted by distance, so those within the limit come first
+    within = neighbourdistances[guesses] <= limits[:, None]
+    reach = within.sum(axis=1)
+    nearest = np.where(reach <= VQ_PRUNE_RESTART, guesses, -1)
+    computed = len(frames)
+    
+    # Compare the candidates of the frames that have any, one neighbour
+    # rank at a time; the guess's distance comes from the same computation
+    search = np.flatnonzero((reach > 0) & (reach <= VQ_PRUNE_RESTART))
+    if len(search):
+        candidates = np.concatenate((guesses[search, None], neighbours[guesses[search], :VQ_PRUNE_RESTART]), axis=1)
+        distances = np.full(candidates.shape, np.inf)
+        distances[:, 0] = guessdistances[search]
+        for rank in range(1, candidates.shape[1]):
+            rows = np.flatnonzero(within[search, rank - 1])
+            if len(rows) == 0:
+                break
+            distances[rows, rank] = _row_distances(frames[search[rows]], centroids[candidates[rows, rank]])
+            computed += len(rows)
+        nearest[search] = _lowest_nearest(distances, candidates)
+    return nearest, computed
+
+
+def _full_search(
+    frames: NDArray[np.float64],
+    centroids: NDArray[np.float64],
+    norms: NDArray[np.float64]
+) -> tuple[NDArray[np.intp], int]:
+    """
+    Nearest centroids of frames by comparing every centroid.
+    
+    Distances come from one float32 matrix product in the Gram form
+    ||c||^2 - 2 x.c, computed a block of frames at a time, as in the
+    blocked method. Centroids within the product's rounding error bound of
+    the nearest one are compared again by their exact float64 distances,
+    so the result is the exact nearest centroid.
+    
+    Returns:
+        Tuple of (nearest, computed): the nearest centroid per frame and
+        the number of distances computed.
+    """
+    nearest = np.empty(len(frames), dtype=np.intp)
+    computed = len(frames) * len(centroids)
+    centroids32 = centroids.astype(np.float32)
+    norms32 = norms.astype(np.float32)
+    largest = float(np.sqrt(norms.max()))
+    # Bound on the float32 error of ||c||^2 - 2 x.c relative to
+    # ||c||^2 + 2 |x| |c|: rounding the operands, summing over the bins
+    # and the final subtraction. Either side of a comparison may be off by it.
+    error = 2.0 * (frames.shape[1] + 4) * float(np.finfo(np.float32).eps)
+    rowsperblock = max(1, VQ_BLOCK_SIZE * VQ_CENTROID_BLOCK_SIZE // len(centroids))
+    for start in range(0, len(frames), rowsperblock):
+        block = frames[start:start + rowsperblock]
+        approximate = block.astype(np.float32) @ centroids32.T
+        approximate *= -2.0
+        approximate += norms32
+        best = approximate.min(axis=1)
+        lengths = np.sqrt(np.einsum('ij,ij->i', block, block))
+        tolerance = error * (norms.max() + 2.0 * largest * lengths)
+        near = approximate <= (best + tolerance)[:, None]
+        nearest[start:start + len(block)] = near.argmax(axis=1)
+        
+        # Compare near ties by their exact distances, all at once
+        ties = np.flatnonzero(near.sum(axis=1) > 1)
+        if len(ties):
+            rows, candidates = np.nonzero(near[ties])
+            distances = _row_distances(block[ties[rows]], centroids[candidates])
+            closest = np.full(len(ties), np.inf)
+            np.minimum.at(closest, rows, distances)
+            # Candidates come in index order per row: keep each row's first winner
+            winners = np.flatnonzero(distances == closest[rows])
+            winners = winners[np.r_[True, np.diff(rows[winners]) > 0]]
+            nearest[start + ties] = candidates[winners]
+            computed += len(rows)
+    return nearest, computed
+
+
+def _nearest_neighbours(
+    centroids: NDArray[np.float64],
+    norms: NDArray[np.float64],
+    count: int
+) -> tuple[NDArray[np.intp], NDArray[np.float64]]:
+    """
+    Find each centroid's nearest other centroids, a block of rows at a time.
+    
+    Distances come from the Gram matrix form, which loses precision to
+    cancellation, so its error bound is taken off: the distances returned
+    are lower bounds, which keeps the pruning safe.
+    
+    Args:
+        centroids: Centroids, shape (k, bins).
+        norms: Squared norms of the centroids, shape (k,).
+        count: Neighbours to keep per centroid (at most k - 1).
+    
+    Returns:
+        Tuple of (indices, distances), each of shape (k, count), sorted by
+        distance per row.
+    """
+    neighbours = np.empty((len(centroids), count), dtype=np.intp)
+    distances = np.empty((len(centroids), count))
+    for start in range(0, len(centroids), VQ_CENTROID_BLOCK_SIZE):
+        rows = slice(start, start + VQ_CENTROID_BLOCK_SIZE)
+        normsums = norms[rows, None] + norms[None, :]
+        squared = normsums - 2.0 * (centroids[rows] @ centroids.T)
+        squared -= VQ_PRUNE_SLACK * normsums
+        between = np.sqrt(np.maximum(squared, 0.0))
+        
+        # Exclude each centroid itself
+        between[np.arange(len(between)), np.arange(start, start + len(between))] = np.inf
+        
+        nearest = np.argpartition(between, count - 1, axis=1)[:, :count]
+        nearestdistances = np.take_along_axis(between, nearest, axis=1)
+        order = np.argsort(nearestdistances, axis=1, kind='stable')
+        neighbours[rows] = np.take_along_axis(nearest, order, axis=1)
+        distances[rows] = np.take_along_axis(nearestdistances, order, axis=1)
+    return neighbours, distances
+
+
+def _row_distances(frames: NDArray[np.float64], centroids: NDArray[np.float64]) -> NDArray[np.float64]:
+    """Euclidean distance from each frame to the centroid in the same row."""
+    diffs = frames - centroids
+    return np.sqrt(np.einsum('ij,ij->i', diffs, diffs))
+
+
+def _lowest_nearest(distances: NDArray[np.float64], candidates: NDArray[np.intp]) -> NDArray[np.intp]:
+    """Per row, the lowest candidate index among those at the smallest distance."""
+    ties = distances == distances.min(axis=1, keepdims=True)
+    return np.where(ties, candidates, np.iinfo(np.intp).max).min(axis=1)
@@ -11,6 +11,8 @@ analysis pipeline:
 
 The worker processes audio in chunks to manage memory efficiently, then
 aggregates results into dictionaries for the parent analysis module.
+process_chunk() holds the per-chunk work itself so it can also be run in
+a process pool.
 
 The processing includes:
 - Converting dB magnitude to linear amplitude
@@ -20,7 +22,7 @@ The processing includes:
 
 Example usage:
     worker_processor(
-        'song.wav', 44100, 24, left_audio, right_audio,
+        'song.wav', 44100, 24, ArraySource(left_audio, right_audio),
         chunk_idx=0, total_chunks=10, chunk_len=88200, total_len=882000,
         stft_dict, stft2_dict, harmonic_dict, resid_dict,
         volume_dict, balance_dict, width_dict
@@ -28,27 +30,30 @@ Example usage:
 """
 from __future__ import annotations
 
-import math
 from typing import Any
 
 import numpy as np
 from numpy.typing import NDArray
 
+from analysis_plan import (
+    AMPLITUDE_DB_DIVISOR, EMPTY_FRAME_DB, POWER_DB_DIVISOR, AnalysisPlan, get_plan
+)
+from audio_source import AudioSource
 from processor import processor
+from spectral_frontend import SpectralFrontEnd
 
 
 # Type aliases for result dictionaries
-STFTDict = dict[int, list[list[float]]]
-HarmonicDict = dict[int, list[list[list[float]]]]
-VolumeDict = dict[int, list[float]]
+STFTDict = dict[int, NDArray[np.float64]]
+HarmonicDict = dict[int, NDArray[np.float64]]
+VolumeDict = dict[int, NDArray[np.float64]]
 
 
 def worker_processor(
     filename: str,
     fs: int,
     fps: int,
-    x: NDArray[np.float64],
-    x2: NDArray[np.float64],
+    source: AudioSource,
     i: int,
     chunkcount: int,
     chunklen: int,
@@ -72,8 +77,7 @@ def worker_processor(
         filename: Name of the audio file being processed (for logging).
         fs: Sample rate in Hz (e.g., 44100).
         fps: Target frames per second for output (e.g., 24 for video).
-        x: Left channel audio samples as numpy array.
-        x2: Right channel audio samples as numpy array.
+        source: Stereo audio source; only this chunk's samples are read.
         i: Current chunk index (0-based).
         chunkcount: Total number of full chunks.
         chunklen: Number of samples per chunk.
@@ -94,7 +98,8 @@ def worker_processor(
     
     Example:
         >>> stft_results = {}
-        >>> worker_processor('test.wav', 44100, 24, left, right, 0, 1, 88200, 88200,
+        >>> worker_processor('test.wav', 44100, 24, ArraySource(left, right),
+        ...                  0, 1, 88200, 88200,
         ...                  stft_results, {}, {}, {}, {}, {}, {})
         >>> len(stft_results[0])  # Number of frames at 24fps
         48
@@ -103,17 +108,12 @@ def worker_processor(
     chunkdelta: int = i * chunklen
     
     # Get this chunk of audio
-    xchunk: NDArray[np.float64] = x[chunkdelta:chunklen + chunkdelta]
-    xchunk2: NDArray[np.float64] = x2[chunkdelta:chunklen + chunkdelta]
+    xchunk, xchunk2 = source.read(chunkdelta, chunklen + chunkdelta)
     
-    # STFT Analysis
-    stftsamples, stftsamples2, volume, balance, width = _process_stft(
-        fs, fps, xchunk, xchunk2
+    stftsamples, stftsamples2, harmonicsamples, volume, balance, width = process_chunk(
+        fs, fps, xchunk, xchunk2, chunklen
     )
     
-    # Harmonic Model Analysis
-    harmonicsamples = _process_harmonic(fs, fps, xchunk, xchunk2, chunklen)
-    
     # Store results in dictionaries
     return_dict_stft[origi] = stftsamples
     return_dict_stft2[origi] = stftsamples2
@@ -125,12 +125,87 @@ def worker_processor(
     print(f"{filename} worker {origi}/{chunkcount}")
 
 
-def _process_stft(
+def process_chunk(
     fs: int,
     fps: int,
     xchunk: NDArray[np.float64],
-    xchunk2: NDArray[np.float64]
-) -> tuple[list[list[float]], list[list[float]], list[float], list[float], list[float]]:
+    xchunk2: NDArray[np.float64],
+    chunklen: int
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Run STFT and harmonic analysis on a single stereo chunk.
+    
+    This is the side-effect free core of worker_processor(). It only sees
+    the chunk's samples, so it can be shipped to a worker process without
+    pickling the whole song.
+    
+    Args:
+        fs: Sample rate in Hz.
+        fps: Target frames per second.
+        xchunk: Left channel audio chunk.
+        xchunk2: Right channel audio chunk.
+        chunklen: Nominal number of samples per chunk.
+    
+    Returns:
+        Tuple of arrays (stft_left, stft_right, harmonics, volumes, balances,
+        widths). The STFT arrays are (frames, bins), harmonics is
+        (frames, 2, nH) and the rest are one value per frame.
+    """
+    # Settings and segment maps shared by every chunk at this fs and fps
+    plan = get_plan(fs, fps)
+    
+    # One spectral front-end per channel, shared by every model run on it
+    frontend = SpectralFrontEnd(xchunk)
+    frontend2 = SpectralFrontEnd(xchunk2)
+    
+    # STFT Analysis
+    stftsamples, stftsamples2, volume, balance, width = _process_stft(
+        plan, xchunk, xchunk2, frontend, frontend2
+    )
+    
+    # Harmonic Model Analysis
+    harmonicsamples = _process_harmonic(
+        plan, xchunk, xchunk2, chunklen, frontend, frontend2
+    )
+    
+    return stftsamples, stftsamples2, harmonicsamples, volume, balance, width
+
+
+def process_region(
+    fs: int,
+    fps: int,
+    region: AudioSource,
+    chunklen: int
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Read a one-chunk audio region and run process_chunk() on it.
+    
+    Used by the process pool in analysis(): a WavSource region is pickled as
+    its path and sample range, so each worker reads its own chunk.
+    
+    Args:
+        fs: Sample rate in Hz.
+        fps: Target frames per second.
+        region: Source covering exactly one chunk.
+        chunklen: Nominal number of samples per chunk.
+    
+    Returns:
+        Same as process_chunk().
+    """
+    xchunk, xchunk2 = region.read(0, len(region))
+    return process_chunk(fs, fps, xchunk, xchunk2, chunklen)
+
+
+def _process_stft(
+    plan: AnalysisPlan,
+    xchunk: NDArray[np.float64],
+    xchunk2: NDArray[np.float64],
+    frontend: SpectralFrontEnd | None = None,
+    frontend2: SpectralFrontEnd | None = None
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64]]:
     """
     Process STFT analysis and extract volume, balance, and width.
     
@@ -139,17 +214,19 @@ def _process_stft(
     and calculates stereo characteristics.
     
     Args:
-        fs: Sample rate in Hz.
-        fps: Target frames per second.
+        plan: Analysis plan for the sample rate and target fps.
         xchunk: Left channel audio chunk.
         xchunk2: Right channel audio chunk.
+        frontend: Spectral front-end for the left channel.
+        frontend2: Spectral front-end for the right channel.
     
     Returns:
-        Tuple of (stft_left, stft_right, volumes, balances, widths).
+        Tuple of arrays (stft_left, stft_right, volumes, balances, widths).
     
     Algorithm:
         1. Compute STFT for both channels
-        2. For each target frame period:
+        2. Split the STFT frames into target frame periods
+        3. For every period at once (array operations):
            - Find peak magnitude at each frequency bin
            - Convert dB to linear amplitude: 10^(dB/10)
            - Sum magnitudes for volume
@@ -157,91 +234,83 @@ def _process_stft(
            - Calculate average absolute difference for width
     """
     # Perform STFT analysis on both channels
-    result: list[list[float]] = processor(fs, xchunk, 'TheSTFT', False)
-    result2: list[list[float]] = processor(fs, xchunk2, 'TheSTFT', False)
-    
-    # Calculate STFT parameters
-    numframes: int = len(result[0])
-    analysislen: int = len(result[0][0]) - 1
-    
-    hopsize: int = 512
-    fftsizeratio: float = float(analysislen) / hopsize
-    framelen: float = float(fs) / fps * fftsizeratio
-    ratio: float = float(framelen) / analysislen
-    
-    # Initialize output arrays
-    stftsamples: list[list[float]] = []
-    stftsamples2: list[list[float]] = []
-    volume: list[float] = []
-    balance: list[float] = []
-    width: list[float] = []
-    
-    rprev: float = 0.0
-    delta: int = 0
-    
-    # Iterate over STFT frames and downsample to target FPS
-    for frame_idx in range(numframes):
-        r: float = frame_idx % ratio
-        
-        # Trigger output at frame boundaries
-        if r < rprev or frame_idx == numframes - 1:
-            # Find peak magnitude at each frequency bin across the window
-            maximum: list[float] = [-1000.0] * analysislen
-            maximum2: list[float] = [-1000.0] * analysislen
-            
-            for j in range(delta):
-                for k in range(analysislen):
-                    if result[0][frame_idx - j][k] > maximum[k]:
-                        maximum[k] = result[0][frame_idx - j][k]
-                    if result2[0][frame_idx - j][k] > maximum2[k]:
-                        maximum2[k] = result2[0][frame_idx - j][k]
-            
-            # Convert to linear amplitude and calculate volume
-            # Formula: linear = 10^(dB/10) for power (was /20 for amplitude)
-            # Reference: http://www.mogami.com/e/cad/db.html
-            sums: float = 0.0
-            sums2: float = 0.0
-            
-            for j in range(analysislen):
-                maximum[j] = math.pow(10, maximum[j] / 10)
-                maximum2[j] = math.pow(10, maximum2[j] / 10)
-                sums += maximum[j]
-                sums2 += maximum2[j]
-            
-            # Calculate pan (balance): left-right difference
-            pan: float = sums2 - sums
-            
-            # Calculate stereo width: average absolute difference
-            thewidth: float = 0.0
-            for j in range(delta):
-                for k in range(analysislen):
-                    thewidth += result[0][frame_idx - j][k] - result2[0][frame_idx - j][k]
-            thewidth = abs(thewidth) / analysislen
-            
-            # Use loudest channel for volume
-            thevolume: float = sums if sums >= sums2 else sums2
-            
-            # Store results
-            stftsamples.append(maximum)
-            stftsamples2.append(maximum2)
-            volume.append(thevolume)
-            balance.append(pan)
-            width.append(thewidth)
-            delta = 0
+    mX: NDArray[np.float64] = processor(plan.fs, xchunk, 'TheSTFT', False, frontend, plan)[0]
+    mX2: NDArray[np.float64] = processor(plan.fs, xchunk2, 'TheSTFT', False, frontend2, plan)[0]
+    
+    # Output frame boundaries over the STFT frames
+    starts, ends, filled = plan.stft_segments(mX.shape[0])
+    
+    return stft_features(mX, mX2, starts, filled)
+
+
+def stft_features(
+    mX: NDArray[np.float64],
+    mX2: NDArray[np.float64],
+    starts: NDArray[np.intp],
+    filled: NDArray[np.bool_]
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Reduce STFT frames to output frames (the frame -> fps step).
+    
+    Args:
+        mX: Left channel STFT magnitudes (dB), shape (frames, N // 2 + 1).
+        mX2: Right channel STFT magnitudes, same shape.
+        starts: First STFT frame of each output frame. Each output frame
+                runs up to the next filled one's start, the last one to the
+                end of mX.
+        filled: Which output frames have any STFT frames.
+    
+    Returns:
+        Tuple of arrays (stft_left, stft_right, volumes, balances, widths),
+        as for _process_stft().
+    """
+    analysislen: int = mX.shape[1] - 1
+    
+    # Peak magnitude at each frequency bin across each window (dB).
+    # The Nyquist bin is dropped, as before.
+    maximum = np.full((len(starts), analysislen), EMPTY_FRAME_DB)
+    maximum2 = np.full((len(starts), analysislen), EMPTY_FRAME_DB)
+    
+    # Stereo width accumulates the signed left-right dB difference
+    thewidth = np.zeros(len(starts))
+    
+    if filled.any():
+        segstarts = starts[filled]
+        maximum[filled] = np.maximum.reduceat(mX[:, :analysislen], segstarts, axis=0)
+        maximum2[filled] = np.maximum.reduceat(mX2[:, :analysislen], segstarts, axis=0)
         
-        rprev = r
-        delta += 1
+        framediff = (mX[:, :analysislen] - mX2[:, :analysislen]).sum(axis=1)
+        thewidth[filled] = np.add.reduceat(framediff, segstarts)
+    
+    # Convert to linear amplitude and calculate volume
+    # Formula: linear = 10^(dB/10) for power (was /20 for amplitude)
+    # Reference: http://www.mogami.com/e/cad/db.html
+    maximum = np.power(10.0, maximum / POWER_DB_DIVISOR)
+    maximum2 = np.power(10.0, maximum2 / POWER_DB_DIVISOR)
+    sums = maximum.sum(axis=1)
+    sums2 = maximum2.sum(axis=1)
+    
+    # Calculate pan (balance): left-right difference
+    pan = sums2 - sums
+    
+    # Calculate stereo width: average absolute difference
+    thewidth = np.abs(thewidth) / analysislen
     
-    return stftsamples, stftsamples2, volume, balance, width
+    # Use loudest channel for volume
+    thevolume = np.where(sums >= sums2, sums, sums2)
+    
+    return maximum, maximum2, thevolume, pan, thewidth
 
 
 def _process_harmonic(
-    fs: int,
-    fps: int,
+    plan: AnalysisPlan,
     xchunk: NDArray[np.float64],
     xchunk2: NDArray[np.float64],
-    chunklen: int
-) -> list[list[list[float]]]:
+    chunklen: int,
+    frontend: SpectralFrontEnd | None = None,
+    frontend2: SpectralFrontEnd | None = None
+) -> NDArray[np.float64]:
     """
     Process harmonic model analysis for pitch tracking.
     
@@ -249,91 +318,89 @@ def _process_harmonic(
     frequencies and magnitudes, and downsamples to target frame rate.
     
     Args:
-        fs: Sample rate in Hz.
-        fps: Target frames per second.
+        plan: Analysis plan for the sample rate and target fps.
         xchunk: Left channel audio chunk.
         xchunk2: Right channel audio chunk.
         chunklen: Length of the audio chunk in samples.
+        frontend: Spectral front-end for the left channel.
+        frontend2: Spectral front-end for the right channel.
     
     Returns:
-        List of [frequencies, magnitudes] pairs for each output frame.
-        Each frame contains merged left/right harmonic data.
+        Array of shape (frames, 2, nH) holding [frequencies, magnitudes]
+        for each output frame. Each frame contains merged left/right
+        harmonic data.
     
     Algorithm:
         1. Compute harmonic analysis for both channels
-        2. For each target frame period:
+        2. Split the harmonic frames into target frame periods
+        3. For every period at once (segment sums over the
+           (frames, nH) matrices):
            - Average harmonic frequencies and magnitudes across window
            - Convert magnitude from dB to linear: 10^(dB/20)
            - Merge left and right channel data
     """
     # Perform harmonic model analysis
-    HMresult: list[list[list[float]]] = processor(fs, xchunk, 'TheHM', False)
-    HMresult2: list[list[list[float]]] = processor(fs, xchunk2, 'TheHM', False)
+    hfreq, hmag, _ = processor(plan.fs, xchunk, 'TheHM', False, frontend, plan)
+    hfreq2, hmag2, _ = processor(plan.fs, xchunk2, 'TheHM', False, frontend2, plan)
     
-    # Calculate harmonic analysis parameters
-    numframes: int = len(HMresult[0])
-    nH: int = len(HMresult[0][0])  # Number of harmonics
-    analysislen: float = float(chunklen) / numframes
+    # Output frame boundaries over the harmonic model frames
+    starts, ends, filled = plan.harmonic_segments(hfreq.shape[0], chunklen)
     
-    hopsize: int = 128
-    fftsizeratio: float = float(analysislen) / hopsize
-    framelen: float = float(fs) / fps * fftsizeratio
-    ratio: float = float(framelen) / analysislen
+    return harmonic_features(hfreq, hmag, hfreq2, hmag2, starts, ends, filled)
+
+
+def harmonic_features(
+    hfreq: NDArray[np.float64],
+    hmag: NDArray[np.float64],
+    hfreq2: NDArray[np.float64],
+    hmag2: NDArray[np.float64],
+    starts: NDArray[np.intp],
+    ends: NDArray[np.intp],
+    filled: NDArray[np.bool_]
+) -> NDArray[np.float64]:
+    """
+    Reduce harmonic model frames to output frames (the frame -> fps step).
     
-    # Initialize output
-    harmonicsamples: list[list[list[float]]] = []
+    Args:
+        hfreq: Left channel harmonic frequencies, shape (frames, nH).
+        hmag: Left channel harmonic magnitudes (dB), same shape.
+        hfreq2: Right channel harmonic frequencies, same shape.
+        hmag2: Right channel harmonic magnitudes, same shape.
+        starts: First harmonic frame of each output frame. Each output
+                frame runs up to the next filled one's start, the last one
+                to the end of hfreq.
+        ends: Last harmonic frame of each output frame (inclusive).
+        filled: Which output frames have any harmonic frames.
     
-    rprev: float = 0.0
-    delta: int = 0
+    Returns:
+        Array of shape (frames, 2, nH), as for _process_harmonic().
+    """
+    nH: int = hfreq.shape[1]  # Number of harmonics
     
-    # Iterate over harmonic frames and downsample to target FPS
-    for frame_idx in range(numframes):
-        r: float = frame_idx % ratio
-        
-        # Trigger output at frame boundaries
-        if r < rprev or frame_idx == numframes - 1:
-            # Initialize averaging arrays
-            hfreqaverages: list[float] = [0.0] * nH
-            hfreqaverages2: list[float] = [0.0] * nH
-            hmagaverages: list[float] = [0.0] * nH
-            hmagaverages2: list[float] = [0.0] * nH
-            
-            # Sum values across window for averaging
-            for j in range(delta):
-                for k in range(nH):
-                    hfreqaverages[k] += HMresult[0][frame_idx - j][k]
-                    hfreqaverages2[k] += HMresult2[0][frame_idx - j][k]
-                    hmagaverages[k] += HMresult[1][frame_idx - j][k]
-                    hmagaverages2[k] += HMresult2[1][frame_idx - j][k]
-            
-            # Calculate averages and convert magnitude to linear
-            for j in range(nH):
-                # Average frequencies (rounded to integer Hz)
-                hfreqaverages[j] = int(round(hfreqaverages[j] / delta)) if delta > 0 else 0
-                hfreqaverages2[j] = int(round(hfreqaverages2[j] / delta)) if delta > 0 else 0
-                
-                # Average magnitudes
-                hmagaverages[j] = hmagaverages[j] / delta if delta > 0 else 0
-                hmagaverages2[j] = hmagaverages2[j] / delta if delta > 0 else 0
-                
-                # Convert dB to linear amplitude: 10^(dB/20)
-                hmagaverages[j] = math.pow(10, hmagaverages[j] / 20)
-                hmagaverages2[j] = math.pow(10, hmagaverages2[j] / 20)
-            
-            # Merge left and right channels (average)
-            hfreqaveragesmerged: list[float] = []
-            hmagaveragesmerged: list[float] = []
-            
-            for j in range(nH):
-                hfreqaveragesmerged.append((hfreqaverages[j] + hfreqaverages2[j]) / 2)
-                hmagaveragesmerged.append((hmagaverages[j] + hmagaverages2[j]) / 2)
-            
-            harmonicsamples.append([hfreqaveragesmerged, hmagaveragesmerged])
-            delta = 0
-        
-        rprev = r
-        delta += 1
+    delta = (ends - starts + 1)[filled, np.newaxis]
     
-    return harmonicsamples
-
-
+    # Average values across each window. Empty windows average to 0.
+    hfreqaverages = np.zeros((len(starts), nH))
+    hfreqaverages2 = np.zeros((len(starts), nH))
+    hmagaverages = np.zeros((len(starts), nH))
+    hmagaverages2 = np.zeros((len(starts), nH))
+    
+    if filled.any():
+        segstarts = starts[filled]
+        # Average frequencies (rounded to integer Hz)
+        hfreqaverages[filled] = np.round(np.add.reduceat(hfreq, segstarts, axis=0) / delta)
+        hfreqaverages2[filled] = np.round(np.add.reduceat(hfreq2, segstarts, axis=0) / delta)
+        # Average magnitudes
+        hmagaverages[filled] = np.add.reduceat(hmag, segstarts, axis=0) / delta
+        hmagaverages2[filled] = np.add.reduceat(hmag2, segstarts, axis=0) / delta
+    
+    # Convert dB to linear amplitude: 10^(dB/20)
+    hmagaverages = np.power(10.0, hmagaverages / AMPLITUDE_DB_DIVISOR)
+    hmagaverages2 = np.power(10.0, hmagaverages2 / AMPLITUDE_DB_DIVISOR)
+    
+    # Merge left and right channels (average)
+    hfreqaveragesmerged = (hfreqaverages + hfreqaverages2) / 2
+    hmagaveragesmerged = (hmagaverages + hmagaverages2) / 2
+    
+    # One [freqs, mags] pair per output frame
+    return np.stack((hfreqaveragesmerged, hmagaveragesmerged), axis=1)
@@ -0,0 +1,93 @@
+//Song bundle: the stems' JSON and data files packed into one file (see processor/analysis_format.py)
+export class Bundle {
+  constructor(file, ranged = false) {
+    this.file = file;
+    this.ranged = ranged; //Fetch each file by byte range instead of the whole bundle at once
+    this.buffer = null;
+    this.files = {};
+    this.start = 0;
+  }
+
+  //Calls callback once the manifest is read, or onerror (with the error) if the bundle can't be loaded
+  load(callback, onerror = () => {}) {
+    const mythis = this;
+    const fail = error => {
+      console.log(`${mythis.file}: ${error.message}`);
+      onerror(error);
+    };
+    //readHeader throws on a body that isn't a bundle
+    const attempt = step => response => {
+      try { step(response); } catch (error) { fail(error); }
+    };
+    if(this.ranged){
+      //Header first, for the manifest length, then the manifest
+      this.request(0, 16, attempt(header => {
+        const length = mythis.readHeader(header);
+        mythis.request(16, length, attempt(manifest => {
+          mythis.readManifest(manifest, length);
+          callback();
+        }), fail);
+      }), fail);
+    }else{
+      this.request(undefined, undefined, attempt(buffer => {
+        const length = mythis.readHeader(buffer);
+        mythis.readManifest(buffer.slice(16, 16 + length), length);
+        mythis.buffer = buffer;
+        callback();
+      }), fail);
+    }
+  }
+
+  readHeader(arrayBuffer) {
+    if(arrayBuffer.byteLength < 16){
+      throw new Error('unsupported song bundle');
+    }
+    const view = new DataView(arrayBuffer);
+    const magic = String.fromCharCode(...new Uint8Array(arrayBuffer, 0, 4));
+    if(magic != 'AVSB' || view.getUint16(4, true) != 1 || view.getUint16(6, true) != 0xFEFF){
+      throw new Error('unsupported song bundle');
+    }
+    return view.getUint32(8, true);
+  }
+
+  readManifest(arrayBuffer, length) {
+    this.files = JSON.parse(new TextDecoder().decode(arrayBuffer)).files;
+    //Files start after the manifest, 8-byte aligned
+    this.start = Math.ceil((16 + length) / 8) * 8;
+  }
+
+  has(name) {
+    return name in this.files;
+  }
+
+  read(name, callback, onerror = () => {}) {
+    const [offset, length] = this.files[name];
+    if(this.buffer){
+      //Copied out so the file's sections start at offset 0, as when fetched on its own
+      callback(this.buffer.slice(this.start + offset, this.start + offset + length));
+    }else{
+      this.request(this.start + offset, length, callback, onerror);
+    }
+  }
+
+  request(offset, length, callback, onerror = () => {}) {
+    const oReqs = new XMLHttpRequest();
+    oReqs.open("GET", this.file, true);
+    oReqs.responseType = "arraybuffer";
+    if(offset !== undefined){
+      oReqs.setRequestHeader("Range", `bytes=${offset}-${offset + length - 1}`);
+    }
+    oReqs.onload = function (oEvent) {
+      if((this.status != 200 && this.status != 206) || !this.response){
+        onerror(new Error(`request failed with status ${this.status}`));
+      }else{
+        //A server without range support sends the whole file
+        callback(offset !== undefined && this.status == 200 ? this.response.slice(offset, offset + length) : this.response);
+      }
+    }
+    oReqs.onerror = function () {
+      onerror(new Error('request failed'));
+    }
+    oReqs.send(null);
+  }
+}
@@ -42,15 +42,24 @@ export class Scene {
     constructor() {
       const mythis = this;
 
-      //Backend connection
-      /*this.socket = io.connect('http://localhost:3000');*/
-      this.export = false; //Not really working
+      //Backend connection, for frame capture (see capture.js): ?capture=true renders the
+      //first song into a video on the Node server, then stops
+      this.socket = null;
+      this.captureserver = 'http://localhost:3001';
+      this.export = false;
+      this.capturing = false;
+      this.captureinflight = 0; //Frames sent but not yet acknowledged by the server
+      this.capturemaxinflight = 4; //More than this and frames are skipped instead of piling up
+      this.capturedropped = 0;
       this.stop_on_next = false;
 
       // Check for devmode URL parameter
       const urlParams = new URLSearchParams(window.location.search);
       const devmode = urlParams.get('devmode') === 'true';
       this.hide_controls = !devmode;
+      if(urlParams.get('capture') === 'true'){
+        this.startCapture();
+      }
 
       // Update version display from build-time environment variable
       const versionElement = document.getElementById('version');
@@ -240,6 +249,7 @@ export class Scene {
         this.songs[this.currentsong].stop();
         this.playdiv.style.display = 'block';
         this.paused = true;
+        if(this.export) this.endCapture();
       }
     }
 
@@ -299,13 +309,70 @@ export class Scene {
         this.then = this.now - (this.delta % this.interval);
         this.renderer.render(this.scene, this.camera);
         if(this.export){
-          //this.socket.emit('render-frame', {frame: mythis.frame, file: document.querySelector('canvas').toDataURL()});
+          this.captureFrame();
         }
         this.stats.update();
         this.frame = Math.round((this.now - this.animationstart) / 41.666666666); //1000ms / 24fps = 41.666666666
       }
     }
 
+    //Connect to the capture server, loading its socket.io client first; frames are
+    //captured once connected, and the capture ends when playback stops (after this song)
+    startCapture() {
+      const mythis = this;
+      this.export = true;
+      this.stop_on_next = true;
+      const script = document.createElement('script');
+      script.src = `${this.captureserver}/socket.io/socket.io.js`;
+      script.onload = () => {
+        mythis.socket = io(mythis.captureserver);
+      };
+      script.onerror = () => {
+        console.log(`Capture: no capture server at ${mythis.captureserver}`);
+        mythis.export = false;
+      };
+      document.head.appendChild(script);
+    }
+
+    //Send the frame just rendered to the server's encoder as raw pixels
+    captureFrame() {
+      const mythis = this;
+      if(!this.export || !this.socket || !this.socket.connected) return;
+      const gl = this.renderer.getContext();
+      const width = gl.drawingBufferWidth;
+      const height = gl.drawingBufferHeight;
+      if(!this.capturing){
+        this.capturing = true;
+        this.socket.emit('capture-start', {width: width, height: height, fps: this.fps, format: 'rgba'}, (reply) => {
+          console.log('Capture:', reply);
+        });
+      }
+      if(this.captureinflight >= this.capturemaxinflight){
+        this.capturedropped++; //The server fills the gap with the previous frame
+        return;
+      }
+
+      //Read right after rendering, while the drawing buffer still holds the frame (bottom row first)
+      const pixels = new Uint8Array(width * height * 4);
+      gl.readPixels(0, 0, width, height, gl.RGBA, gl.UNSIGNED_BYTE, pixels);
+      this.captureinflight++;
+      this.socket.emit('capture-frame', this.frame, pixels.buffer, () => {
+        mythis.captureinflight--;
+      });
+    }
+
+    endCapture() {
+      const mythis = this;
+      this.export = false;
+      this.stop_on_next = false;
+      if(this.capturing){
+        this.socket.emit('capture-end', (summary) => {
+          console.log('Capture finished:', summary, 'skipped in browser:', mythis.capturedropped);
+        });
+        this.capturing = false;
+      }
+    }
+
     updateScene() {
       this.songs[this.currentsong].updateAnimation();
       this.camera.lookAt(this.cameralookat);
@@ -1,6 +1,7 @@
 import * as THREE from 'three';
 import { SongGui } from './song_gui.js';
 import { Stem } from './stem.js';
+import { Bundle } from './bundle.js';
 import { getColorSet } from './colors/colorsWarmCold.js';
 
 export class Song {
@@ -24,6 +25,9 @@ export class Song {
     this.ignoreending = false;
     this.stemnames = [];
     this.stems = [];
+    this.codebooks = {}; //Shared codebooks, filled in by the stems
+    this.bundle = null; //Song bundle, if the processor wrote one
+    this.bundleranges = false; //Fetch bundled files by byte range instead of all at once
     this.loadingstage = 0;
     this.order = [];
     this.colors = [];
@@ -56,6 +60,20 @@ export class Song {
       mythis.mp3file = json[0].mp3file;
       mythis.stemnames = json[0].audiofiles;
 
+      //Load the song bundle alongside the attributes and mp3
+      const bundleloaded = new Promise(resolve => {
+        if(json[0].bundle){
+          mythis.bundle = new Bundle(`${mythis.location + json[0].bundle.file}?v=${json[0].bundle.version}`, mythis.bundleranges);
+          //Without it the stems request their files one by one
+          mythis.bundle.load(resolve, () => {
+            mythis.bundle = null;
+            resolve();
+          });
+        }else{
+          resolve();
+        }
+      });
+
       //Load attributes
       //mythis.loadJSON(`${mythis.location + mythis.attributesjson}?v=${Math.round(Math.random()*1000)}`, response => {
       mythis.loadJSON(`${mythis.location + mythis.attributesjson}`, response => {
@@ -102,9 +120,11 @@ export class Song {
           };
 
           //Create stems
-          for(let i=0; i<mythis.stemnames.length; i++){
-            mythis.stems[i] = mythis.createStem(mythis.stemnames[i], i, mythis.order[i]);
-          }
+          bundleloaded.then(() => {
+            for(let i=0; i<mythis.stemnames.length; i++){
+              mythis.stems[i] = mythis.createStem(mythis.stemnames[i], i, mythis.order[i]);
+            }
+          });
         });
       });
     });
@@ -114,7 +134,7 @@ export class Song {
     const mythis = this;
 
     //Create the stem
-    const thestem = new Stem(this.location, name, i, order, this.scene, this.stemgroup, this.colors[i]);
+    const thestem = new Stem(this.location, name, i, order, this.scene, this.stemgroup, this.colors[i], this.codebooks, this.bundle);
     thestem.onLoaded = () => {
 
       //If all stems are loaded
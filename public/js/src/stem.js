@@ -3,7 +3,7 @@ import { Triangles } from './models/triangles.js';
 import { Spectrum } from './models/spectrum.js';
 
 export class Stem {
-  constructor(location, name, index, order, scene, stemgroup, color) {
+  constructor(location, name, index, order, scene, stemgroup, color, codebooks = {}, bundle = null) {
     this.location = location;
     this.name = name;
     this.index = index;
@@ -11,6 +11,8 @@ export class Stem {
     this.scene = scene;
     this.stemgroup = stemgroup;
     this.color = color;
+    this.codebooks = codebooks; //Shared codebooks by file, loaded once per song
+    this.bundle = bundle; //Song bundle the stem's files are read from, if any
 
     //Variables
     //this.jsonfile = `${this.name}_analysis.json?v=${Math.round(Math.random()*1000)}`;
@@ -30,6 +32,7 @@ export class Stem {
     this.centroids;
     this.centroid_indexes;
     this.pitch;
+    this.segmentstate = []; //Time segments: undefined, 'loading' or 'loaded'
 
     //onLoaded handler
     this.isLoaded = function() {
@@ -48,80 +51,185 @@ export class Stem {
 
     //Load JSON
     this.json = new Object();
-    this.loadJSON(this.location + this.jsonfile, response => {
+    const parseJSON = response => {
       mythis.json = JSON.parse(response);
 
       //If not all quite samples, load the data file. Otherwise deactivate.
       if(!mythis.json.track.allquietsamples){
-        const oReqs = new XMLHttpRequest();
-        //oReqs.open("GET", `${mythis.location + mythis.json.track.filename}_analysis.data?v=${Math.round(Math.random()*1000)}`, true);
-        oReqs.open("GET", `${mythis.location + mythis.json.track.filename}_analysis.data`, true);
-        oReqs.responseType = "arraybuffer";
-        oReqs.onload = function (oEvent) {
-          if(this.response){
-            mythis.parseData(this.response);
+        //mythis.loadData(`${mythis.location + mythis.json.track.filename}_analysis.data?v=${Math.round(Math.random()*1000)}`, response => {
+        //Versioned by cache key so the server can let browsers cache it for good
+        mythis.loadFile(`${mythis.json.track.filename}_analysis.data`, mythis.json.track.cache_key, response => {
+          const codebook = mythis.json.track.codebook;
+          if(codebook){
+            //Centroids come from the song's shared codebook
+            mythis.loadCodebook(codebook, centroids => {
+              mythis.parseData(response, centroids);
+            });
+          }else{
+            mythis.parseData(response);
           }
-        }
-        oReqs.send(null);
+        }, error => mythis.loadFailed(error));
       }else{
         mythis.active = false;
         setTimeout(() => {
           mythis.isLoaded();
         }, 1000);
       }
-    });
+    };
+
+    if(this.bundle && this.bundle.has(this.jsonfile)){
+      this.bundle.read(this.jsonfile, response => parseJSON(new TextDecoder().decode(response)),
+        () => mythis.loadJSON(mythis.location + mythis.jsonfile, parseJSON));
+    }else{
+      this.loadJSON(this.location + this.jsonfile, parseJSON);
+    }
+  }
+
+  loadCodebook(codebook, callback) {
+    const mythis = this;
+    const file = codebook.file + (codebook.cache_key ? `?v=${codebook.cache_key}` : '');
+
+    //The first stem to ask loads the file, the others wait for it
+    if(!this.codebooks[file]){
+      this.codebooks[file] = new Promise(resolve => {
+        mythis.loadFile(codebook.file, codebook.cache_key, response => {
+          const [count, size] = codebook.centroids;
+          resolve(mythis.splitCentroids(new Uint16Array(response), 0, count, size));
+        });
+      });
+    }
+    this.codebooks[file].then(callback);
   }
 
-  parseData(arrayBuffer) {
+  splitCentroids(data, head, count, size) {
+    const centroids = [];
+    for(let i=0; i<count; i++){
+      centroids[i] = data.subarray(head, head + size);
+      head += size;
+    }
+    return centroids;
+  }
 
-    //Extract data array
+  readSections(arrayBuffer) {
+    //Format 2/3: header, section table, aligned sections (see processor/analysis_format.py)
+    const view = new DataView(arrayBuffer);
+    const magic = String.fromCharCode(...new Uint8Array(arrayBuffer, 0, 4));
+    const version = view.getUint16(4, true);
+    if(magic != 'AVIS' || (version != 2 && version != 3) || view.getUint16(6, true) != 0xFEFF){
+      throw new Error(`${this.name}: unsupported analysis data format`);
+    }
+
+    //Sections are little-endian, like typed arrays on every platform we target
+    const types = {1: Uint8Array, 2: Uint16Array};
+    const sections = {};
+    const count = view.getUint32(8, true);
+    for(let i=0; i<count; i++){
+      const entry = 16 + i * 32;
+      const name = String.fromCharCode(...new Uint8Array(arrayBuffer, entry, 16)).replace(/\0+$/, '');
+      const offset = view.getUint32(entry + 16, true);
+      const length = view.getUint32(entry + 20, true);
+      const section = new types[view.getUint8(entry + 24)](arrayBuffer, offset, length);
+
+      //Delta-encoded section: running sum in place (wraps like the encoder)
+      if(view.getUint8(entry + 25) & 1){
+        for(let j=1; j<section.length; j++){
+          section[j] += section[j-1];
+        }
+      }
+      sections[name] = section;
+    }
+    return sections;
+  }
+
+  readLegacySections(arrayBuffer) {
+    //Format 1: uint16 sections back to back, in the order of the JSON structure
     const data = new Uint16Array(arrayBuffer);
+    const sections = {};
     let head = 0;
-    let splicelen = 0;
+    for(let i=0; i<Object.keys(this.json.structure).length; i++){
+      const [name, [rows, cols]] = Object.entries(this.json.structure[i])[0];
+      sections[name] = data.subarray(head, head + rows * cols);
+      head += rows * cols;
+    }
+    return sections;
+  }
+
+  parseData(arrayBuffer, sharedcentroids) {
 
-    //volume
-    splicelen = this.json.structure[0].volume[0];
-    this.volume = data.slice(head, head + splicelen);
-    head += splicelen;
+    //Extract sections (views into the buffer, not copies)
+    const sections = this.json.track.data_format >= 2 ? this.readSections(arrayBuffer) : this.readLegacySections(arrayBuffer);
 
-    //balance
-    splicelen = this.json.structure[1].balance[0];
-    this.balance = data.slice(head, head + splicelen);
-    head += splicelen;
+    //stft_clusters (empty in the data file with a shared codebook)
+    const [centroidcount, centroidsize] = this.json.structure[3].centroids;
+    this.centroids = sharedcentroids || this.splitCentroids(sections.centroids, 0, centroidcount, centroidsize);
 
-    //width
-    splicelen = this.json.structure[2].width[0];
-    this.width = data.slice(head, head + splicelen);
-    head += splicelen;
+    this.setStaticParameters();
 
-    //stft_clusters
-    splicelen = this.json.structure[3].centroids[1];
-    this.centroids = [];
-    for(let i=0; i<this.json.structure[3].centroids[0]; i++){
-      this.centroids[i] = data.slice(head, head + splicelen);
-      head += splicelen;
+    //Segmented export: the data file only holds the centroids, start once the first segment is in
+    if(this.json.track.segments){
+      this.loadSegment(0, () => this.createObjects(), error => this.loadFailed(error));
+      return;
     }
 
-    //centroid_indexes
-    splicelen = this.json.structure[4].centroid_indexes[0];
-    this.centroid_indexes = data.slice(head, head + splicelen);
-    head += splicelen;
+    this.volume = sections.volume;
+    this.balance = sections.balance;
+    this.width = sections.width;
+
+    //centroid_indexes (uint8 in format 2 files)
+    this.centroid_indexes = sections.centroid_indexes;
 
     //harmonics
-    splicelen = this.json.structure[5].pitch[0];
-    this.pitch = data.slice(head, head + splicelen);
-    head += splicelen;
+    this.pitch = sections.pitch;
 
-    //Static Parameters
+    this.createObjects();
+
+  }
+
+  loadSegment(index, callback, onerror = () => {}) {
+    const mythis = this;
+    const segment = this.json.track.segments[index];
+    if(!segment || this.segmentstate[index]){
+      return;
+    }
+    this.segmentstate[index] = 'loading';
+
+    //Back to not loaded, so the next frame that needs the segment asks for it again
+    const failed = error => {
+      mythis.segmentstate[index] = undefined;
+      console.log(`${mythis.name}: segment ${index} failed to load (${error.message})`);
+      onerror(error);
+    };
+    this.loadFile(segment.file, this.json.track.cache_key, response => {
+      let sections;
+      try {
+        sections = mythis.readSections(response);
+      } catch(error) {
+        failed(error);
+        return;
+      }
+      const structure = Object.assign({}, ...Object.values(mythis.json.structure));
+      for(const name of ['volume', 'balance', 'width', 'centroid_indexes', 'pitch']){
+        //Whole-song arrays, allocated with the first segment's types and filled in as segments arrive
+        if(!mythis[name]){
+          const [rows, cols] = structure[name];
+          mythis[name] = new sections[name].constructor(rows * cols);
+        }
+        mythis[name].set(sections[name], segment.start);
+      }
+      mythis.segmentstate[index] = 'loaded';
+      if(typeof callback === "function"){
+        callback();
+      }
+    }, failed);
+  }
+
+  setStaticParameters() {
     this.fs = this.json.track.fs;
     this.fftsize = this.json.track.stft_size;
     this.binratio = this.fs/this.fftsize;
     this.multiplyer = this.json.track.byte_num_range; //255, 65535
     this.factor = 100000;
     this.maxvolume = this.json.track.maxvolume;
-
-    this.createObjects();
-
   }
 
   createObjects() {
@@ -195,6 +303,16 @@ export class Stem {
     this.frame = frame;
     if(this.active){
 
+      //Segmented export: fetch the current and next segments, skip frames that aren't in yet
+      if(this.json.track.segments){
+        const segment = Math.floor(this.frame / this.json.track.segment_frames);
+        this.loadSegment(segment);
+        this.loadSegment(segment + 1);
+        if(this.segmentstate[segment] != 'loaded'){
+          return;
+        }
+      }
+
       //Update models
       this.triangles.updateTriangles();
       this.spectrum.updateSpectrum();
@@ -233,6 +351,40 @@ export class Stem {
     }
   }
 
+  loadFile(name, version, callback, onerror = () => {}) {
+    //From the song bundle when it has the file, otherwise (or if that read fails) on its own, versioned for caching
+    const file = this.location + name + (version ? `?v=${version}` : '');
+    if(this.bundle && this.bundle.has(name)){
+      this.bundle.read(name, callback, () => this.loadData(file, callback, onerror));
+    }else{
+      this.loadData(file, callback, onerror);
+    }
+  }
+
+  loadData(file, callback, onerror = () => {}) {
+    const oReqs = new XMLHttpRequest();
+    oReqs.open("GET", file, true);
+    oReqs.responseType = "arraybuffer";
+    oReqs.onload = function (oEvent) {
+      if(this.status != 200 || !this.response){
+        onerror(new Error(`${file}: request failed with status ${this.status}`));
+      }else{
+        callback(this.response);
+      }
+    }
+    oReqs.onerror = function () {
+      onerror(new Error(`${file}: request failed`));
+    }
+    oReqs.send(null);
+  }
+
+  loadFailed(error) {
+    //Without its data the stem can't be shown: leave it out, like an all quiet stem, so the song still loads
+    console.log(`${this.name}: ${error.message}, stem left out`);
+    this.active = false;
+    this.isLoaded();
+  }
+
   loadJSON(file, callback) {
     const xobj = new XMLHttpRequest();
     xobj.overrideMimeType("application/json");